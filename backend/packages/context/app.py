@@ -1,9 +1,27 @@
+import asyncio
 import logging
 from fastapi import FastAPI
 from .socket import socket_app
-from .db import shutdown_db_client, ensure_indexes
+from .db import client, shutdown_db_client, ensure_indexes, prewarm_pool
+from .gateway import razorpay_client
+from .slow_queries import slow_queries
+from .loop_monitor import run_loop_monitor
+from .order_events import order_events
+from .logs import adopt_server_loggers, configure_logging, stop_logging
+from .tracing import exporter as trace_exporter
 from ..middleware.cors import apply_cors
+from ..middleware.idempotency import apply_idempotency
+from ..middleware.admission import apply_admission
+from ..middleware.rate_limit import apply_rate_limit
+from ..middleware.metrics import apply_metrics
+from ..middleware.request_context import apply_request_context
+from ..middleware.profiling import apply_profiling
+from ..middleware.tracing import apply_tracing
 from ..routes.index import api_router
+from ..routes.metrics import router as metrics_router
+from ..cron.payment_events import run_payment_events_worker
+from ..cron.outbox_relay import run_outbox_relay
+from ..cron.reconcile import RECONCILE_INTERVAL_MINUTES, RECONCILE_SETTLEMENT_PATH, run_reconciliation_schedule
 
 
 def create_app() -> FastAPI:
@@ -11,25 +29,62 @@ def create_app() -> FastAPI:
 
     # Include routers
     app.include_router(api_router)
+    app.include_router(metrics_router)
 
     # Mount Socket.IO
     app.mount("/socket.io", socket_app)
 
-    # Middleware
+    # Middleware (the last one applied runs outermost)
+    apply_idempotency(app)
+    apply_admission(app)
+    apply_rate_limit(app)
     apply_cors(app)
+    apply_request_context(app)
+    apply_profiling(app)
+    apply_tracing(app)
+    apply_metrics(app)
 
     # Logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    configure_logging()
+
+    background_tasks = []
 
     @app.on_event("startup")
     async def _startup():
+        adopt_server_loggers()
+        slow_queries.bind(asyncio.get_running_loop(), client)
+        background_tasks.append(asyncio.create_task(run_loop_monitor()))
         await ensure_indexes()
+        try:
+            await prewarm_pool()
+        except Exception as e:
+            logging.getLogger(__name__).warning("MongoDB pool pre-warm failed: %s", e)
+        background_tasks.append(asyncio.create_task(run_payment_events_worker()))
+        background_tasks.append(asyncio.create_task(run_outbox_relay()))
+        if RECONCILE_SETTLEMENT_PATH and RECONCILE_INTERVAL_MINUTES > 0:
+            background_tasks.append(asyncio.create_task(run_reconciliation_schedule()))
+
+    @app.on_event("shutdown")
+    async def _stop_background_tasks():
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+
+    @app.on_event("shutdown")
+    async def _flush_order_events():
+        await order_events.flush_all()
 
     @app.on_event("shutdown")
     async def _shutdown_db_client():
         await shutdown_db_client()
 
+    @app.on_event("shutdown")
+    async def _shutdown_gateway_client():
+        await razorpay_client.close()
+
+    @app.on_event("shutdown")
+    async def _stop_logging():
+        trace_exporter.close()
+        stop_logging()
+
     return app
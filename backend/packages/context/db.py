@@ -1,7 +1,10 @@
 from pathlib import Path
 import os
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import read_preferences
+from pymongo.read_concern import ReadConcern
+import asyncio
 
 # Load env from backend/.env
 ROOT_DIR = Path(__file__).resolve().parents[2]
@@ -10,6 +13,14 @@ load_dotenv(ROOT_DIR / '.env')
 # Use environment variables for credentials/host and database
 import logging
 from pymongo.errors import OperationFailure
+from .indexes import INDEX_EXPLAIN_CHECK, check_query_plans, sync_indexes
+from .metrics import (
+    MONGO_POOL_CHECKOUT_WAIT, MONGO_POOL_CONNECTIONS, MONGO_POOL_IN_USE,
+    CommandMetricsListener, PoolMetricsListener,
+)
+from .mongo_settings import MongoSettings, ReadProfile
+from .slow_queries import SlowQueryListener
+from .tracing import TracingCommandListener
 
 # Support several common env names so the project works with different setups:
 # - MONGO_URI or MONGO_URL for the connection string
@@ -19,35 +30,126 @@ MONGO_DB = os.getenv("MONGO_DB") or os.getenv("DB_NAME") or os.getenv("MONGO_DB_
 
 logger = logging.getLogger(__name__)
 
-client = AsyncIOMotorClient(MONGO_URI)
+mongo_settings = MongoSettings.from_env()
+client = AsyncIOMotorClient(
+    MONGO_URI,
+    event_listeners=[CommandMetricsListener(), PoolMetricsListener(), SlowQueryListener(), TracingCommandListener()],
+    **mongo_settings.client_options(),
+)
 db = client[MONGO_DB]
+_index_build_task = None
+
+_READ_PREFERENCE_CLASSES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+def read_profile_options(profile: ReadProfile):
+    """`get_database` keyword arguments for a read profile."""
+    options = {}
+    if profile.read_preference == "primary":
+        options["read_preference"] = read_preferences.Primary()
+    elif profile.read_preference is not None:
+        staleness = profile.max_staleness_seconds or -1
+        options["read_preference"] = _READ_PREFERENCE_CLASSES[profile.read_preference](max_staleness=staleness)
+    if profile.read_concern is not None:
+        options["read_concern"] = ReadConcern(profile.read_concern)
+    return options
+
+_profile_dbs = {"primary": db}
+_profile_dbs.update({
+    name: client.get_database(MONGO_DB, **read_profile_options(profile))
+    for name, profile in mongo_settings.read_profiles.items()
+})
+
+def get_db(profile: str = "primary") -> AsyncIOMotorDatabase:
+    """Database handle carrying the read preference and read concern of a
+    read profile from MongoSettings. Writes and read-your-writes paths (cart,
+    orders, payments) use the primary handle, `db`."""
+    return _profile_dbs[profile]
 
 async def shutdown_db_client():
     client.close()
 
+async def prewarm_pool():
+    """Open minPoolSize connections before serving traffic.
+
+    pymongo fills the pool to minPoolSize from its background maintenance
+    task; concurrent pings make it open connections now, and we wait (up to
+    MONGO_PREWARM_TIMEOUT_SECONDS) until the pool reports them.
+    """
+    target = client.options.pool_options.min_pool_size
+    if not target:
+        return
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(target)))
+    deadline = asyncio.get_running_loop().time() + mongo_settings.prewarm_timeout_seconds
+    while sum(MONGO_POOL_CONNECTIONS.samples().values()) < target:
+        if asyncio.get_running_loop().time() > deadline:
+            logger.warning("MongoDB pool pre-warm timed out at %d/%d connections",
+                           sum(MONGO_POOL_CONNECTIONS.samples().values()), target)
+            return
+        await asyncio.sleep(0.05)
+    logger.info("MongoDB pool pre-warmed to %d connections", target)
+
+def pool_stats():
+    """Effective pool configuration and per-server connection usage."""
+    options = client.options.pool_options
+    in_use = MONGO_POOL_IN_USE.samples()
+    checkouts, wait_seconds = MONGO_POOL_CHECKOUT_WAIT.summary()
+    return {
+        "max_pool_size": options.max_pool_size,
+        "min_pool_size": options.min_pool_size,
+        "max_idle_time_seconds": options.max_idle_time_seconds,
+        "wait_queue_timeout_seconds": options.wait_queue_timeout,
+        "max_connecting": options.max_connecting,
+        "compressors": list(mongo_settings.compressors),
+        "read_preference": client.read_preference.mongos_mode,
+        "read_profiles": {
+            name: {
+                "read_preference": profile_db.read_preference.mongos_mode,
+                "max_staleness_seconds": profile_db.read_preference.max_staleness,
+                "read_concern": profile_db.read_concern.level,
+            }
+            for name, profile_db in _profile_dbs.items()
+        },
+        "servers": {
+            address: {"connections": int(count), "in_use": int(in_use.get((address,), 0))}
+            for (address,), count in MONGO_POOL_CONNECTIONS.samples().items()
+        },
+        "checkouts": checkouts,
+        "avg_checkout_wait_ms": round(wait_seconds / checkouts * 1000, 3) if checkouts else 0.0,
+    }
+
+async def _build_indexes():
+    created = await sync_indexes(db)
+    logger.info("MongoDB indexes in sync (%d built)", len(created))
+
+def _log_index_build(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error("Background index build failed: %s", task.exception())
+
 async def ensure_indexes():
-    """Create required indexes. If the server requires authentication but
-    the connection string lacks credentials, skip index creation for development.
+    """Build the indexes declared through the index registry. If the server
+    requires authentication but the connection string lacks credentials, skip
+    index creation for development.
+
+    Builds run in the background so startup is not held up by large
+    collections; with INDEX_EXPLAIN_CHECK=1 they are awaited and every
+    registered query shape is checked for collection scans.
     """
+    global _index_build_task
     try:
         # Test connection first
         await client.admin.command('ping')
-        
-        await db.users.create_index("username", unique=True)
-        await db.users.create_index("id", unique=True)
-        await db.pharmacies.create_index("id", unique=True)
-        await db.medicines.create_index("id", unique=True)
-        await db.medicines.create_index("pharmacy_id")
-
-        await db.carts.create_index("user_id", unique=True)
-        await db.orders.create_index("id", unique=True)
-        await db.orders.create_index("user_id")
-        await db.addresses.create_index("id", unique=True)
-        await db.reviews.create_index("id", unique=True)
-        await db.lab_tests.create_index("id", unique=True)
-        await db.consultations.create_index("id", unique=True)
-        
-        logger.info("MongoDB indexes created successfully")
+
+        if INDEX_EXPLAIN_CHECK:
+            await _build_indexes()
+        else:
+            _index_build_task = asyncio.create_task(_build_indexes())
+            _index_build_task.add_done_callback(_log_index_build)
         
     except OperationFailure as e:
         logger.error("MongoDB operation failed: %s", e)
@@ -76,3 +178,6 @@ async def ensure_indexes():
             "Cannot connect to MongoDB. Please ensure MongoDB is running and "
             f"connection details are correct. Connection string: {MONGO_URI}"
         ) from e
+
+    if INDEX_EXPLAIN_CHECK:
+        await check_query_plans(db)
@@ -0,0 +1,117 @@
+"""Versioned ETags and conditional GETs for catalog endpoints.
+
+Each catalog collection has a change counter in `collection_versions`,
+bumped by every writer (`bump_versions`). Writes that touch only part of a
+collection bump scoped counters instead (`scope("medicines", "pharmacy",
+pharmacy_id)`), so a stock change retires the ETags of one pharmacy's list
+and the medicines it sold rather than every medicine response. A catalog
+response's ETag is derived from the counters it depends on, so checking
+`If-None-Match` takes a single `_id` lookup: a match answers 304 before the
+payload is read or serialized. The counter document also carries a random
+epoch, so a wiped and re-seeded database never revalidates ETags issued
+before the wipe.
+
+Versions and data are both read through the catalog profile, which may hit
+different secondaries. The data read runs in a causally consistent session
+advanced past the version read, so a body is never older than its ETag.
+
+Bodies that do need building go through `catalog_cache`: concurrent
+identical requests share one query and one serialized buffer, which is then
+reused for CATALOG_RESPONSE_CACHE_TTL_SECONDS. The cache key includes the
+ETag, so a version bump from any worker retires old entries, and local
+writers also drop them eagerly.
+"""
+from typing import Any, Awaitable, Callable, Optional, Sequence, Tuple
+import hashlib
+import os
+import uuid
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from .db import client, db, get_db
+from .serialization import dump_json
+from ..dyna_modules.cache import CoalescingCache
+
+CATALOG_CACHE_CONTROL = os.getenv("CATALOG_CACHE_CONTROL", "public, max-age=0, must-revalidate")
+CATALOG_RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_RESPONSE_CACHE_TTL_SECONDS", 10))
+CATALOG_RESPONSE_CACHE_MAX_BYTES = int(os.getenv("CATALOG_RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+catalog_cache = CoalescingCache("catalog", CATALOG_RESPONSE_CACHE_TTL_SECONDS, CATALOG_RESPONSE_CACHE_MAX_BYTES)
+
+catalog_db = get_db("catalog")
+
+
+def scope(collection: str, *parts: str) -> str:
+    """Version key for the part of `collection` identified by `parts`."""
+    return ":".join((collection, *parts))
+
+
+async def bump_versions(*collections: str) -> None:
+    """Invalidate the ETags and cached bodies of responses built from
+    `collections` (collection names or `scope` keys)."""
+    catalog_cache.invalidate(*collections)
+    for name in collections:
+        await db.collection_versions.update_one(
+            {"_id": name},
+            {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex}},
+            upsert=True,
+        )
+
+
+_CausalTimes = Tuple[Optional[Any], Optional[Any]]
+
+
+async def catalog_etag(collections: Sequence[str]) -> Tuple[str, _CausalTimes]:
+    """The ETag for `collections`, plus the session's (cluster, operation)
+    time for reading data at least as fresh as it."""
+    async with await client.start_session(causal_consistency=True) as session:
+        docs = await catalog_db.collection_versions.find(
+            {"_id": {"$in": list(collections)}}, session=session
+        ).to_list(None)
+        times = (session.cluster_time, session.operation_time)
+    versions = {d["_id"]: f"{d.get('epoch', '')}.{d.get('version', 0)}" for d in docs}
+    key = "|".join(f"{name}={versions.get(name, '0')}" for name in sorted(collections))
+    return 'W/"%s"' % hashlib.sha1(key.encode()).hexdigest()[:20], times
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+
+
+async def catalog_response(request: Request, collections: Sequence[str],
+                           load: Callable[[Any], Awaitable[Any]]) -> Response:
+    """Answer a catalog GET whose body `load(session)` builds from
+    `collections`: 304 on a matching If-None-Match, otherwise the (shared,
+    cached) JSON. `load` must pass `session` to its reads."""
+    etag, (cluster_time, operation_time) = await catalog_etag(collections)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=_cache_headers(etag))
+
+    async def build() -> bytes:
+        # A fresh session: this load may be shared by, and outlive, the request
+        async with await client.start_session(causal_consistency=True) as session:
+            if cluster_time is not None:
+                session.advance_cluster_time(cluster_time)
+            if operation_time is not None:
+                session.advance_operation_time(operation_time)
+            return dump_json(await load(session))
+
+    key = (etag, request.url.path, tuple(sorted(request.query_params.multi_items())))
+    body = await catalog_cache.get_or_load(key, build, collections)
+    return Response(body, media_type="application/json", headers=_cache_headers(etag))
@@ -0,0 +1,217 @@
+"""Non-blocking Razorpay client.
+
+Talks to the Razorpay REST API over a pooled keep-alive httpx session instead
+of the synchronous SDK, so a slow gateway only delays the request waiting on
+it. Calls are bounded by timeouts, retried with full-jitter backoff and
+guarded by a circuit breaker that fails fast while the gateway is down.
+
+Point RAZORPAY_API_BASE at `python -m packages.iife.razorpay_stub` to run
+against a local stub gateway.
+"""
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+
+from .tracing import KIND_CLIENT, start_span
+
+logger = logging.getLogger(__name__)
+
+RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID", "rzp_test_123456789")
+RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET", "test_secret_key_123456789")
+# No default: webhooks are refused until a secret is configured
+RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET", "")
+RAZORPAY_API_BASE = os.getenv("RAZORPAY_API_BASE", "https://api.razorpay.com/v1")
+
+GATEWAY_TIMEOUT_SECONDS = float(os.getenv("GATEWAY_TIMEOUT_SECONDS", 10))
+GATEWAY_CONNECT_TIMEOUT_SECONDS = float(os.getenv("GATEWAY_CONNECT_TIMEOUT_SECONDS", 3))
+GATEWAY_MAX_CONNECTIONS = int(os.getenv("GATEWAY_MAX_CONNECTIONS", 50))
+GATEWAY_MAX_RETRIES = int(os.getenv("GATEWAY_MAX_RETRIES", 2))
+GATEWAY_BACKOFF_BASE_SECONDS = float(os.getenv("GATEWAY_BACKOFF_BASE_SECONDS", 0.2))
+GATEWAY_BREAKER_THRESHOLD = int(os.getenv("GATEWAY_BREAKER_THRESHOLD", 5))
+GATEWAY_BREAKER_RESET_SECONDS = float(os.getenv("GATEWAY_BREAKER_RESET_SECONDS", 30))
+
+# Errors raised before the request reached the gateway; safe to retry for any method
+_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+_RETRYABLE_STATUSES = {429, 502, 503, 504}
+# Statuses meaning the gateway refused the request without processing it
+_REJECTED_STATUSES = {429, 503}
+
+
+class GatewayError(Exception):
+    """The gateway rejected the request or returned an unusable response."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class GatewayUnavailable(GatewayError):
+    """The gateway could not be reached, or the circuit breaker is open.
+
+    `retry_after` is the number of seconds until a retry can succeed: what is
+    left of the breaker's open period, or the gateway's own Retry-After."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message, status_code)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe.
+
+    Letting the probe through re-arms the open timer, so a probe that never
+    reports back (e.g. a cancelled request) just delays the next one.
+    """
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def remaining_open_seconds(self) -> Optional[float]:
+        """Seconds until the breaker lets a probe through, or None when closed."""
+        if self.opened_at is None:
+            return None
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "half_open":
+            self.opened_at = time.monotonic()
+        return state != "open"
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class RazorpayClient:
+    def __init__(self, key_id: str, key_secret: str, base_url: str = RAZORPAY_API_BASE,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.key_id = key_id
+        self._auth = (key_id, key_secret)
+        self._base_url = base_url.rstrip("/")
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self.breaker = CircuitBreaker(GATEWAY_BREAKER_THRESHOLD, GATEWAY_BREAKER_RESET_SECONDS)
+
+    def _http(self) -> httpx.AsyncClient:
+        # Created lazily so the session binds to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self._base_url,
+                auth=self._auth,
+                transport=self._transport,
+                timeout=httpx.Timeout(GATEWAY_TIMEOUT_SECONDS, connect=GATEWAY_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(
+                    max_connections=GATEWAY_MAX_CONNECTIONS,
+                    max_keepalive_connections=GATEWAY_MAX_CONNECTIONS,
+                    keepalive_expiry=60,
+                ),
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def create_order(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._request("POST", "/orders", json=payload)
+
+    async def fetch_order(self, razorpay_order_id: str) -> Dict[str, Any]:
+        return await self._request("GET", f"/orders/{razorpay_order_id}")
+
+    async def fetch_order_payments(self, razorpay_order_id: str) -> Dict[str, Any]:
+        return await self._request("GET", f"/orders/{razorpay_order_id}/payments")
+
+    async def _request(self, method: str, path: str, **kwargs: Any) -> Dict[str, Any]:
+        with start_span(f"razorpay {method}", KIND_CLIENT, **{"http.method": method, "http.target": path}) as span:
+            return await self._attempt(method, path, span, **kwargs)
+
+    async def _attempt(self, method: str, path: str, span, **kwargs: Any) -> Dict[str, Any]:
+        if not self.breaker.allow():
+            raise GatewayUnavailable(
+                "Payment gateway temporarily unavailable", retry_after=self.breaker.remaining_open_seconds()
+            )
+
+        # Creating orders is not idempotent, so POSTs are only retried when the
+        # gateway provably did not process the request.
+        idempotent = method == "GET"
+        attempt = 0
+        while True:
+            span.set_attribute("razorpay.attempts", attempt + 1)
+            try:
+                response = await self._http().request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                retryable = idempotent or isinstance(e, _CONNECT_ERRORS)
+                if retryable and attempt < GATEWAY_MAX_RETRIES:
+                    attempt += 1
+                    await self._backoff(attempt)
+                    continue
+                self.breaker.record_failure()
+                raise GatewayUnavailable(
+                    f"Payment gateway unreachable: {e.__class__.__name__}",
+                    retry_after=self.breaker.remaining_open_seconds(),
+                ) from e
+
+            if response.status_code in _RETRYABLE_STATUSES:
+                retryable = idempotent or response.status_code in _REJECTED_STATUSES
+                if retryable and attempt < GATEWAY_MAX_RETRIES:
+                    attempt += 1
+                    await self._backoff(attempt, response.headers.get("Retry-After"))
+                    continue
+                self.breaker.record_failure()
+                retry_after = response.headers.get("Retry-After", "")
+                raise GatewayUnavailable(
+                    f"Payment gateway returned {response.status_code}",
+                    response.status_code,
+                    retry_after=self.breaker.remaining_open_seconds()
+                    or (float(retry_after) if retry_after.isdigit() else None),
+                )
+
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+                raise GatewayError(f"Payment gateway returned {response.status_code}", response.status_code)
+
+            self.breaker.record_success()
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 400:
+                raise GatewayError(_error_description(response), response.status_code)
+            return response.json()
+
+    async def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> None:
+        delay = random.uniform(0, GATEWAY_BACKOFF_BASE_SECONDS * 2 ** attempt)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), GATEWAY_TIMEOUT_SECONDS))
+        logger.warning("Retrying payment gateway call (attempt %d) in %.2fs", attempt, delay)
+        await asyncio.sleep(delay)
+
+
+def _error_description(response: httpx.Response) -> str:
+    try:
+        return response.json()["error"]["description"]
+    except (ValueError, KeyError, TypeError):
+        return f"Payment gateway returned {response.status_code}"
+
+
+razorpay_client = RazorpayClient(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET)
@@ -0,0 +1,105 @@
+"""Declarative index registry.
+
+Modules declare the indexes their queries need next to the queries
+themselves, using `register_indexes(Index(...), ...)`. At startup
+`sync_indexes` diffs the registry against the live collections and builds
+only what is missing. With INDEX_EXPLAIN_CHECK=1 every registered query shape
+is explained afterwards and startup fails if any of them plans a COLLSCAN.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+INDEX_EXPLAIN_CHECK = os.getenv("INDEX_EXPLAIN_CHECK", "0") == "1"
+
+KeySpec = List[Tuple[str, int]]
+
+
+class Index:
+    """One index plus, optionally, the query shape it exists to serve."""
+
+    def __init__(
+        self,
+        collection: str,
+        keys: Union[str, Sequence[Tuple[str, int]]],
+        query: Optional[Dict[str, Any]] = None,
+        sort: Optional[Sequence[Tuple[str, int]]] = None,
+        **options: Any,
+    ):
+        self.collection = collection
+        self.keys: KeySpec = [(keys, 1)] if isinstance(keys, str) else [tuple(k) for k in keys]
+        self.query = query
+        self.sort = list(sort) if sort else None
+        self.options = options
+
+    def __repr__(self):
+        return f"Index({self.collection}, {self.keys}, {self.options})"
+
+
+_registry: List[Index] = []
+
+
+def register_indexes(*indexes: Index) -> None:
+    for index in indexes:
+        if not any(i.collection == index.collection and i.keys == index.keys for i in _registry):
+            _registry.append(index)
+
+
+def registered_indexes() -> List[Index]:
+    return list(_registry)
+
+
+async def missing_indexes(db) -> List[Index]:
+    """Registered indexes whose key pattern does not exist on the live collection."""
+    by_collection: Dict[str, List[Index]] = {}
+    for index in _registry:
+        by_collection.setdefault(index.collection, []).append(index)
+
+    missing = []
+    for collection, indexes in by_collection.items():
+        live = await db[collection].index_information()
+        live_keys = {tuple(tuple(k) for k in info["key"]): info for info in live.values()}
+        for index in indexes:
+            info = live_keys.get(tuple(index.keys))
+            if info is None:
+                missing.append(index)
+            elif index.options.get("unique", False) != info.get("unique", False):
+                logger.warning("Index %s exists with different options; leaving it unchanged", index)
+    return missing
+
+
+async def sync_indexes(db) -> List[Index]:
+    """Build every missing registered index. Existing indexes are never dropped."""
+    missing = await missing_indexes(db)
+    for index in missing:
+        logger.info("Building missing index %s", index)
+        await db[index.collection].create_index(index.keys, **index.options)
+    return missing
+
+
+def _stages(plan: Dict[str, Any]):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+async def check_query_plans(db) -> None:
+    """Explain each registered query shape and raise if any uses a COLLSCAN."""
+    offenders = []
+    for index in _registry:
+        if index.query is None:
+            continue
+        cursor = db[index.collection].find(index.query)
+        if index.sort:
+            cursor = cursor.sort(index.sort)
+        explain = await cursor.explain()
+        winning_plan = explain["queryPlanner"]["winningPlan"]
+        if "COLLSCAN" in set(_stages(winning_plan)):
+            offenders.append(f"{index.collection}: {index.query} sort={index.sort}")
+    if offenders:
+        raise RuntimeError("Registered queries use a collection scan:\n  " + "\n  ".join(offenders))
@@ -0,0 +1,90 @@
+"""Request-scoped batching loaders (DataLoader style).
+
+`loader.load(id)` does not query right away: ids requested in the same
+event-loop tick are collected and fetched with one `{field: {"$in": ids}}`
+query when the tick ends, and every result is cached for the rest of the
+request. Handlers get a fresh `Loaders` per request through the
+`request_loaders` dependency, then either await `load_many(ids)` or
+`asyncio.gather` several `load` calls; a loop that awaits `load` one id at a
+time still runs one query per id, but repeated ids are served from the cache.
+"""
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+import asyncio
+
+from .db import get_db
+from .metrics import Histogram
+
+LOADER_BATCH_SIZE = Histogram(
+    "loader_batch_size", "Ids fetched per batched loader query", ("collection",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 500),
+)
+
+
+class Loader:
+    def __init__(self, collection, field: str = "id", fields: Optional[Sequence[str]] = None):
+        self.collection = collection
+        self.field = field
+        self.projection = {"_id": 0, **{f: 1 for f in fields}, field: 1} if fields else {"_id": 0}
+        self._cache: Dict[Hashable, asyncio.Future] = {}
+        self._pending: List[Hashable] = []
+
+    def load(self, key: Hashable) -> "asyncio.Future[Optional[Dict[str, Any]]]":
+        """Future resolving to the document whose `field` equals `key`, or None."""
+        future = self._cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._cache[key] = loop.create_future()
+            if not self._pending:
+                loop.call_soon(self._dispatch)
+            self._pending.append(key)
+        return future
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Optional[Dict[str, Any]]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: Hashable, doc: Optional[Dict[str, Any]]) -> None:
+        """Seed the cache with a document the handler already has."""
+        if key not in self._cache:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(doc)
+            self._cache[key] = future
+
+    def _dispatch(self) -> None:
+        keys, self._pending = self._pending, []
+        asyncio.ensure_future(self._fetch(keys))
+
+    async def _fetch(self, keys: List[Hashable]) -> None:
+        LOADER_BATCH_SIZE.observe(len(keys), self.collection.name)
+        try:
+            docs = await self.collection.find({self.field: {"$in": keys}}, self.projection).to_list(None)
+        except Exception as e:
+            for key in keys:
+                future = self._cache.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        found = {doc.get(self.field): doc for doc in docs}
+        for key in keys:
+            future = self._cache[key]
+            if not future.done():
+                future.set_result(found.get(key))
+
+
+class Loaders:
+    """One `Loader` per (read profile, collection, field, projection), created on first use."""
+
+    def __init__(self):
+        self._loaders: Dict[Tuple, Loader] = {}
+
+    def get(self, collection: str, field: str = "id", fields: Optional[Sequence[str]] = None,
+            profile: str = "primary") -> Loader:
+        key = (profile, collection, field, tuple(fields) if fields else None)
+        loader = self._loaders.get(key)
+        if loader is None:
+            loader = self._loaders[key] = Loader(get_db(profile)[collection], field, fields)
+        return loader
+
+
+async def request_loaders() -> Loaders:
+    """FastAPI dependency; FastAPI resolves it once per request."""
+    return Loaders()
@@ -0,0 +1,176 @@
+"""Queue-based structured logging.
+
+Logging calls never wait on I/O: `QueueHandler` puts records on a bounded
+queue (records are dropped and counted when it is full), and a
+`QueueListener` thread writes them as JSON lines to stderr and to a rotating
+file. Every record carries the request id and route of the request
+that logged it, read from `request_context` when the record is enqueued.
+
+High-volume events (socket connects and the like) go through `EventLogger`,
+which samples them (LOG_SAMPLE_RATES, e.g. "socket.connect=0.1") and
+rate-limits each event name to LOG_EVENT_RATE_PER_SECOND, reporting how many
+were suppressed on the next one it lets through.
+"""
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Optional
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+
+from .metrics import Counter
+from .request_context import current_request_id, current_route
+from .tracing import current_trace_id
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "logs/app.log")
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", 50 * 1024 * 1024))
+LOG_FILE_BACKUPS = int(os.getenv("LOG_FILE_BACKUPS", 5))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_EVENT_RATE_PER_SECOND = float(os.getenv("LOG_EVENT_RATE_PER_SECOND", 20))
+LOG_SAMPLE_RATES: Dict[str, float] = {
+    name.strip(): float(rate)
+    for name, _, rate in (item.partition("=") for item in os.getenv("LOG_SAMPLE_RATES", "").split(","))
+    if name.strip() and rate
+}
+
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _ContextQueueHandler(QueueHandler):
+    """Enqueues without blocking and stamps request context on the caller's side."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = current_request_id()
+        record.route = current_route()
+        record.trace_id = current_trace_id()
+        # Format args and tracebacks now; the record is read on another thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging() -> None:
+    """Route the root logger through the queue. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+    if LOG_FORMAT == "json":
+        formatter: logging.Formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s")
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if LOG_FILE_PATH:
+        path = Path(LOG_FILE_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handlers.append(RotatingFileHandler(path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_ContextQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def adopt_server_loggers() -> None:
+    """Send uvicorn's loggers through the queue as well; uvicorn installs its
+    own stream handlers when it starts, after the app was created."""
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        server_logger = logging.getLogger(name)
+        server_logger.handlers = []
+        server_logger.propagate = True
+
+
+def stop_logging() -> None:
+    """Flush queued records; called on shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class EventLogger:
+    """Sampled, rate-limited structured events for one logger."""
+
+    def __init__(self, name: str, rate_per_second: float = LOG_EVENT_RATE_PER_SECOND):
+        self.logger = logging.getLogger(name)
+        self.rate_per_second = rate_per_second
+        # event -> [tokens, last refill, suppressed since last emit]
+        self._buckets: Dict[str, list] = {}
+
+    def log(self, level: int, event: str, **fields: Any) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        sample_rate = LOG_SAMPLE_RATES.get(event, 1.0)
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(event)
+        if bucket is None:
+            bucket = self._buckets[event] = [self.rate_per_second, now, 0]
+        bucket[0] = min(self.rate_per_second, bucket[0] + (now - bucket[1]) * self.rate_per_second)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return
+        bucket[0] -= 1
+        extra = {"event": event, **fields}
+        if sample_rate < 1.0:
+            extra["sample_rate"] = sample_rate
+        if bucket[2]:
+            extra["suppressed"] = bucket[2]
+            bucket[2] = 0
+        self.logger.log(level, event, extra=extra)
+
+    def debug(self, event: str, **fields: Any) -> None:
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields: Any) -> None:
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self.log(logging.WARNING, event, **fields)
@@ -0,0 +1,116 @@
+"""Event-loop lag monitor and blocking-call detector.
+
+`run_loop_monitor` sleeps for LOOP_MONITOR_INTERVAL_MS at a time and records
+how late each wake-up is in `event_loop_lag_seconds`. Every tick also
+refreshes a heartbeat that a watchdog thread checks. When the heartbeat is
+older than LOOP_BLOCK_THRESHOLD_MS, something is holding the loop: the
+watchdog takes the loop thread's current stack from `sys._current_frames()`
+while the blocking call is still running, logs it and keeps it for
+`GET /api/admin/loop-stalls`.
+
+LOOP_DEBUG=1 additionally turns on asyncio debug mode with
+`slow_callback_duration` set to LOOP_SLOW_CALLBACK_MS, so asyncio logs every
+callback or task step that runs longer than that. Debug mode has overhead of
+its own and is meant for staging.
+"""
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from .metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", 100))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", 250))
+LOOP_STALL_HISTORY = int(os.getenv("LOOP_STALL_HISTORY", 50))
+LOOP_DEBUG = os.getenv("LOOP_DEBUG", "0").lower() in ("1", "true", "yes")
+LOOP_SLOW_CALLBACK_MS = float(os.getenv("LOOP_SLOW_CALLBACK_MS", 100))
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay between a scheduled loop wake-up and when it ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+EVENT_LOOP_LAG_LAST = Gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+EVENT_LOOP_STALLS = Counter("event_loop_stalls_total", "Times the loop was blocked past LOOP_BLOCK_THRESHOLD_MS")
+
+
+class _Watchdog(threading.Thread):
+    def __init__(self, loop: asyncio.AbstractEventLoop, loop_thread_id: int):
+        super().__init__(name="loop-watchdog", daemon=True)
+        self.loop = loop
+        self.loop_thread_id = loop_thread_id
+        self.heartbeat = time.monotonic()
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=LOOP_STALL_HISTORY)
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        # A stall is reported once, when first seen; the next one needs a fresh heartbeat
+        reported_heartbeat = None
+        limit = (LOOP_MONITOR_INTERVAL_MS + LOOP_BLOCK_THRESHOLD_MS) / 1000
+        while not self._stopped.wait(LOOP_MONITOR_INTERVAL_MS / 2000):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat
+            if blocked > limit and heartbeat != reported_heartbeat:
+                reported_heartbeat = heartbeat
+                self._capture(blocked)
+
+    def _capture(self, blocked: float) -> None:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        task = asyncio.tasks._current_tasks.get(self.loop)
+        stall = {
+            "at": time.time(),
+            "blocked_ms": round(blocked * 1000, 1),
+            "task": task.get_name() if task is not None else None,
+            "coroutine": getattr(task.get_coro(), "__qualname__", None) if task is not None else None,
+            "stack": [line.rstrip() for line in stack],
+        }
+        self.stalls.append(stall)
+        EVENT_LOOP_STALLS.inc()
+        logger.warning(
+            "Event loop blocked for %.0f ms in %s:\n%s",
+            stall["blocked_ms"], stall["coroutine"] or "a callback", "".join(stack[-12:]),
+        )
+
+
+_watchdog: Optional[_Watchdog] = None
+
+
+async def run_loop_monitor() -> None:
+    global _watchdog
+    loop = asyncio.get_running_loop()
+    if LOOP_DEBUG:
+        loop.set_debug(True)
+        loop.slow_callback_duration = LOOP_SLOW_CALLBACK_MS / 1000
+        logging.getLogger("asyncio").setLevel(logging.WARNING)
+
+    _watchdog = _Watchdog(loop, threading.get_ident())
+    _watchdog.start()
+    interval = LOOP_MONITOR_INTERVAL_MS / 1000
+    try:
+        while True:
+            scheduled = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(loop.time() - scheduled, 0.0)
+            EVENT_LOOP_LAG.observe(lag)
+            EVENT_LOOP_LAG_LAST.set(lag)
+            _watchdog.heartbeat = time.monotonic()
+    finally:
+        _watchdog.stop()
+
+
+def recent_stalls(limit: int = 20) -> List[Dict[str, Any]]:
+    """Most recent stalls first."""
+    if _watchdog is None:
+        return []
+    return list(reversed(_watchdog.stalls))[:limit]
@@ -0,0 +1,235 @@
+"""In-process metrics exposed in the Prometheus text format at `/metrics`.
+
+Deliberately small: counters, gauges and fixed-bucket histograms keyed by
+label tuples, cheap enough to record on every request. Metrics updated from
+pymongo's monitoring threads are created with `threadsafe=True` and take a
+per-metric lock; the rest are only touched from the event loop and skip it.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+import threading
+import time
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), threadsafe: bool = False):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock() if threadsafe else None
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        if self._lock is None:
+            self._values[labels] = self._values.get(labels, 0) + amount
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Dict[Tuple[str, ...], float]:
+        return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, value in list(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets=DEFAULT_BUCKETS, threadsafe: bool = False):
+        super().__init__(name, documentation, labelnames, threadsafe)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        if self._lock is None:
+            self._observe(value, labels)
+            return
+        with self._lock:
+            self._observe(value, labels)
+
+    def summary(self, *labels: str) -> Tuple[int, float]:
+        """(count, sum) of the observations for `labels`."""
+        data = self._values.get(labels)
+        return (int(sum(data[:-1])), data[-1]) if data else (0, 0.0)
+
+    def _observe(self, value: float, labels: Tuple[str, ...]) -> None:
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0] * (len(self.buckets) + 2)
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, data in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            cumulative += data[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {data[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests currently being served")
+
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command"), threadsafe=True
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongodb_command_failures_total", "Failed MongoDB commands", ("collection", "command"), threadsafe=True
+)
+MONGO_POOL_CHECKOUT_WAIT = Histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0), threadsafe=True,
+)
+MONGO_POOL_CONNECTIONS = Gauge("mongodb_pool_connections", "Open pooled connections", ("address",), threadsafe=True)
+MONGO_POOL_IN_USE = Gauge(
+    "mongodb_pool_connections_in_use", "Checked-out pooled connections", ("address",), threadsafe=True
+)
+
+SOCKETIO_CONNECTIONS = Gauge("socketio_connections", "Connected Socket.IO clients")
+SOCKETIO_EMITS = Counter("socketio_emits_total", "Socket.IO emits by event", ("event",))
+SOCKETIO_EMIT_RECIPIENTS = Counter(
+    "socketio_emit_recipients_total", "Clients reached by Socket.IO emits (fan-out)", ("event",)
+)
+SOCKETIO_EMITS_SKIPPED = Counter(
+    "socketio_emits_skipped_total", "Emits to rooms with nobody online, by what happened instead", ("event", "outcome")
+)
+SOCKETIO_PRESENCE = Gauge("socketio_presence_online", "Distinct users and pharmacies with an open socket", ("kind",))
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Per-collection, per-command latency from pymongo command monitoring."""
+
+    def __init__(self):
+        self._collections: Dict[Tuple[int, object], str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[(event.request_id, event.connection_id)] = (
+            collection if isinstance(collection, str) else event.database_name
+        )
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.request_id, event.connection_id), "")
+        MONGO_COMMAND_LATENCY.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.request_id, event.connection_id), "")
+        MONGO_COMMAND_LATENCY.observe(event.duration_micros / 1e6, collection, event.command_name)
+        MONGO_COMMAND_FAILURES.inc(collection, event.command_name)
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Connection counts and checkout waits. Checkouts start and finish on the
+    same executor thread, so the start time is kept thread-locally."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _address(self, event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def _observe_wait(self):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            MONGO_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+            self._local.started = None
+
+    def connection_checked_out(self, event):
+        self._observe_wait()
+        MONGO_POOL_IN_USE.inc(self._address(event))
+
+    def connection_check_out_failed(self, event):
+        self._observe_wait()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_IN_USE.dec(self._address(event))
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc(self._address(event))
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec(self._address(event))
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
@@ -139,6 +139,7 @@ class LabTest(BaseModel):
     test_type: str
     status: str = "scheduled"
     scheduled_date: datetime
+    duration_minutes: int = 30
     results_url: Optional[str] = None
     notes: Optional[str] = ""
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -189,6 +190,16 @@ class CreateOrderRequest(BaseModel):
     phone: str
     payment_method: str  # cod, razorpay
 
+class OrderStatusChange(BaseModel):
+    order_id: str
+    status: str
+
+class BulkOrderStatusRequest(BaseModel):
+    updates: List[OrderStatusChange] = Field(..., min_length=1, max_length=500)
+
+class UserPharmaciesRequest(BaseModel):
+    pharmacy_ids: List[str]
+
 class VerifyPaymentRequest(BaseModel):
     razorpay_order_id: str
     razorpay_payment_id: str
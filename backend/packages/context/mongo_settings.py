@@ -0,0 +1,146 @@
+"""MongoDB client settings loaded from the environment.
+
+Each option has a MONGO_* variable. Unset options are not passed to the
+driver, so options given in the connection string (or the driver defaults)
+still apply; set ones take precedence over the connection string.
+Wire compression is off unless MONGO_COMPRESSORS is set; compressors whose
+Python package is not installed are dropped instead of letting pymongo warn
+on every client construction.
+
+Read profiles route groups of reads (see `get_db` in db.py) with their own
+read preference, staleness bound and read concern, configured with
+MONGO_<PROFILE>_READ_PREFERENCE, MONGO_<PROFILE>_MAX_STALENESS_SECONDS and
+MONGO_<PROFILE>_READ_CONCERN. "primary" is the client default; "catalog"
+serves pharmacy, medicine and review browsing, which tolerates staleness.
+"""
+from dataclasses import dataclass, field
+from importlib.util import find_spec
+from typing import Any, Dict, Optional, Tuple
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Compressor -> module pymongo needs for it (zlib ships with Python)
+_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+READ_PREFERENCES = {"primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"}
+READ_CONCERNS = {"local", "available", "majority", "linearizable", "snapshot"}
+# The server enforces max(90s, heartbeatFrequency + idleWritePeriod) as the floor
+MIN_MAX_STALENESS_SECONDS = 90
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+@dataclass(frozen=True)
+class ReadProfile:
+    read_preference: Optional[str] = None
+    max_staleness_seconds: Optional[int] = None
+    read_concern: Optional[str] = None
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "ReadProfile":
+        prefix = f"MONGO_{name.upper()}_"
+        profile = cls(
+            read_preference=os.getenv(prefix + "READ_PREFERENCE") or defaults.get("read_preference"),
+            max_staleness_seconds=_env_int(prefix + "MAX_STALENESS_SECONDS") or defaults.get("max_staleness_seconds"),
+            read_concern=os.getenv(prefix + "READ_CONCERN") or defaults.get("read_concern"),
+        )
+        profile.validate(prefix)
+        return profile
+
+    def validate(self, prefix: str = "") -> None:
+        if self.read_preference is not None and self.read_preference not in READ_PREFERENCES:
+            raise ValueError(f"{prefix}READ_PREFERENCE must be one of {', '.join(sorted(READ_PREFERENCES))}")
+        if self.read_concern is not None and self.read_concern not in READ_CONCERNS:
+            raise ValueError(f"{prefix}READ_CONCERN must be one of {', '.join(sorted(READ_CONCERNS))}")
+        if self.max_staleness_seconds is not None:
+            if self.read_preference in (None, "primary"):
+                raise ValueError(f"{prefix}MAX_STALENESS_SECONDS cannot be used with a primary read preference")
+            if self.max_staleness_seconds < MIN_MAX_STALENESS_SECONDS:
+                raise ValueError(f"{prefix}MAX_STALENESS_SECONDS must be at least {MIN_MAX_STALENESS_SECONDS}")
+
+
+@dataclass(frozen=True)
+class MongoSettings:
+    max_pool_size: Optional[int] = None
+    min_pool_size: Optional[int] = None
+    max_idle_time_ms: Optional[int] = None
+    wait_queue_timeout_ms: Optional[int] = None
+    max_connecting: Optional[int] = None
+    server_selection_timeout_ms: Optional[int] = None
+    connect_timeout_ms: Optional[int] = None
+    socket_timeout_ms: Optional[int] = None
+    read_preference: Optional[str] = None
+    compressors: Tuple[str, ...] = ()
+    zlib_compression_level: Optional[int] = None
+    app_name: str = "medimart-backend"
+    prewarm_timeout_seconds: float = 10.0
+    read_profiles: Dict[str, ReadProfile] = field(default_factory=dict)
+
+    @classmethod
+    def from_env(cls) -> "MongoSettings":
+        compressors = os.getenv("MONGO_COMPRESSORS", "")
+        settings = cls(
+            max_pool_size=_env_int("MONGO_MAX_POOL_SIZE"),
+            min_pool_size=_env_int("MONGO_MIN_POOL_SIZE"),
+            max_idle_time_ms=_env_int("MONGO_MAX_IDLE_TIME_MS"),
+            wait_queue_timeout_ms=_env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+            max_connecting=_env_int("MONGO_MAX_CONNECTING"),
+            server_selection_timeout_ms=_env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS"),
+            connect_timeout_ms=_env_int("MONGO_CONNECT_TIMEOUT_MS"),
+            socket_timeout_ms=_env_int("MONGO_SOCKET_TIMEOUT_MS"),
+            read_preference=os.getenv("MONGO_READ_PREFERENCE") or None,
+            compressors=_available_compressors(c.strip() for c in compressors.split(",") if c.strip()),
+            zlib_compression_level=_env_int("MONGO_ZLIB_COMPRESSION_LEVEL"),
+            app_name=os.getenv("MONGO_APP_NAME", "medimart-backend"),
+            prewarm_timeout_seconds=float(os.getenv("MONGO_PREWARM_TIMEOUT_SECONDS", 10)),
+            read_profiles={
+                "catalog": ReadProfile.from_env(
+                    "catalog", read_preference="secondaryPreferred",
+                    max_staleness_seconds=MIN_MAX_STALENESS_SECONDS, read_concern="local",
+                ),
+            },
+        )
+        settings.validate()
+        return settings
+
+    def validate(self) -> None:
+        if self.min_pool_size and self.max_pool_size and self.min_pool_size > self.max_pool_size:
+            raise ValueError("MONGO_MIN_POOL_SIZE cannot exceed MONGO_MAX_POOL_SIZE")
+        if self.read_preference is not None and self.read_preference not in READ_PREFERENCES:
+            raise ValueError(f"MONGO_READ_PREFERENCE must be one of {', '.join(sorted(READ_PREFERENCES))}")
+
+    def client_options(self) -> Dict[str, Any]:
+        """Keyword arguments for AsyncIOMotorClient."""
+        options = {
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "maxIdleTimeMS": self.max_idle_time_ms,
+            "waitQueueTimeoutMS": self.wait_queue_timeout_ms,
+            "maxConnecting": self.max_connecting,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "connectTimeoutMS": self.connect_timeout_ms,
+            "socketTimeoutMS": self.socket_timeout_ms,
+            "readPreference": self.read_preference,
+            "compressors": ",".join(self.compressors) or None,
+            "zlibCompressionLevel": self.zlib_compression_level,
+            "appname": self.app_name,
+        }
+        return {k: v for k, v in options.items() if v is not None}
+
+
+def _available_compressors(requested) -> Tuple[str, ...]:
+    available = []
+    for name in requested:
+        module = _COMPRESSOR_MODULES.get(name)
+        if module is None:
+            raise ValueError(f"Unknown MongoDB compressor: {name}")
+        if find_spec(module) is None:
+            logger.info("MongoDB compressor %s skipped: %s is not installed", name, module)
+            continue
+        available.append(name)
+    return tuple(available)
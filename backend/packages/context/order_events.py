@@ -0,0 +1,102 @@
+"""Coalesced realtime order events.
+
+Order lifecycle changes reach this coalescer through the outbox relay
+(`cron/outbox_relay.py`) instead of being emitted one by one. Events for a
+user's room are buffered for ORDER_EVENTS_WINDOW_MS, merged per order (later
+fields win) and delivered as one `order_updates` frame:
+
+    {"orders": [{"order_id": ..., "status": ..., "event": ..., "seq": ...}, ...]}
+
+One flusher task per room sends that room's frames strictly in order, and an
+event published while a frame is going out lands in the next one, so the
+last frame always carries each order's final state. Orders within a frame
+are listed by their latest change. `seq` is the order's `event_seq`, which
+every writer of an order event increments (`$inc`) in the same unit of work
+that writes the outbox row and passes on as the event's `seq` field. It
+therefore counts each order's changes exactly, whichever worker delivers
+them and across deploys, and clients can discard anything older than what
+they already have.
+
+`publish` returns a future that resolves once the frame carrying the event
+has been emitted, or fails with the emit's error, so the relay only marks
+outbox rows delivered after they really went out.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import os
+
+from .metrics import Counter
+from .socket import emit
+
+logger = logging.getLogger(__name__)
+
+ORDER_EVENTS_WINDOW_MS = float(os.getenv("ORDER_EVENTS_WINDOW_MS", 250))
+
+ORDER_EVENTS_COALESCED = Counter("order_events_coalesced_total", "Order events merged into a later event before delivery")
+
+
+class OrderEventCoalescer:
+    def __init__(self, window_ms: float):
+        self.window = window_ms / 1000
+        self._buffers: Dict[str, "OrderedDict[str, Dict[str, Any]]"] = {}
+        self._flushers: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+
+    def publish(self, user_id: str, order_id: str, event: str, seq: int, **fields: Any) -> asyncio.Future:
+        room = f"user_{user_id}"
+        buffer = self._buffers.setdefault(room, OrderedDict())
+        state = buffer.pop(order_id, None)
+        if state is not None:
+            ORDER_EVENTS_COALESCED.inc()
+            fields = {**state, **fields}
+            seq = max(seq, state["seq"])
+        buffer[order_id] = {**fields, "order_id": order_id, "user_id": user_id, "event": event, "seq": seq}
+        delivered = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(room, []).append(delivered)
+        if room not in self._flushers:
+            self._flushers[room] = asyncio.create_task(self._flush_room(room))
+        return delivered
+
+    async def _flush_room(self, room: str) -> None:
+        try:
+            while self._buffers.get(room):
+                await asyncio.sleep(self.window)
+                await self._send(room)
+        finally:
+            del self._flushers[room]
+            # Only left over if the flusher was cancelled before sending
+            self._buffers.pop(room, None)
+            _settle(self._waiters.pop(room, []), RuntimeError("Order event flusher stopped"))
+
+    async def _send(self, room: str) -> None:
+        batch = self._buffers.pop(room, None)
+        waiters = self._waiters.pop(room, [])
+        if not batch:
+            return
+        try:
+            await emit("order_updates", {"orders": list(batch.values())}, room=room)
+        except Exception as e:
+            logger.exception("Failed to deliver order events to %s", room)
+            _settle(waiters, e)
+            return
+        _settle(waiters)
+
+    async def flush_all(self) -> None:
+        """Deliver everything still buffered; called on shutdown."""
+        self.window = 0
+        await asyncio.gather(*self._flushers.values(), return_exceptions=True)
+
+
+def _settle(waiters: List[asyncio.Future], error: Optional[BaseException] = None) -> None:
+    for waiter in waiters:
+        if waiter.done():
+            continue
+        if error is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(error)
+
+
+order_events = OrderEventCoalescer(ORDER_EVENTS_WINDOW_MS)
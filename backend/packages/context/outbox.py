@@ -0,0 +1,106 @@
+"""Transactional outbox for events that must follow a state change.
+
+Handlers no longer emit realtime events themselves. They write an `outbox`
+row in the same transaction as the change the event describes (`unit_of_work`
++ `enqueue`), so either both are stored or neither is, and a dying process
+or a failing emit can no longer lose the event. The relay in
+`cron/outbox_relay.py` claims pending rows in order, hands them to their
+consumers and marks them delivered; the HTTP response does not wait for any
+of that.
+
+`unit_of_work` runs the work through `with_transaction`, which retries it on
+TransientTransactionError (e.g. a write conflict between concurrent orders)
+and retries the commit on UnknownTransactionCommitResult, so work functions
+must be safe to run more than once. Transactions need a replica set or
+mongos. On a standalone server (OUTBOX_TRANSACTIONS=auto detects it, or
+force with on/off) the work gets no session and its writes run one after
+another; handlers write the outbox row last, so a crash can still drop an
+event but never announce a change that was not made.
+"""
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+import asyncio
+import logging
+import os
+
+from .db import client, db
+from .indexes import Index, register_indexes
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_TRANSACTIONS = os.getenv("OUTBOX_TRANSACTIONS", "auto").lower()
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", 24))
+
+register_indexes(
+    Index(
+        "outbox", [("status", 1), ("_id", 1)],
+        query={"$or": [{"status": "pending", "available_at": {"$lte": "?"}},
+                       {"status": "relaying", "lease_until": {"$lte": "?"}}]},
+        sort=[("_id", 1)],
+    ),
+    Index("outbox", "owner", sparse=True, query={"owner": "?"}, sort=[("_id", 1)]),
+    Index("outbox", "delivered_at", expireAfterSeconds=int(OUTBOX_RETENTION_HOURS * 3600)),
+)
+
+T = TypeVar("T")
+
+_transactions_supported: Optional[bool] = None
+_wakeup = asyncio.Event()
+
+
+def wake() -> None:
+    """Let the relay pick up new rows now instead of at its next poll."""
+    _wakeup.set()
+
+
+async def wait_for_rows(timeout: float) -> None:
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
+
+async def transactions_supported() -> bool:
+    global _transactions_supported
+    if OUTBOX_TRANSACTIONS in ("on", "off"):
+        return OUTBOX_TRANSACTIONS == "on"
+    if _transactions_supported is None:
+        try:
+            hello = await client.admin.command("hello")
+        except Exception as e:
+            logger.warning("Could not detect transaction support, writing without a transaction: %s", e)
+            return False
+        _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        if not _transactions_supported:
+            logger.warning("MongoDB is standalone; outbox rows are written without a transaction")
+    return _transactions_supported
+
+
+async def unit_of_work(work: Callable[[Any], Awaitable[T]]) -> T:
+    """Run `work(session)` so its writes commit together (it passes the
+    session as `session=`) and return its result. The session is None when
+    transactions are unavailable. Transient failures re-run `work`."""
+    if not await transactions_supported():
+        result = await work(None)
+    else:
+        async with await client.start_session() as session:
+            result = await session.with_transaction(work)
+    wake()
+    return result
+
+
+def order_event(user_id: str, order_id: str, event: str, **fields: Any) -> Dict[str, Any]:
+    """Outbox row for a realtime order update (see `context/order_events.py`)."""
+    return {
+        "type": "order_event",
+        "payload": {"user_id": user_id, "order_id": order_id, "event": event, "fields": fields},
+    }
+
+
+async def enqueue(*rows: Dict[str, Any], session=None) -> None:
+    now = datetime.utcnow()
+    await db.outbox.insert_many(
+        [{**row, "status": "pending", "attempts": 0, "created_at": now, "available_at": now} for row in rows],
+        session=session,
+    )
@@ -0,0 +1,47 @@
+"""Who is connected to this process's Socket.IO server.
+
+Sockets authenticate with the API's JWT when they connect; the registry maps
+each user id (and each pharmacy id an operator has joined) to its open sids,
+so emits can tell whether a room has anyone in it. Like the Socket.IO rooms
+themselves it is per process, so it is only trusted to say someone is
+offline when the server runs as a single worker (no SOCKETIO_MESSAGE_QUEUE).
+A user's socket is registered once their deferred backlog was delivered.
+"""
+from collections import defaultdict
+from typing import Dict, Set, Tuple
+
+from .metrics import SOCKETIO_PRESENCE
+
+USER, PHARMACY = "user", "pharmacy"
+
+
+class PresenceRegistry:
+    def __init__(self):
+        self._sids: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
+        self._subjects: Dict[str, Set[Tuple[str, str]]] = defaultdict(set)
+
+    def add(self, sid: str, kind: str, subject_id: str) -> bool:
+        """Register `sid` for a user or pharmacy; True when that subject just came online."""
+        key = (kind, subject_id)
+        came_online = not self._sids[key]
+        self._sids[key].add(sid)
+        self._subjects[sid].add(key)
+        if came_online:
+            SOCKETIO_PRESENCE.inc(kind)
+        return came_online
+
+    def remove(self, sid: str) -> None:
+        for key in self._subjects.pop(sid, ()):
+            sids = self._sids.get(key)
+            if sids is None:
+                continue
+            sids.discard(sid)
+            if not sids:
+                del self._sids[key]
+                SOCKETIO_PRESENCE.dec(key[0])
+
+    def is_online(self, kind: str, subject_id: str) -> bool:
+        return bool(self._sids.get((kind, subject_id)))
+
+
+presence = PresenceRegistry()
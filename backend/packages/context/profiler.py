@@ -0,0 +1,173 @@
+"""Per-request sampling profiler.
+
+While at least one request is being profiled, a sampler thread wakes every
+PROFILE_INTERVAL_MS, checks which task the event loop is running and, when
+it is a profiled request's task, folds the loop thread's stack (from
+`sys._current_frames()`) into that request's samples. Samples taken while
+the request is suspended on I/O are counted under an "(awaiting)" frame, so
+the output shows both where CPU time went and how much of the wall time was
+spent waiting. With nothing being profiled the thread sleeps.
+
+Profiles are kept in memory and rendered in the collapsed-stack format read
+by flamegraph.pl, speedscope and inferno: one `frame;frame;frame count`
+line per distinct stack, outermost frame first.
+"""
+from collections import Counter, deque
+from itertools import count
+from typing import Any, Deque, Dict, List, Optional
+import asyncio
+import os
+import sys
+import threading
+import time
+
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_ON_DEMAND_KEEP = int(os.getenv("PROFILE_ON_DEMAND_KEEP", 50))
+PROFILE_SAMPLED_KEEP_PER_ROUTE = int(os.getenv("PROFILE_SAMPLED_KEEP_PER_ROUTE", 20))
+
+AWAITING_FRAME = "(awaiting)"
+# Frames from the loop machinery down to the task step are the same in every sample
+_LOOP_ENTRY = ("asyncio/events.py", "_run")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    short = filename.rsplit("site-packages/", 1)[-1] if "site-packages/" in filename else os.path.basename(filename)
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({short}:{frame.f_lineno})"
+
+
+def _fold(frame) -> str:
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == _LOOP_ENTRY[1] and code.co_filename.endswith(_LOOP_ENTRY[0]):
+            break
+        labels.append(_frame_label(frame).replace(";", ":"))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+class ProfileSession:
+    _ids = count(1)
+
+    def __init__(self, kind: str, method: str, path: str):
+        self.id = f"{int(time.time())}-{next(self._ids)}"
+        self.kind = kind
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.started = time.time()
+        self.duration_ms: Optional[float] = None
+        self.status_code: Optional[int] = None
+        self.stacks: Counter = Counter()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "started": self.started,
+            "duration_ms": self.duration_ms,
+            "status_code": self.status_code,
+            "samples": sum(self.stacks.values()),
+            "awaiting_samples": self.stacks.get(AWAITING_FRAME, 0),
+        }
+
+    def collapsed(self) -> str:
+        return render_collapsed(self.stacks)
+
+
+def render_collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+
+
+class _Profiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[asyncio.Task, ProfileSession] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._on_demand: Deque[ProfileSession] = deque(maxlen=PROFILE_ON_DEMAND_KEEP)
+        self._sampled: Dict[str, Deque[ProfileSession]] = {}
+
+    def start(self, kind: str, method: str, path: str) -> ProfileSession:
+        """Profile the current task until `stop` is called."""
+        session = ProfileSession(kind, method, path)
+        task = asyncio.current_task()
+        with self._lock:
+            if self._thread is None:
+                self._loop = asyncio.get_running_loop()
+                self._loop_thread_id = threading.get_ident()
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+            self._active[task] = session
+        self._wake.set()
+        return session
+
+    def stop(self, session: ProfileSession) -> None:
+        with self._lock:
+            for task, active in list(self._active.items()):
+                if active is session:
+                    del self._active[task]
+            if not self._active:
+                self._wake.clear()
+            session.duration_ms = round((time.time() - session.started) * 1000, 2)
+            if session.kind == "sampled":
+                key = session.route or session.path
+                if key not in self._sampled:
+                    self._sampled[key] = deque(maxlen=PROFILE_SAMPLED_KEEP_PER_ROUTE)
+                self._sampled[key].append(session)
+            else:
+                self._on_demand.append(session)
+
+    def _run(self) -> None:
+        interval = PROFILE_INTERVAL_MS / 1000
+        while True:
+            self._wake.wait()
+            time.sleep(interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                current = asyncio.tasks._current_tasks.get(self._loop)
+                frame = sys._current_frames().get(self._loop_thread_id)
+                running = self._active.get(current)
+                stack = _fold(frame) if running is not None and frame is not None else None
+                for session in self._active.values():
+                    if session is running and stack:
+                        session.stacks[stack] += 1
+                    else:
+                        session.stacks[AWAITING_FRAME] += 1
+
+    def get(self, profile_id: str) -> Optional[ProfileSession]:
+        with self._lock:
+            for session in self._all():
+                if session.id == profile_id:
+                    return session
+        return None
+
+    def list(self, route: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            sessions = [s for s in self._all() if route is None or (s.route or s.path) == route]
+        return [s.summary() for s in sorted(sessions, key=lambda s: s.started, reverse=True)]
+
+    def aggregate(self, route: str) -> str:
+        """All stored sampled profiles of `route` merged into one collapsed file."""
+        merged: Counter = Counter()
+        with self._lock:
+            for session in self._sampled.get(route, ()):
+                merged.update(session.stacks)
+        return render_collapsed(merged)
+
+    def _all(self):
+        yield from self._on_demand
+        for sessions in self._sampled.values():
+            yield from sessions
+
+
+profiler = _Profiler()
@@ -0,0 +1,119 @@
+"""Token-bucket rate limiting state.
+
+A `RateLimit` allows `burst` requests at once and refills at
+`rate_per_second`. Buckets live in a backend chosen with RATE_LIMIT_BACKEND:
+
+- "memory" (default): per-process dict, bounded to RATE_LIMIT_MAX_KEYS
+  buckets. Limits apply per worker.
+- "mongo": one document per bucket in `rate_limits`, refilled and debited in
+  a single atomic pipeline update, so all workers share the budget. Idle
+  buckets expire through a TTL index once they would be full again. If Mongo
+  errors, requests are let through rather than failing the API.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Tuple
+import logging
+import math
+import os
+import re
+import time
+
+from pymongo import ReturnDocument
+
+from .db import db
+from .indexes import Index, register_indexes
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000))
+
+_PERIODS = {"second": 1, "sec": 1, "s": 1, "minute": 60, "min": 60, "m": 60, "hour": 3600, "h": 3600}
+
+register_indexes(
+    Index("rate_limits", "expires_at", expireAfterSeconds=0),
+)
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    rate_per_second: float
+    burst: int
+    key: str = "ip"  # "ip" or "user" (falls back to the IP when anonymous)
+
+    @classmethod
+    def parse(cls, spec: str, key: str = "ip") -> "RateLimit":
+        """Parse "<count>/<period>", e.g. "10/minute"; the count is also the burst.
+        Count and period must be positive."""
+        match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d*)\s*([a-z]+)\s*", spec.lower())
+        if not match or match.group(3) not in _PERIODS:
+            raise ValueError(f"Invalid rate limit {spec!r}; expected e.g. '10/minute'")
+        count = int(match.group(1))
+        period = int(match.group(2) or 1) * _PERIODS[match.group(3)]
+        if count <= 0 or period <= 0:
+            raise ValueError(f"Invalid rate limit {spec!r}; count and period must be positive")
+        return cls(rate_per_second=count / period, burst=count, key=key)
+
+    def retry_after(self, tokens: float) -> int:
+        return max(1, math.ceil((1 - tokens) / self.rate_per_second))
+
+
+class MemoryBackend:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # key -> (tokens, updated_at)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, limit: RateLimit) -> Tuple[bool, float]:
+        """Try to take one token; returns (allowed, tokens left)."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (float(limit.burst), now))
+        tokens = min(float(limit.burst), tokens + (now - updated) * limit.rate_per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class MongoBackend:
+    async def take(self, key: str, limit: RateLimit) -> Tuple[bool, float]:
+        now = time.time()
+        refilled = {"$min": [
+            limit.burst,
+            {"$add": [
+                {"$ifNull": ["$tokens", limit.burst]},
+                {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, limit.rate_per_second]},
+            ]},
+        ]}
+        expires_at = datetime.utcnow() + timedelta(seconds=limit.burst / limit.rate_per_second)
+        try:
+            bucket = await db.rate_limits.find_one_and_update(
+                {"_id": key},
+                [
+                    {"$set": {"tokens": refilled, "updated_at": now, "expires_at": expires_at}},
+                    {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                    {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except Exception as e:
+            logger.warning("Rate limit backend unavailable, allowing request: %s", e)
+            return True, float(limit.burst)
+        return bucket["allowed"], bucket["tokens"]
+
+
+def _backend():
+    if RATE_LIMIT_BACKEND == "mongo":
+        return MongoBackend()
+    if RATE_LIMIT_BACKEND == "memory":
+        return MemoryBackend(RATE_LIMIT_MAX_KEYS)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND}")
+
+
+rate_limit_backend = _backend()
@@ -0,0 +1,41 @@
+"""Per-request context shared with code that has no access to the request.
+
+The request-context middleware stores the ASGI scope and the request id in
+context variables.
+Motor copies the context into its executor threads, so pymongo listeners can
+attribute commands to the route that issued them.
+"""
+from contextvars import ContextVar
+from typing import Optional
+
+_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def set_scope(scope: dict):
+    return _scope.set(scope)
+
+
+def reset_scope(token) -> None:
+    _scope.reset(token)
+
+
+def set_request_id(request_id: str):
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token) -> None:
+    _request_id.reset(token)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def current_route() -> Optional[str]:
+    """Route template of the current request, or its raw path before routing."""
+    scope = _scope.get()
+    if scope is None:
+        return None
+    route = scope.get("route")
+    return route.path if route is not None else scope.get("path")
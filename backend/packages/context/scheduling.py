@@ -0,0 +1,216 @@
+"""Slot-based availability engine for doctors and labs.
+
+Each resource (a doctor or a lab) has one calendar document per day in
+`slot_calendars`, holding the indices of the booked slots. In memory a day is
+a bitmap (a Python int, bit i = slot i), so "next N free slots" is a handful
+of shifts and ANDs. Bookings are a single conditional update, which makes
+them atomic without locks or transactions.
+
+All times are naive UTC, the form MongoDB hands back, so the slots computed
+when booking and when releasing always agree; opening hours are UTC as well.
+
+Appointments that hold slots are marked `slots_reserved: True`. Status
+changes go through `change_status`, which only moves an appointment from the
+status it was read with, so of two concurrent cancels only one releases, and
+appointments that never reserved (older bookings) never free anybody else's
+slots.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+import os
+
+from pymongo.errors import DuplicateKeyError
+
+from .db import db
+from .indexes import Index, register_indexes
+
+SLOT_MINUTES = int(os.getenv("SCHEDULING_SLOT_MINUTES", 15))
+OPEN_HOUR = int(os.getenv("SCHEDULING_OPEN_HOUR", 9))
+CLOSE_HOUR = int(os.getenv("SCHEDULING_CLOSE_HOUR", 21))
+LOOKAHEAD_DAYS = int(os.getenv("SCHEDULING_LOOKAHEAD_DAYS", 14))
+
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+_FIRST_OPEN_SLOT = OPEN_HOUR * 60 // SLOT_MINUTES
+_LAST_OPEN_SLOT = CLOSE_HOUR * 60 // SLOT_MINUTES  # exclusive
+OPEN_MASK = ((1 << _LAST_OPEN_SLOT) - 1) ^ ((1 << _FIRST_OPEN_SLOT) - 1)
+
+register_indexes(
+    Index("slot_calendars", [("resource", 1), ("day", 1)], unique=True, query={"resource": "?", "day": {"$in": ["?"]}}),
+)
+
+
+class SlotUnavailable(Exception):
+    """Raised when any slot of a requested interval is already booked."""
+
+
+class StatusConflict(Exception):
+    """Raised when an appointment's status changed since it was read."""
+
+
+def doctor_resource(doctor_name: str) -> str:
+    return f"doctor:{doctor_name}"
+
+
+def lab_resource(lab_name: str) -> str:
+    return f"lab:{lab_name}"
+
+
+def to_utc(value: datetime) -> datetime:
+    """Naive UTC for any datetime; naive input is taken to be UTC already."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_datetime(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp from a request into naive UTC."""
+    try:
+        return to_utc(datetime.fromisoformat(value))
+    except ValueError:
+        raise ValueError("Invalid date format")
+
+
+def _day_key(day: datetime) -> str:
+    return day.strftime("%Y-%m-%d")
+
+
+def slots_for(start: datetime, duration_minutes: int) -> Tuple[str, List[int]]:
+    """Return the day key and slot indices covered by [start, start + duration).
+
+    Every slot the interval touches is included, so unaligned start times
+    still block the whole slot. Raises ValueError for intervals outside
+    opening hours or spanning midnight.
+    """
+    if duration_minutes <= 0:
+        raise ValueError("duration_minutes must be positive")
+
+    start = to_utc(start)
+    day_start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = (start - day_start).total_seconds() / 60
+    first = int(offset // SLOT_MINUTES)
+    last = -int(-(offset + duration_minutes) // SLOT_MINUTES)  # ceil, exclusive
+
+    if last > SLOTS_PER_DAY:
+        raise ValueError("Appointments cannot span midnight")
+    if first < _FIRST_OPEN_SLOT or last > _LAST_OPEN_SLOT:
+        raise ValueError(f"Appointments must fall between {OPEN_HOUR:02d}:00 and {CLOSE_HOUR:02d}:00")
+
+    return _day_key(start), list(range(first, last))
+
+
+def _bitmap(booked: List[int]) -> int:
+    mask = 0
+    for slot in booked:
+        mask |= 1 << slot
+    return mask
+
+
+def _free_starts(booked_mask: int, width: int) -> int:
+    """Bitmap of slot indices where `width` consecutive open, free slots begin."""
+    free = OPEN_MASK & ~booked_mask
+    runs = free
+    for i in range(1, width):
+        runs &= free >> i
+    return runs
+
+
+async def next_free_slots(resource: str, after: datetime, duration_minutes: int, count: int = 5) -> List[datetime]:
+    """Return up to `count` start times at or after `after` that fit `duration_minutes`."""
+    if duration_minutes <= 0:
+        raise ValueError("duration_minutes must be positive")
+    width = -(-duration_minutes // SLOT_MINUTES)
+
+    after = to_utc(after)
+    first_day = after.replace(hour=0, minute=0, second=0, microsecond=0)
+    days = [first_day + timedelta(days=i) for i in range(LOOKAHEAD_DAYS)]
+    calendars = await db.slot_calendars.find(
+        {"resource": resource, "day": {"$in": [_day_key(d) for d in days]}},
+        {"_id": 0, "day": 1, "booked": 1},
+    ).to_list(LOOKAHEAD_DAYS)
+    booked_by_day = {c["day"]: _bitmap(c.get("booked", [])) for c in calendars}
+
+    # Slots already started on the first day are not offered
+    offset = (after - first_day).total_seconds() / 60
+    not_before = -int(-offset // SLOT_MINUTES)
+
+    result: List[datetime] = []
+    for index, day in enumerate(days):
+        starts = _free_starts(booked_by_day.get(_day_key(day), 0), width)
+        if index == 0:
+            starts &= ~((1 << not_before) - 1)
+        while starts and len(result) < count:
+            lowest = starts & -starts
+            slot = lowest.bit_length() - 1
+            result.append(day + timedelta(minutes=slot * SLOT_MINUTES))
+            starts ^= lowest
+        if len(result) >= count:
+            break
+    return result
+
+
+async def book(resource: str, start: datetime, duration_minutes: int) -> None:
+    """Atomically reserve the slots for an appointment or raise SlotUnavailable."""
+    day, slots = slots_for(start, duration_minutes)
+    # Two first bookings of the same day can race on the upsert; the loser
+    # retries once against the now-existing document.
+    for attempt in range(2):
+        try:
+            result = await db.slot_calendars.update_one(
+                {"resource": resource, "day": day, "booked": {"$nin": slots}},
+                {"$push": {"booked": {"$each": slots}}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            if attempt:
+                raise SlotUnavailable(resource)
+            continue
+        if result.modified_count or result.upserted_id is not None:
+            return
+    raise SlotUnavailable(resource)
+
+
+async def release(resource: str, start: datetime, duration_minutes: int) -> None:
+    """Free the slots of an interval. Only call it for an interval the caller
+    holds: it does not check who booked the slots."""
+    try:
+        day, slots = slots_for(start, duration_minutes)
+    except ValueError:
+        # Bookings made before the engine existed were never reserved
+        return
+    await db.slot_calendars.update_one(
+        {"resource": resource, "day": day},
+        {"$pullAll": {"booked": slots}},
+    )
+
+
+async def change_status(collection, appointment: Dict[str, Any], resource: str, status: str,
+                        fields: Dict[str, Any]) -> None:
+    """Move `appointment` (as read from `collection`) to `status`, setting
+    `fields` too. Reviving a cancelled appointment books its slots again and
+    cancelling a reserved one releases them. Raises SlotUnavailable or
+    ValueError when a revival cannot book, StatusConflict when another
+    request changed the status first."""
+    current = appointment.get("status")
+    start, duration = appointment["scheduled_date"], appointment.get("duration_minutes", 30)
+    update = {**fields, "status": status, "updated_at": datetime.utcnow()}
+    reviving = status == "scheduled" and current == "cancelled"
+    cancelling = status == "cancelled" and current == "scheduled"
+    if reviving:
+        await book(resource, start, duration)
+        update["slots_reserved"] = True
+    elif cancelling:
+        update["slots_reserved"] = False
+
+    before = await collection.find_one_and_update({"id": appointment["id"], "status": current}, {"$set": update})
+    if before is None:
+        if reviving:
+            await release(resource, start, duration)
+        raise StatusConflict(appointment["id"])
+    if cancelling and before.get("slots_reserved"):
+        await release(resource, start, duration)
+
+
+async def release_deleted(appointment: Dict[str, Any], resource: str) -> None:
+    """Free the slots of an appointment that was just deleted, if it held any."""
+    if appointment.get("status") == "scheduled" and appointment.get("slots_reserved"):
+        await release(resource, appointment["scheduled_date"], appointment.get("duration_minutes", 30))
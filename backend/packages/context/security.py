@@ -7,10 +7,13 @@ from passlib.context import CryptContext
 import os
 
 from .db import db
+from .tracing import start_span
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-here-make-it-strong")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# Comma-separated usernames allowed to use the operational /admin endpoints
+ADMIN_USERNAMES = {u.strip() for u in os.environ.get("ADMIN_USERNAMES", "").split(",") if u.strip()}
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
@@ -29,21 +32,49 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+    with start_span("auth.get_current_user"):
+        return await _authenticate(credentials)
+
+async def _authenticate(credentials: HTTPAuthorizationCredentials):
+    user = await authenticate_token(credentials.credentials)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+async def authenticate_token(token: str) -> Optional[dict]:
+    """User document a bearer token belongs to, or None when the token is invalid."""
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    return await db.users.find_one({"username": username})
 
-    user = await db.users.find_one({"username": username})
-    if user is None:
-        raise credentials_exception
-    return user
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    if current_user["username"] not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+def token_subject(authorization: Optional[str]) -> Optional[str]:
+    """Username of a valid bearer token in an Authorization header.
+
+    Used by middleware that runs before dependencies; it trusts the signed
+    username and skips the user lookup.
+    """
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
+def is_admin_token(authorization: Optional[str]) -> bool:
+    """Whether an Authorization header carries a valid admin bearer token."""
+    return token_subject(authorization) in ADMIN_USERNAMES
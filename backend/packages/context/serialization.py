@@ -0,0 +1,57 @@
+"""Fast response path for documents read from our own database.
+
+Read handlers used to build a Pydantic model per document, which FastAPI
+then validated and serialized again through `response_model`. Documents we
+wrote ourselves do not need that: `trusted_rows` projects them onto the
+model's fields (filling defaults for fields older documents lack) and
+`FastJSONResponse` encodes them with orjson in one pass. Handlers keep their
+`response_model` for the OpenAPI schema; returning a Response skips the
+second validation.
+"""
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Type
+import json
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dump_json(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_json_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+
+def trusted_row(model: Type[BaseModel], doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Project a stored document onto `model`'s fields without validation."""
+    row = {}
+    for name, info in model.model_fields.items():
+        if name in doc:
+            row[name] = doc[name]
+        elif not info.is_required():
+            row[name] = info.get_default(call_default_factory=True)
+    return row
+
+
+def trusted_rows(model: Type[BaseModel], docs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [trusted_row(model, doc) for doc in docs]
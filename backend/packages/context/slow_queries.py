@@ -0,0 +1,194 @@
+"""Slow MongoDB command log with sampled explain capture.
+
+Commands slower than SLOW_QUERY_THRESHOLD_MS are normalized to their shape
+(literal values replaced by "?"), attributed to the route that issued them,
+aggregated in memory for the top-N admin view and written as JSON lines to a
+rotating file. A sample of them is re-run as `explain` with executionStats
+on the event loop, and the plan summary is written to the same file.
+"""
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from pymongo import monitoring
+
+from .request_context import current_route
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", 100))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", 0.1))
+SLOW_QUERY_LOG_PATH = os.getenv("SLOW_QUERY_LOG_PATH", "logs/slow_queries.log")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", 10 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", 5))
+SLOW_QUERY_MAX_SHAPES = int(os.getenv("SLOW_QUERY_MAX_SHAPES", 1000))
+
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Values under these keys describe the query's structure and are kept as-is
+_STRUCTURAL_KEYS = {"sort", "projection", "hint", "fields", "key"}
+# Driver and session bookkeeping that is neither shape nor explainable
+_IGNORED_KEYS = {"lsid", "txnNumber", "$clusterTime", "$db", "$readPreference", "autocommit",
+                 "startTransaction", "readConcern", "writeConcern", "cursor", "batchSize",
+                 "ordered", "comment", "maxTimeMS"}
+# Bulk statement lists; the first statement stands for the whole batch
+_BATCH_KEYS = {"documents", "updates", "deletes"}
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(value: Any) -> Any:
+    """Replace literals with "?" while keeping field names and operators."""
+    if isinstance(value, dict):
+        return {
+            k: (v if k in _STRUCTURAL_KEYS else normalize(v[:1] if k in _BATCH_KEYS else v))
+            for k, v in value.items()
+            if k not in _IGNORED_KEYS
+        }
+    if isinstance(value, (list, tuple)):
+        # Arrays of documents (pipelines, update statements) keep their
+        # structure; arrays of literals collapse to a single placeholder
+        if value and all(isinstance(v, dict) for v in value):
+            return [normalize(v) for v in value]
+        return "?"
+    return "?"
+
+
+class _SlowQueryStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shapes: Dict[str, Dict[str, Any]] = {}
+        self._file_logger: Optional[logging.Logger] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client = None
+        self._explains: set = set()
+
+    def bind(self, loop: asyncio.AbstractEventLoop, client) -> None:
+        """Enable explain capture; called once the event loop is running."""
+        self._loop = loop
+        self._client = client
+
+    def _file(self) -> logging.Logger:
+        if self._file_logger is None:
+            path = Path(SLOW_QUERY_LOG_PATH)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=SLOW_QUERY_LOG_MAX_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            file_logger = logging.getLogger("slow_queries.file")
+            file_logger.addHandler(handler)
+            file_logger.setLevel(logging.INFO)
+            file_logger.propagate = False
+            self._file_logger = file_logger
+        return self._file_logger
+
+    def record(self, database: str, command_name: str, command: Dict[str, Any],
+               duration_ms: float, route: Optional[str]) -> None:
+        collection = command.get(command_name)
+        collection = collection if isinstance(collection, str) else ""
+        shape = normalize(command)
+        key = json.dumps(shape, sort_keys=True, default=str)
+
+        with self._lock:
+            stats = self._shapes.get(key)
+            if stats is None:
+                if len(self._shapes) >= SLOW_QUERY_MAX_SHAPES:
+                    coldest = min(self._shapes, key=lambda k: self._shapes[k]["total_ms"])
+                    del self._shapes[coldest]
+                stats = self._shapes[key] = {
+                    "shape": shape, "collection": collection, "command": command_name,
+                    "count": 0, "total_ms": 0.0, "max_ms": 0.0, "routes": {},
+                }
+            stats["count"] += 1
+            stats["total_ms"] += duration_ms
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+            stats["last_seen"] = time.time()
+            if route:
+                stats["routes"][route] = stats["routes"].get(route, 0) + 1
+
+        self._file().info(json.dumps({
+            "type": "slow_query", "ts": time.time(), "database": database, "collection": collection,
+            "command": command_name, "duration_ms": round(duration_ms, 2), "route": route, "shape": shape,
+        }, default=str))
+
+        if (
+            self._loop is not None
+            and command_name in EXPLAINABLE_COMMANDS
+            and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE_RATE
+        ):
+            explainable = {
+                k: (v[:1] if k in _BATCH_KEYS else v) for k, v in command.items() if k not in _IGNORED_KEYS
+            }
+            self._loop.call_soon_threadsafe(self._start_explain, database, explainable, shape, route)
+
+    def _start_explain(self, *args) -> None:
+        task = asyncio.ensure_future(self._explain(*args))
+        self._explains.add(task)
+        task.add_done_callback(self._explains.discard)
+
+    async def _explain(self, database: str, command: Dict[str, Any], shape: Any, route: Optional[str]) -> None:
+        try:
+            result = await self._client[database].command(
+                {"explain": command, "verbosity": "executionStats"}
+            )
+        except Exception as e:
+            logger.warning("Explain for slow query failed: %s", e)
+            return
+        stats = result.get("executionStats", {})
+        self._file().info(json.dumps({
+            "type": "explain", "ts": time.time(), "database": database, "route": route, "shape": shape,
+            "winning_plan": _plan_stages(result.get("queryPlanner", {}).get("winningPlan", {})),
+            "n_returned": stats.get("nReturned"),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "keys_examined": stats.get("totalKeysExamined"),
+            "execution_ms": stats.get("executionTimeMillis"),
+        }, default=str))
+
+    def top(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            ranked = sorted(self._shapes.values(), key=lambda s: s["total_ms"], reverse=True)[:limit]
+            return [
+                {**s, "routes": dict(s["routes"]), "avg_ms": round(s["total_ms"] / s["count"], 2),
+                 "total_ms": round(s["total_ms"], 2), "max_ms": round(s["max_ms"], 2)}
+                for s in ranked
+            ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._shapes.clear()
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    stages = []
+    while plan:
+        stage = plan.get("stage")
+        if stage:
+            stages.append(f"{stage}({plan['indexName']})" if "indexName" in plan else stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0] or plan.get("queryPlan")
+    return stages
+
+
+slow_queries = _SlowQueryStore()
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    def __init__(self):
+        self._started: Dict[Tuple[int, object], Tuple[Dict[str, Any], Optional[str]]] = {}
+
+    def started(self, event):
+        if event.command_name == "explain":
+            return
+        self._started[(event.request_id, event.connection_id)] = (event.command, current_route())
+
+    def _finish(self, event):
+        started = self._started.pop((event.request_id, event.connection_id), None)
+        if started is None or event.duration_micros < SLOW_QUERY_THRESHOLD_MS * 1000:
+            return
+        command, route = started
+        slow_queries.record(event.database_name, event.command_name, command, event.duration_micros / 1000, route)
+
+    succeeded = _finish
+    failed = _finish
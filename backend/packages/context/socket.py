@@ -1,18 +1,161 @@
+from datetime import datetime, timedelta
+import os
 import socketio
+from .db import db
+from .indexes import Index, register_indexes
+from .logs import EventLogger
+from .metrics import SOCKETIO_CONNECTIONS, SOCKETIO_EMIT_RECIPIENTS, SOCKETIO_EMITS, SOCKETIO_EMITS_SKIPPED
+from .presence import PHARMACY, USER, presence
+from .security import ADMIN_USERNAMES, authenticate_token
+from .tracing import KIND_PRODUCER, start_span
 
-sio = socketio.AsyncServer(cors_allowed_origins="*")
+# How long events for offline users are kept for delivery on their next connect
+SOCKET_DEFERRED_TTL_HOURS = float(os.getenv("SOCKET_DEFERRED_TTL_HOURS", 24))
+SOCKET_DEFERRED_MAX_DELIVER = int(os.getenv("SOCKET_DEFERRED_MAX_DELIVER", 100))
+# Redis URL for running more than one worker: emits then reach a socket on
+# whichever process holds it. Without it, rooms and presence are per process
+# and the server must run as a single worker.
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+# The local presence registry only knows who is offline when every socket
+# connects to this process
+PRESENCE_AUTHORITATIVE = not SOCKETIO_MESSAGE_QUEUE
+
+sio = socketio.AsyncServer(
+    cors_allowed_origins="*",
+    client_manager=socketio.AsyncRedisManager(SOCKETIO_MESSAGE_QUEUE) if SOCKETIO_MESSAGE_QUEUE else None,
+)
 socket_app = socketio.ASGIApp(sio)
+events = EventLogger(__name__)
+
+register_indexes(
+    Index("deferred_notifications", [("user_id", 1), ("created_at", 1)], query={"user_id": "?"}, sort=[("created_at", 1)]),
+    Index("deferred_notifications", "expires_at", expireAfterSeconds=0),
+)
+
+def _room_subject(room):
+    """(kind, id) of a presence-tracked room, else None."""
+    if room and room.startswith("user_"):
+        return USER, room[len("user_"):]
+    if room and room.startswith("pharmacy_"):
+        return PHARMACY, room[len("pharmacy_"):]
+    return None
+
+async def emit(event, data, room=None):
+    """Emit through the shared server, recording the event and its fan-out.
+
+    In single-worker mode, events for an offline user are stored and
+    delivered when they next connect, and events for a pharmacy room nobody
+    has joined are dropped. With SOCKETIO_MESSAGE_QUEUE no single process
+    knows who is online, so everything goes through the queue; users who
+    are offline catch up through the REST endpoints."""
+    subject = _room_subject(room)
+    if subject is not None and PRESENCE_AUTHORITATIVE and not presence.is_online(*subject):
+        if subject[0] == USER:
+            now = datetime.utcnow()
+            await db.deferred_notifications.insert_one({
+                "user_id": subject[1],
+                "event": event,
+                "data": data,
+                "created_at": now,
+                "expires_at": now + timedelta(hours=SOCKET_DEFERRED_TTL_HOURS),
+            })
+            SOCKETIO_EMITS_SKIPPED.inc(event, "deferred")
+        else:
+            SOCKETIO_EMITS_SKIPPED.inc(event, "dropped")
+        return
+
+    recipients = sum(1 for _ in sio.manager.get_participants("/", room))
+    SOCKETIO_EMITS.inc(event)
+    SOCKETIO_EMIT_RECIPIENTS.inc(event, amount=recipients)
+    with start_span(f"socketio.emit {event}", KIND_PRODUCER, room=room or "*", recipients=recipients):
+        await sio.emit(event, data, room=room)
+
+def _token(environ, auth):
+    # Not read from the query string: access logs record it
+    if isinstance(auth, dict) and auth.get("token"):
+        return auth["token"]
+    header = environ.get("HTTP_AUTHORIZATION", "")
+    if header.lower().startswith("bearer "):
+        return header[7:]
+    return None
+
+async def _deliver_deferred(sid, user_id):
+    """Send the user's stored events to `sid`, deleting those handed to the
+    transport. Failures are logged, not raised; undelivered events stay
+    stored for the next connect."""
+    delivered = []
+    try:
+        pending = await db.deferred_notifications.find(
+            {"user_id": user_id}, {"_id": 1, "event": 1, "data": 1}
+        ).sort("created_at", 1).to_list(SOCKET_DEFERRED_MAX_DELIVER)
+        for notification in pending:
+            await sio.emit(notification["event"], notification["data"], to=sid)
+            delivered.append(notification["_id"])
+        if delivered:
+            await db.deferred_notifications.delete_many({"_id": {"$in": delivered}})
+            events.info("socket.deferred_delivered", sid=sid, user_id=user_id, count=len(delivered))
+    except Exception as e:
+        events.warning("socket.deferred_failed", sid=sid, user_id=user_id, delivered=len(delivered),
+                       error=f"{type(e).__name__}: {e}")
 
 @sio.event
-async def connect(sid, environ):
-    print(f"Client {sid} connected")
+async def connect(sid, environ, auth=None):
+    token = _token(environ, auth)
+    user = await authenticate_token(token) if token else None
+    if user is None:
+        events.info("socket.rejected", sid=sid)
+        raise socketio.exceptions.ConnectionRefusedError("authentication failed")
+
+    await sio.save_session(sid, {"user_id": user["id"], "username": user["username"]})
+    await sio.enter_room(sid, f"user_{user['id']}")
+    # The server sends the CONNECT packet after this handler returns; frames
+    # sent from here would reach the client before it, so the backlog goes
+    # out from a task
+    sio.start_background_task(_come_online, sid, user["id"])
+    SOCKETIO_CONNECTIONS.inc()
+    events.info("socket.connect", sid=sid, user_id=user["id"])
+
+async def _come_online(sid, user_id):
+    """Deliver the backlog, then count the socket as online. Until then live
+    events for the user are deferred, so they cannot overtake the backlog; a
+    second pass picks up anything deferred meanwhile."""
+    await _deliver_deferred(sid, user_id)
+    if not sio.manager.is_connected(sid, "/"):
+        # Gone already; registering it now would leave it online for good
+        return
+    presence.add(sid, USER, user_id)
+    await _deliver_deferred(sid, user_id)
 
 @sio.event
 async def disconnect(sid):
-    print(f"Client {sid} disconnected")
+    presence.remove(sid)
+    SOCKETIO_CONNECTIONS.dec()
+    events.info("socket.disconnect", sid=sid)
 
 @sio.event
 async def join_room(sid, data):
-    user_id = data.get('user_id')
-    await sio.enter_room(sid, f"user_{user_id}")
-    print(f"Client {sid} joined room user_{user_id}")
+    # Sockets join their own user room on connect; the user_id clients used
+    # to send here is no longer trusted.
+    user_id = (await sio.get_session(sid))["user_id"]
+    if isinstance(data, dict) and data.get("user_id") not in (None, user_id):
+        events.warning("socket.join_room_denied", sid=sid, requested=data.get("user_id"))
+        return {"ok": False, "error": "forbidden"}
+    return {"ok": True, "room": f"user_{user_id}"}
+
+@sio.event
+async def join_pharmacy(sid, data):
+    """Operators subscribe to a pharmacy's room; admins, or users whose
+    document lists the pharmacy in `pharmacy_ids`."""
+    session = await sio.get_session(sid)
+    pharmacy_id = (data or {}).get("pharmacy_id") if isinstance(data, dict) else None
+    if not pharmacy_id:
+        return {"ok": False, "error": "pharmacy_id is required"}
+    if session["username"] not in ADMIN_USERNAMES:
+        user = await db.users.find_one({"id": session["user_id"], "pharmacy_ids": pharmacy_id}, {"_id": 1})
+        if user is None:
+            events.warning("socket.join_pharmacy_denied", sid=sid, pharmacy_id=pharmacy_id)
+            return {"ok": False, "error": "forbidden"}
+    await sio.enter_room(sid, f"pharmacy_{pharmacy_id}")
+    presence.add(sid, PHARMACY, pharmacy_id)
+    events.debug("socket.join_pharmacy", sid=sid, pharmacy_id=pharmacy_id)
+    return {"ok": True, "room": f"pharmacy_{pharmacy_id}"}
@@ -0,0 +1,314 @@
+"""Lightweight in-process tracing.
+
+Spans are plain objects tied together through a context variable: the
+tracing middleware opens a root span per request, `start_span` opens
+children, and the pymongo listener turns each command into a child of
+whatever span issued it (Motor copies the context into its executor
+threads). Sampling is decided once at the root by TRACE_SAMPLE_RATE. The
+sampled flag of an incoming W3C `traceparent` is only honored from trusted
+callers (see the tracing middleware), and at most TRACE_FORCED_PER_SECOND
+times a second; an untrusted traceparent still sets the trace and parent id.
+Unsampled requests get a shared no-op span and cost a context-variable
+lookup per instrumentation point.
+
+Finished traces are kept in a ring buffer (`GET /api/admin/traces`) and,
+with TRACE_EXPORT_PATH set, appended as OTLP/JSON
+`ExportTraceServiceRequest` lines by a background thread, which the
+OpenTelemetry collector's file receiver and most trace viewers can read.
+"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from pymongo import monitoring
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+TRACE_RING_SIZE = int(os.getenv("TRACE_RING_SIZE", 200))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_EXPORT_MAX_BYTES = int(os.getenv("TRACE_EXPORT_MAX_BYTES", 50 * 1024 * 1024))
+TRACE_EXPORT_BACKUPS = int(os.getenv("TRACE_EXPORT_BACKUPS", 3))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "medimart-backend")
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 1000))
+# Honor the sampled flag of every incoming traceparent (behind a gateway or
+# mesh that sets it); otherwise only admin requests may force a trace
+TRACE_TRUST_TRACEPARENT = os.getenv("TRACE_TRUST_TRACEPARENT", "0").lower() in ("1", "true", "yes")
+TRACE_FORCED_PER_SECOND = int(os.getenv("TRACE_FORCED_PER_SECOND", 10))
+
+# OTLP SpanKind values
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT, KIND_PRODUCER = 1, 2, 3, 4
+
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List["Span"] = []
+        self.dropped = 0
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: Trace, name: str, kind: int, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    @property
+    def recording(self) -> bool:
+        return True
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.error = message
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        if len(self.trace.spans) < TRACE_MAX_SPANS:
+            self.trace.spans.append(self)
+        else:
+            self.trace.dropped += 1
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    recording = False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def _random_id(n_bytes: int) -> str:
+    return random.getrandbits(n_bytes * 8).to_bytes(n_bytes, "big").hex()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current.get()
+    return span.trace.trace_id if span is not None else None
+
+
+def _parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    # version-traceid-parentid-flags
+    parts = (value or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+class _ForcedBudget:
+    """Allows at most `per_second` forced traces in each one-second window."""
+
+    def __init__(self, per_second: int):
+        self.per_second = per_second
+        self._window = 0
+        self._used = 0
+
+    def take(self) -> bool:
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window, self._used = window, 0
+        if self._used >= self.per_second:
+            return False
+        self._used += 1
+        return True
+
+
+_forced_budget = _ForcedBudget(TRACE_FORCED_PER_SECOND)
+
+
+def start_root_span(name: str, traceparent: Optional[str] = None, trust_sampled: bool = False, **attributes: Any):
+    """Open a request's root span, or return NOOP_SPAN when not sampled.
+    An incoming traceparent's sampled flag forces the trace only with
+    `trust_sampled` and while the forced-trace budget lasts.
+    Returns (span, context token); pass both to `end_root_span`."""
+    incoming = _parse_traceparent(traceparent)
+    trace_id, parent_id, forced = incoming if incoming is not None else (None, None, False)
+    sampled = (forced and trust_sampled and _forced_budget.take()) or random.random() < TRACE_SAMPLE_RATE
+    if not sampled:
+        return NOOP_SPAN, None
+    span = Span(Trace(trace_id or _random_id(16)), name, KIND_SERVER, parent_id, attributes)
+    return span, _current.set(span)
+
+
+def end_root_span(span, token) -> None:
+    if token is None:
+        return
+    _current.reset(token)
+    span.end()
+    exporter.export(span.trace, span)
+
+
+@contextmanager
+def start_span(name: str, kind: int = KIND_INTERNAL, **attributes: Any) -> Iterator[Any]:
+    """Child span of the current span; a no-op outside a sampled trace."""
+    parent = _current.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    span = Span(parent.trace, name, kind, parent.span_id, attributes)
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current.reset(token)
+        span.end()
+
+
+class _Exporter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=TRACE_RING_SIZE)
+        self._file_logger: Optional[logging.Logger] = None
+        self._listener: Optional[QueueListener] = None
+
+    def _file(self) -> logging.Logger:
+        if self._file_logger is None:
+            path = Path(TRACE_EXPORT_PATH)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=TRACE_EXPORT_MAX_BYTES, backupCount=TRACE_EXPORT_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            export_queue: queue.Queue = queue.Queue(10000)
+            self._listener = QueueListener(export_queue, handler)
+            self._listener.start()
+            file_logger = logging.getLogger("tracing.export")
+            file_logger.addHandler(QueueHandler(export_queue))
+            file_logger.setLevel(logging.INFO)
+            file_logger.propagate = False
+            self._file_logger = file_logger
+        return self._file_logger
+
+    def export(self, trace: Trace, root: Span) -> None:
+        document = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "medimart"}, "spans": [s.to_otlp() for s in trace.spans]}],
+            }]
+        }
+        summary = {
+            "trace_id": trace.trace_id,
+            "name": root.name,
+            "start": root.start_ns / 1e9,
+            "duration_ms": round((root.end_ns - root.start_ns) / 1e6, 3),
+            "spans": len(trace.spans),
+            "dropped_spans": trace.dropped,
+            "error": root.error,
+        }
+        with self._lock:
+            self._recent.append({"summary": summary, "otlp": document})
+        if TRACE_EXPORT_PATH:
+            self._file().info(json.dumps(document, separators=(",", ":")))
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [entry["summary"] for entry in reversed(self._recent)][:limit]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for entry in self._recent:
+                if entry["summary"]["trace_id"] == trace_id:
+                    return entry["otlp"]
+        return None
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+exporter = _Exporter()
+
+
+class TracingCommandListener(monitoring.CommandListener):
+    """One client span per MongoDB command issued inside a sampled trace."""
+
+    def __init__(self):
+        self._spans: Dict[Tuple[int, object], Span] = {}
+
+    def started(self, event):
+        parent = _current.get()
+        if parent is None:
+            return
+        collection = event.command.get(event.command_name)
+        host, port = event.connection_id
+        span = Span(parent.trace, f"mongodb.{event.command_name}", KIND_CLIENT, parent.span_id, {
+            "db.system": "mongodb",
+            "db.name": event.database_name,
+            "db.operation": event.command_name,
+            "db.mongodb.collection": collection if isinstance(collection, str) else "",
+            "net.peer.name": host,
+            "net.peer.port": port,
+        })
+        self._spans[(event.request_id, event.connection_id)] = span
+
+    def succeeded(self, event):
+        span = self._spans.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            span.end()
+
+    def failed(self, event):
+        span = self._spans.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            span.set_error(str(event.failure.get("errmsg", "command failed")))
+            span.end()
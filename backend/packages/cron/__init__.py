@@ -0,0 +1 @@
+# Background and scheduled tasks
@@ -0,0 +1,144 @@
+"""Relays outbox rows to their consumers.
+
+Pending rows (see `context/outbox.py`) are claimed in `_id` order in
+batches and passed to the handler registered for their `type` in
+OUTBOX_HANDLERS. Every worker runs a relay; a batch is claimed by moving its
+rows from `pending` to `relaying` with the batch's `owner` and a
+`lease_until` OUTBOX_LEASE_SECONDS ahead, row by row, so each row goes to
+one worker. Rows whose lease ran out (their worker died) are claimed again.
+A handler returns once its consumer has the row (order events: once the
+Socket.IO frame carrying them was emitted); the rows of a batch are handled
+concurrently, so coalescing windows overlap instead of adding up. Delivered
+rows are marked in one `update_many` and expire after
+OUTBOX_RETENTION_HOURS. A handler that raises gets the row retried with
+exponential backoff, up to OUTBOX_MAX_ATTEMPTS, after which it is marked
+failed. Delivery is at least once: a crash or a lease running out between
+publishing and marking repeats the rows, so consumers get the row id as
+`event_id` to drop duplicates.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from pymongo import UpdateOne
+
+from ..context.db import db
+from ..context.metrics import Counter, Histogram
+from ..context.order_events import order_events
+from ..context.outbox import wait_for_rows
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 200))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 1))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+# How long a claimed batch is reserved for its worker
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", 60))
+
+OUTBOX_RELAYED = Counter("outbox_relayed_total", "Outbox rows handed to their consumer", ("type", "outcome"))
+OUTBOX_DELIVERY_LAG = Histogram(
+    "outbox_delivery_lag_seconds", "Time from writing an outbox row to relaying it", ("type",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 60.0),
+)
+
+
+async def _publish_order_event(row: Dict[str, Any]) -> None:
+    payload = row["payload"]
+    await order_events.publish(
+        payload["user_id"], payload["order_id"], payload["event"], event_id=str(row["_id"]), **payload["fields"]
+    )
+
+
+OUTBOX_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]] = {
+    "order_event": _publish_order_event,
+}
+
+
+async def _relay(row: Dict[str, Any]) -> None:
+    handler = OUTBOX_HANDLERS.get(row["type"])
+    if handler is None:
+        raise ValueError(f"No outbox handler for type {row['type']!r}")
+    await handler(row)
+
+
+_WORKER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _claimable(now: datetime) -> Dict[str, Any]:
+    return {"$or": [
+        {"status": "pending", "available_at": {"$lte": now}},
+        {"status": "relaying", "lease_until": {"$lte": now}},
+    ]}
+
+
+async def process_batch() -> int:
+    """Claim and relay one batch of rows. Returns the number of rows claimed."""
+    now = datetime.utcnow()
+    candidates = (
+        await db.outbox.find(_claimable(now), {"_id": 1})
+        .sort("_id", 1)
+        .limit(OUTBOX_BATCH_SIZE)
+        .to_list(OUTBOX_BATCH_SIZE)
+    )
+    if not candidates:
+        return 0
+
+    # Each row is claimed atomically; rows another worker took in between no
+    # longer match and stay with it
+    owner = f"{_WORKER}:{uuid.uuid4().hex}"
+    await db.outbox.update_many(
+        {"_id": {"$in": [c["_id"] for c in candidates]}, **_claimable(now)},
+        {"$set": {"status": "relaying", "owner": owner, "lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)}},
+    )
+    rows = await db.outbox.find({"owner": owner}).sort("_id", 1).to_list(None)
+    if not rows:
+        return 0
+
+    # Tasks start in list order, so handlers are entered (and order events
+    # published) in `_id` order even though they complete concurrently
+    outcomes = await asyncio.gather(*(_relay(row) for row in rows), return_exceptions=True)
+
+    delivered, retries = [], []
+    for row, e in zip(rows, outcomes):
+        if isinstance(e, BaseException):
+            attempts = row.get("attempts", 0) + 1
+            final = attempts >= OUTBOX_MAX_ATTEMPTS
+            logger.warning("Outbox row %s (%s) failed, attempt %d: %s", row["_id"], row["type"], attempts, e)
+            OUTBOX_RELAYED.inc(row["type"], "failed" if final else "retry")
+            retries.append(UpdateOne({"_id": row["_id"], "owner": owner}, {"$set": {
+                "status": "failed" if final else "pending",
+                "attempts": attempts,
+                "available_at": now + timedelta(seconds=min(2 ** attempts, 300)),
+                "last_error": str(e),
+            }}))
+            continue
+        delivered.append(row["_id"])
+        OUTBOX_RELAYED.inc(row["type"], "delivered")
+        OUTBOX_DELIVERY_LAG.observe((now - row["created_at"]).total_seconds(), row["type"])
+
+    if delivered:
+        await db.outbox.update_many(
+            {"_id": {"$in": delivered}, "owner": owner},
+            {"$set": {"status": "delivered", "delivered_at": datetime.utcnow()}},
+        )
+    if retries:
+        await db.outbox.bulk_write(retries, ordered=False)
+    return len(rows)
+
+
+async def run_outbox_relay() -> None:
+    while True:
+        try:
+            read = await process_batch()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to relay outbox rows")
+            read = 0
+
+        if read < OUTBOX_BATCH_SIZE:
+            await wait_for_rows(OUTBOX_POLL_SECONDS)
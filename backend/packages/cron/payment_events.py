@@ -0,0 +1,232 @@
+"""Drains the Razorpay webhook inbox.
+
+The webhook endpoint only verifies and stores events in `payment_events`
+(keyed by event id, so redeliveries are dropped on insert). This worker picks
+up pending events in batches and applies the resulting order and transaction
+updates with one `bulk_write` per collection. Updates are guarded by the
+current payment status, so applying an event twice, or a `payment.failed`
+that arrives after the capture, is harmless. Orders an event actually
+changes are stamped with its id (`payment_event_id`), and a
+`payment_status_updated` outbox row is written for each in the same unit of
+work, so users see webhook-driven changes like verified ones.
+
+An event whose payload cannot be interpreted, or whose updates the server
+rejects, is marked `failed` with its error instead of holding up the rest of
+the batch; failed rows keep no `processed_at`, so the retention TTL never
+removes them. Transient errors (lost connections, elections, errors the
+server labels transient) leave the event `pending` with its `attempts`
+counted and `next_attempt_at` pushed back exponentially.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure, PyMongoError
+
+from ..context.db import db
+from ..context.indexes import Index, register_indexes
+from ..context.outbox import enqueue, order_event, unit_of_work
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_EVENTS_BATCH_SIZE = int(os.getenv("PAYMENT_EVENTS_BATCH_SIZE", 200))
+PAYMENT_EVENTS_POLL_SECONDS = float(os.getenv("PAYMENT_EVENTS_POLL_SECONDS", 2))
+PAYMENT_EVENTS_RETENTION_DAYS = int(os.getenv("PAYMENT_EVENTS_RETENTION_DAYS", 30))
+PAYMENT_EVENTS_RETRY_SECONDS = float(os.getenv("PAYMENT_EVENTS_RETRY_SECONDS", 5))
+PAYMENT_EVENTS_MAX_RETRY_SECONDS = float(os.getenv("PAYMENT_EVENTS_MAX_RETRY_SECONDS", 600))
+
+SUCCESS_EVENTS = {"payment.captured", "order.paid"}
+FAILURE_EVENTS = {"payment.failed"}
+
+register_indexes(
+    Index(
+        "payment_events", [("status", 1), ("received_at", 1)],
+        query={"status": "pending", "next_attempt_at": {"$not": {"$gt": "?"}}}, sort=[("received_at", 1)],
+    ),
+    Index("payment_events", "processed_at", expireAfterSeconds=PAYMENT_EVENTS_RETENTION_DAYS * 86400),
+    Index("orders", "razorpay_order_id", query={"razorpay_order_id": "?"}),
+    Index("orders", "payment_event_id", sparse=True, query={"payment_event_id": {"$in": ["?"]}}),
+)
+
+_wakeup = asyncio.Event()
+
+
+def wake() -> None:
+    """Start the next drain now instead of at the next poll."""
+    _wakeup.set()
+
+
+def _is_transient(error: BaseException) -> bool:
+    """Whether retrying later may succeed: the event itself is not at fault."""
+    if isinstance(error, ConnectionFailure):  # AutoReconnect, NotPrimaryError, timeouts
+        return True
+    return isinstance(error, PyMongoError) and (
+        error.has_error_label("TransientTransactionError") or error.has_error_label("RetryableWriteError")
+    )
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(PAYMENT_EVENTS_RETRY_SECONDS * 2 ** attempts, PAYMENT_EVENTS_MAX_RETRY_SECONDS))
+
+
+def _payment_outcome(event: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Map an event to (outcome, payment entity), or None if it is not relevant."""
+    payment = event.get("payload", {}).get("payment", {}).get("entity", {})
+    if not payment.get("order_id"):
+        return None
+    if event["event"] in SUCCESS_EVENTS:
+        return "success", payment
+    if event["event"] in FAILURE_EVENTS:
+        return "failed", payment
+    return None
+
+
+def _event_updates(event: Dict[str, Any], now: datetime) -> Optional[Tuple[UpdateOne, UpdateOne]]:
+    """The (order, transaction) updates an event implies, or None if it is not relevant."""
+    event_id = event["_id"]
+    outcome = _payment_outcome(event)
+    if outcome is None:
+        return None
+    status, payment = outcome
+    razorpay_order_id = payment["order_id"]
+    if status == "success":
+        return (
+            UpdateOne(
+                {"razorpay_order_id": razorpay_order_id, "payment_status": {"$ne": "completed"}},
+                {"$set": {
+                    "payment_status": "completed",
+                    "razorpay_payment_id": payment.get("id"),
+                    "payment_event_id": event_id,
+                    "updated_at": now,
+                }, "$inc": {"event_seq": 1}},
+            ),
+            UpdateOne(
+                {"razorpay_order_id": razorpay_order_id, "status": {"$ne": "success"}},
+                {"$set": {"status": "success", "razorpay_payment_id": payment.get("id"), "updated_at": now}},
+            ),
+        )
+    return (
+        UpdateOne(
+            {"razorpay_order_id": razorpay_order_id, "payment_status": {"$ne": "completed"}},
+            {"$set": {"payment_status": "failed", "payment_event_id": event_id, "updated_at": now},
+             "$inc": {"event_seq": 1}},
+        ),
+        UpdateOne(
+            {"razorpay_order_id": razorpay_order_id, "status": {"$ne": "success"}},
+            {"$set": {
+                "status": "failed",
+                "razorpay_payment_id": payment.get("id"),
+                "error_message": payment.get("error_description") or "Payment failed",
+                "updated_at": now,
+            }},
+        ),
+    )
+
+
+async def _apply(updates: Dict[Any, Tuple[UpdateOne, UpdateOne]]) -> None:
+    """Apply the updates of the given events and announce the orders they changed."""
+    if not updates:
+        return
+
+    async def work(session):
+        await db.orders.bulk_write([order_op for order_op, _ in updates.values()], ordered=False, session=session)
+        await db.transactions.bulk_write(
+            [transaction_op for _, transaction_op in updates.values()], ordered=False, session=session
+        )
+        changed = await db.orders.find(
+            {"payment_event_id": {"$in": list(updates)}},
+            {"_id": 0, "id": 1, "user_id": 1, "payment_status": 1, "event_seq": 1},
+            session=session,
+        ).to_list(None)
+        if changed:
+            await enqueue(
+                *(order_event(o["user_id"], o["id"], 'payment_status_updated',
+                              seq=o["event_seq"], payment_status=o["payment_status"])
+                  for o in changed),
+                session=session,
+            )
+
+    await unit_of_work(work)
+
+
+async def process_batch() -> int:
+    """Apply one batch of due pending events. Returns the number of events consumed."""
+    now = datetime.utcnow()
+    events = (
+        await db.payment_events.find({"status": "pending", "next_attempt_at": {"$not": {"$gt": now}}})
+        .sort("received_at", 1)
+        .limit(PAYMENT_EVENTS_BATCH_SIZE)
+        .to_list(PAYMENT_EVENTS_BATCH_SIZE)
+    )
+    if not events:
+        return 0
+
+    updates: Dict[Any, Tuple[UpdateOne, UpdateOne]] = {}
+    failed: Dict[Any, str] = {}
+    retry: Dict[Any, str] = {}
+    for event in events:
+        try:
+            update = _event_updates(event, now)
+        except Exception as e:
+            failed[event["_id"]] = f"{type(e).__name__}: {e}"
+            continue
+        if update is not None:
+            updates[event["_id"]] = update
+
+    try:
+        await _apply(updates)
+    except Exception as e:
+        if _is_transient(e):
+            logger.warning("Payment event batch hit a transient error, retrying later: %s", e)
+            retry = {event_id: f"{type(e).__name__}: {e}" for event_id in updates}
+        else:
+            # Find the offending events by applying them one at a time; the
+            # updates are guarded, so re-applying the ones that succeeded is a no-op
+            logger.exception("Batched payment event update failed, applying events individually")
+            for event_id, update in updates.items():
+                try:
+                    await _apply({event_id: update})
+                except Exception as error:
+                    (retry if _is_transient(error) else failed)[event_id] = f"{type(error).__name__}: {error}"
+
+    for event_id, error in failed.items():
+        logger.warning("Payment event %s failed: %s", event_id, error)
+        await db.payment_events.update_one(
+            {"_id": event_id},
+            {"$set": {"status": "failed", "error": error, "failed_at": now}},
+        )
+    attempts = {e["_id"]: e.get("attempts", 0) for e in events}
+    for event_id, error in retry.items():
+        await db.payment_events.update_one(
+            {"_id": event_id},
+            {
+                "$set": {"error": error, "next_attempt_at": now + _retry_delay(attempts[event_id])},
+                "$inc": {"attempts": 1},
+            },
+        )
+    await db.payment_events.update_many(
+        {"_id": {"$in": [e["_id"] for e in events if e["_id"] not in failed and e["_id"] not in retry]}},
+        {"$set": {"status": "processed", "processed_at": now}},
+    )
+    return len(events)
+
+
+async def run_payment_events_worker() -> None:
+    while True:
+        _wakeup.clear()
+        try:
+            consumed = await process_batch()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to process payment events")
+            consumed = 0
+
+        if consumed < PAYMENT_EVENTS_BATCH_SIZE:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), PAYMENT_EVENTS_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
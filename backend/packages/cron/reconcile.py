@@ -0,0 +1,335 @@
+"""Payment reconciliation against a gateway settlement export.
+
+Transactions are streamed from Mongo in `razorpay_order_id` order through a
+server-side cursor, and the settlement CSV is put in the same order with a
+chunked external sort. The two streams are then merge-joined, so memory stays
+bounded by the batch and chunk sizes whatever the row counts. Discrepancies
+are written to a CSV report as they are found; with `fix` enabled, statuses
+the gateway is authoritative for are corrected with batched `bulk_write`s.
+
+The settlement file needs `order_id`, `payment_id`, `amount` (rupees) and
+`status` (captured, authorized, failed or refunded) columns; other columns
+are ignored.
+
+CLI:
+    python -m packages.cron.reconcile --settlement settlement.csv --report report.csv [--fix]
+
+Scheduled: set RECONCILE_SETTLEMENT_PATH and RECONCILE_INTERVAL_MINUTES. Each
+API worker runs the schedule, but a lease in `cron_leases` lets only one of
+them start a run per interval. The run itself is the CLI in a child process,
+so sorting the settlement file and writing the report never touch the API
+event loop.
+"""
+from datetime import datetime, timedelta
+from itertools import islice
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import asyncio
+import csv
+import heapq
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from ..context.db import db
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", 1000))
+RECONCILE_SORT_CHUNK_ROWS = int(os.getenv("RECONCILE_SORT_CHUNK_ROWS", 200_000))
+RECONCILE_STUCK_AFTER_MINUTES = int(os.getenv("RECONCILE_STUCK_AFTER_MINUTES", 60))
+RECONCILE_SETTLEMENT_PATH = os.getenv("RECONCILE_SETTLEMENT_PATH")
+RECONCILE_REPORT_DIR = os.getenv("RECONCILE_REPORT_DIR", "reconciliation")
+RECONCILE_INTERVAL_MINUTES = int(os.getenv("RECONCILE_INTERVAL_MINUTES", 0))
+# How long a scheduled run may go without renewing its lease before another
+# worker may take over
+RECONCILE_LEASE_SECONDS = int(os.getenv("RECONCILE_LEASE_SECONDS", 300))
+
+SETTLEMENT_COLUMNS = ("order_id", "payment_id", "amount", "status")
+REPORT_COLUMNS = (
+    "kind", "razorpay_order_id", "order_id", "db_status", "gateway_status",
+    "db_amount", "gateway_amount", "fixed",
+)
+
+# Gateway payment status -> expected transaction status
+GATEWAY_TO_TRANSACTION = {"captured": "success", "refunded": "refunded", "failed": "failed"}
+# When an order has several payment attempts, the highest ranked one decides
+_GATEWAY_STATUS_RANK = {"failed": 0, "authorized": 1, "captured": 2, "refunded": 3}
+
+
+def _sorted_settlement_rows(path: Path) -> Iterator[Dict[str, str]]:
+    """Yield settlement rows ordered by order_id using bounded memory."""
+    chunks = []
+    try:
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f)
+            missing = set(SETTLEMENT_COLUMNS) - set(reader.fieldnames or ())
+            if missing:
+                raise ValueError(f"Settlement file is missing columns: {', '.join(sorted(missing))}")
+            while True:
+                rows = [
+                    {c: row[c] for c in SETTLEMENT_COLUMNS}
+                    for row in islice(reader, RECONCILE_SORT_CHUNK_ROWS)
+                ]
+                if not rows:
+                    break
+                rows = [r for r in rows if r["order_id"]]
+                rows.sort(key=itemgetter("order_id"))
+                chunk = tempfile.TemporaryFile("w+", newline="")
+                csv.DictWriter(chunk, fieldnames=SETTLEMENT_COLUMNS).writerows(rows)
+                chunk.seek(0)
+                chunks.append(chunk)
+
+        readers = [csv.DictReader(chunk, fieldnames=SETTLEMENT_COLUMNS) for chunk in chunks]
+        yield from heapq.merge(*readers, key=itemgetter("order_id"))
+    finally:
+        for chunk in chunks:
+            chunk.close()
+
+
+def _gateway_orders(rows: Iterator[Dict[str, str]]) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """Collapse consecutive rows of one order into its deciding payment."""
+    current: Optional[Dict[str, str]] = None
+    for row in rows:
+        if current is not None and row["order_id"] != current["order_id"]:
+            yield current["order_id"], current
+            current = None
+        rank = _GATEWAY_STATUS_RANK.get(row["status"], -1)
+        if current is None or rank >= _GATEWAY_STATUS_RANK.get(current["status"], -1):
+            current = row
+    if current is not None:
+        yield current["order_id"], current
+
+
+class _Reconciler:
+    def __init__(self, report_file, fix: bool):
+        self.writer = csv.DictWriter(report_file, fieldnames=REPORT_COLUMNS)
+        self.writer.writeheader()
+        self.fix = fix
+        self.transaction_ops: List[UpdateOne] = []
+        self.order_ops: List[UpdateOne] = []
+        self.stats: Dict[str, int] = {"transactions": 0, "gateway_orders": 0, "fixed": 0}
+
+    def report(self, kind: str, fixed: bool = False, **fields: Any) -> None:
+        self.stats[kind] = self.stats.get(kind, 0) + 1
+        self.writer.writerow({"kind": kind, "fixed": fixed, **fields})
+
+    def compare(self, transaction: Dict[str, Any], gateway: Dict[str, str]) -> None:
+        fields = {
+            "razorpay_order_id": transaction["razorpay_order_id"],
+            "order_id": transaction.get("order_id"),
+            "db_status": transaction.get("status"),
+            "gateway_status": gateway["status"],
+            "db_amount": transaction.get("amount"),
+            "gateway_amount": gateway["amount"],
+        }
+        try:
+            amount_matches = round(float(gateway["amount"]), 2) == round(float(transaction.get("amount") or 0), 2)
+        except ValueError:
+            amount_matches = False
+        if not amount_matches:
+            self.report("amount_mismatch", **fields)
+
+        expected = GATEWAY_TO_TRANSACTION.get(gateway["status"])
+        if expected is None or expected == transaction.get("status"):
+            return
+        # Captures and refunds are authoritative; a gateway failure only
+        # overrides a transaction that never left "initiated".
+        fixable = expected in ("success", "refunded") or transaction.get("status") == "initiated"
+        fixed = self.fix and fixable
+        if fixed:
+            self._queue_fix(transaction, expected, gateway)
+        self.report("status_mismatch", fixed=fixed, **fields)
+
+    def _queue_fix(self, transaction: Dict[str, Any], expected: str, gateway: Dict[str, str]) -> None:
+        now = datetime.utcnow()
+        update = {"status": expected, "updated_at": now}
+        if gateway["payment_id"]:
+            update["razorpay_payment_id"] = gateway["payment_id"]
+        self.transaction_ops.append(UpdateOne({"id": transaction["id"]}, {"$set": update}))
+
+        payment_status = {"success": "completed", "failed": "failed"}.get(expected)
+        if payment_status:
+            self.order_ops.append(UpdateOne(
+                {"id": transaction.get("order_id"), "payment_status": {"$ne": "completed"}},
+                {"$set": {"payment_status": payment_status, "updated_at": now}},
+            ))
+        self.stats["fixed"] += 1
+
+    async def flush(self, force: bool = False) -> None:
+        if self.transaction_ops and (force or len(self.transaction_ops) >= RECONCILE_BATCH_SIZE):
+            await db.transactions.bulk_write(self.transaction_ops, ordered=False)
+            self.transaction_ops = []
+        if self.order_ops and (force or len(self.order_ops) >= RECONCILE_BATCH_SIZE):
+            await db.orders.bulk_write(self.order_ops, ordered=False)
+            self.order_ops = []
+
+
+async def reconcile(settlement_path: Path, report_path: Path, fix: bool = False) -> Dict[str, Any]:
+    """Reconcile transactions with a settlement export and write a discrepancy report."""
+    started = time.perf_counter()
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(report_path, "w", newline="") as report_file:
+        reconciler = _Reconciler(report_file, fix)
+        gateway = _gateway_orders(_sorted_settlement_rows(settlement_path))
+        current = next(gateway, None)
+        current_matched = False
+
+        cursor = (
+            db.transactions.find(
+                {"razorpay_order_id": {"$type": "string"}},
+                {"_id": 0, "id": 1, "order_id": 1, "razorpay_order_id": 1, "status": 1, "amount": 1},
+            )
+            .sort("razorpay_order_id", 1)
+            .batch_size(RECONCILE_BATCH_SIZE)
+        )
+        async for transaction in cursor:
+            reconciler.stats["transactions"] += 1
+            key = transaction["razorpay_order_id"]
+            while current is not None and current[0] < key:
+                if not current_matched:
+                    reconciler.report("missing_in_db", razorpay_order_id=current[0],
+                                      gateway_status=current[1]["status"], gateway_amount=current[1]["amount"])
+                reconciler.stats["gateway_orders"] += 1
+                current, current_matched = next(gateway, None), False
+
+            if current is not None and current[0] == key:
+                current_matched = True
+                reconciler.compare(transaction, current[1])
+            elif transaction.get("status") in ("success", "refunded"):
+                reconciler.report("missing_in_gateway", razorpay_order_id=key, order_id=transaction.get("order_id"),
+                                  db_status=transaction.get("status"), db_amount=transaction.get("amount"))
+            await reconciler.flush()
+
+        while current is not None:
+            if not current_matched:
+                reconciler.report("missing_in_db", razorpay_order_id=current[0],
+                                  gateway_status=current[1]["status"], gateway_amount=current[1]["amount"])
+            reconciler.stats["gateway_orders"] += 1
+            current, current_matched = next(gateway, None), False
+        await reconciler.flush(force=True)
+
+        # Orders still waiting on an online payment long after checkout
+        cutoff = datetime.utcnow() - timedelta(minutes=RECONCILE_STUCK_AFTER_MINUTES)
+        stuck = db.orders.find(
+            {"created_at": {"$lt": cutoff}, "payment_status": "pending", "payment_method": {"$ne": "cod"}},
+            {"_id": 0, "id": 1, "razorpay_order_id": 1, "total_amount": 1},
+        ).batch_size(RECONCILE_BATCH_SIZE)
+        async for order in stuck:
+            reconciler.report("stuck_pending", razorpay_order_id=order.get("razorpay_order_id"),
+                              order_id=order["id"], db_status="pending", db_amount=order.get("total_amount"))
+
+    elapsed = time.perf_counter() - started
+    stats = dict(reconciler.stats)
+    stats["elapsed_seconds"] = round(elapsed, 2)
+    stats["rows_per_second"] = round((stats["transactions"] + stats["gateway_orders"]) / elapsed) if elapsed else 0
+    logger.info("Reconciliation finished: %s", stats)
+    return stats
+
+
+_LEASE_ID = "reconcile"
+_HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+_BACKEND_DIR = Path(__file__).resolve().parents[2]
+
+
+async def _acquire_lease() -> bool:
+    """Take the reconciliation lease if it is free and the last run started
+    at least RECONCILE_INTERVAL_MINUTES ago."""
+    now = datetime.utcnow()
+    try:
+        lease = await db.cron_leases.find_one_and_update(
+            {
+                "_id": _LEASE_ID,
+                "locked_until": {"$lte": now},
+                "started_at": {"$lte": now - timedelta(minutes=RECONCILE_INTERVAL_MINUTES)},
+            },
+            {"$set": {
+                "holder": _HOLDER,
+                "locked_until": now + timedelta(seconds=RECONCILE_LEASE_SECONDS),
+                "started_at": now,
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # The lease exists but is held, or the last run is too recent
+        return False
+    return lease is not None
+
+
+async def _renew_lease() -> None:
+    while True:
+        await asyncio.sleep(RECONCILE_LEASE_SECONDS / 3)
+        await db.cron_leases.update_one(
+            {"_id": _LEASE_ID, "holder": _HOLDER},
+            {"$set": {"locked_until": datetime.utcnow() + timedelta(seconds=RECONCILE_LEASE_SECONDS)}},
+        )
+
+
+async def _release_lease() -> None:
+    await db.cron_leases.update_one(
+        {"_id": _LEASE_ID, "holder": _HOLDER}, {"$set": {"locked_until": datetime.utcnow()}}
+    )
+
+
+async def _run_scheduled() -> None:
+    report_path = Path(RECONCILE_REPORT_DIR) / f"reconciliation-{datetime.utcnow():%Y%m%dT%H%M%S}.csv"
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "packages.cron.reconcile",
+        "--settlement", str(Path(RECONCILE_SETTLEMENT_PATH).resolve()),
+        "--report", str(report_path.resolve()),
+        "--fix",
+        cwd=_BACKEND_DIR,
+    )
+    try:
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    if returncode != 0:
+        logger.error("Scheduled reconciliation exited with status %d", returncode)
+
+
+async def run_reconciliation_schedule() -> None:
+    """Reconcile RECONCILE_SETTLEMENT_PATH every RECONCILE_INTERVAL_MINUTES, fixing statuses."""
+    while True:
+        await asyncio.sleep(min(RECONCILE_INTERVAL_MINUTES * 60, 60))
+        try:
+            if not await _acquire_lease():
+                continue
+            renewer = asyncio.create_task(_renew_lease())
+            try:
+                await _run_scheduled()
+            finally:
+                renewer.cancel()
+                await _release_lease()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Scheduled reconciliation failed")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reconcile transactions against a gateway settlement export")
+    parser.add_argument("--settlement", required=True, type=Path, help="settlement export CSV")
+    parser.add_argument("--report", required=True, type=Path, help="where to write the discrepancy report")
+    parser.add_argument("--fix", action="store_true", help="correct statuses the gateway is authoritative for")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stats = asyncio.run(reconcile(args.settlement, args.report, fix=args.fix))
+    for key, value in stats.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
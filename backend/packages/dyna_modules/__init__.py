@@ -0,0 +1 @@
+# Dynamic modules: reusable runtime helpers (caches)
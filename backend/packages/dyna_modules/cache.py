@@ -0,0 +1,108 @@
+"""In-process read caching: singleflight plus a bounded TTL cache.
+
+`SingleFlight` lets concurrent callers with the same key share one in-flight
+call. `TTLCache` keeps results for a short time under a byte budget (least
+recently used entries are evicted first) and drops entries by tag when the
+data behind them changes. `CoalescingCache` combines the two: a miss is
+computed once however many requests are waiting on it, then served from
+memory until it expires or is invalidated.
+"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Tuple
+import asyncio
+import time
+
+from ..context.metrics import Counter
+
+CACHE_REQUESTS = Counter("cache_requests_total", "In-process cache lookups by result", ("cache", "result"))
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `fn` unless a call for `key` is already running; either way
+        return (or raise) that call's result. A cancelled caller does not
+        cancel the shared call."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+
+class TTLCache:
+    def __init__(self, ttl_seconds: float, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        # key -> (expires_at, value, size, tags)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, int, frozenset]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any, size: int, tags: Iterable[str] = ()) -> None:
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value, size, frozenset(tags))
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, *tags: str) -> None:
+        """Drop every entry tagged with any of `tags`."""
+        tags = set(tags)
+        for key in [k for k, entry in self._entries.items() if entry[3] & tags]:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        self.size_bytes -= self._entries.pop(key)[2]
+
+
+class CoalescingCache:
+    """TTLCache of byte buffers filled through SingleFlight."""
+
+    def __init__(self, name: str, ttl_seconds: float, max_bytes: int):
+        self.name = name
+        self.cache = TTLCache(ttl_seconds, max_bytes)
+        self.flight = SingleFlight()
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable[bytes]],
+                          tags: Iterable[str] = ()) -> bytes:
+        value = self.cache.get(key)
+        if value is not None:
+            CACHE_REQUESTS.inc(self.name, "hit")
+            return value
+        CACHE_REQUESTS.inc(self.name, "coalesced" if self.flight.in_flight(key) else "miss")
+
+        async def fill() -> bytes:
+            body = await load()
+            self.cache.put(key, body, len(body), tags)
+            return body
+
+        return await self.flight.do(key, fill)
+
+    def invalidate(self, *tags: str) -> None:
+        self.cache.invalidate(*tags)
@@ -0,0 +1 @@
+# Self-contained runnable modules
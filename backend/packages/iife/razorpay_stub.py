@@ -0,0 +1,77 @@
+"""Local stand-in for the Razorpay orders API.
+
+Run with `python -m packages.iife.razorpay_stub` and set
+RAZORPAY_API_BASE=http://localhost:9090/v1 for the backend. STUB_LATENCY_MS,
+STUB_FAILURE_RATE and STUB_FAIL_FIRST inject delay and 503s to exercise
+timeouts, retries and the circuit breaker; tests/test_gateway.py does so.
+"""
+import asyncio
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+STUB_PORT = int(os.getenv("STUB_PORT", 9090))
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", 0))
+STUB_FAILURE_RATE = float(os.getenv("STUB_FAILURE_RATE", 0))
+# Fail this many requests with 503 before serving normally
+STUB_FAIL_FIRST = int(os.getenv("STUB_FAIL_FIRST", 0))
+
+app = FastAPI()
+orders: dict = {}
+stats = {"requests": 0}
+
+
+def _error(status_code: int, code: str, description: str) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"error": {"code": code, "description": description}})
+
+
+@app.middleware("http")
+async def _simulate_gateway(request: Request, call_next):
+    if not request.headers.get("authorization", "").startswith("Basic "):
+        return _error(401, "BAD_REQUEST_ERROR", "Authentication failed")
+    stats["requests"] += 1
+    if STUB_LATENCY_MS:
+        await asyncio.sleep(STUB_LATENCY_MS / 1000)
+    if stats["requests"] <= STUB_FAIL_FIRST or random.random() < STUB_FAILURE_RATE:
+        return _error(503, "SERVER_ERROR", "Service unavailable")
+    return await call_next(request)
+
+
+@app.post("/v1/orders")
+async def create_order(payload: dict):
+    order = {
+        "id": f"order_{uuid.uuid4().hex[:14]}",
+        "entity": "order",
+        "amount": payload["amount"],
+        "amount_paid": 0,
+        "amount_due": payload["amount"],
+        "currency": payload.get("currency", "INR"),
+        "receipt": payload.get("receipt"),
+        "status": "created",
+        "attempts": 0,
+        "notes": payload.get("notes", {}),
+        "created_at": int(time.time()),
+    }
+    orders[order["id"]] = order
+    return order
+
+
+@app.get("/v1/orders/{order_id}")
+async def fetch_order(order_id: str):
+    if order_id not in orders:
+        return _error(400, "BAD_REQUEST_ERROR", "The id provided does not exist")
+    return orders[order_id]
+
+
+@app.get("/v1/orders/{order_id}/payments")
+async def fetch_order_payments(order_id: str):
+    return {"entity": "collection", "count": 0, "items": []}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=STUB_PORT)
@@ -0,0 +1,63 @@
+"""Show which replica set members serve each read profile.
+
+Runs a batch of catalog-style reads through every profile from `get_db` and
+counts the servers that answered, using a command listener on a dedicated
+client. Start a local replica set with
+
+    docker compose -f docker-compose.replset.yml up -d
+
+then run, from backend/,
+
+    MONGO_URL="mongodb://localhost:27021,localhost:27022,localhost:27023/?replicaSet=rs0" \\
+        python -m packages.iife.read_routing_check
+"""
+from collections import Counter
+import asyncio
+import os
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from ..context.db import MONGO_DB, MONGO_URI, mongo_settings, read_profile_options
+from ..context.mongo_settings import ReadProfile
+
+CHECK_READS = int(os.getenv("CHECK_READS", 200))
+
+
+class _ServedBy(monitoring.CommandListener):
+    def __init__(self):
+        self.counts: Counter = Counter()
+
+    def started(self, event):
+        if event.command_name == "find":
+            host, port = event.connection_id
+            self.counts[f"{host}:{port}"] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def main() -> None:
+    listener = _ServedBy()
+    check_client = AsyncIOMotorClient(MONGO_URI, event_listeners=[listener], **mongo_settings.client_options())
+    hello = await check_client.admin.command("hello")
+    print(f"replica set: {hello.get('setName', '(standalone)')}, primary: {hello.get('primary', '-')}")
+
+    profiles = {"primary": ReadProfile(read_preference="primary"), **mongo_settings.read_profiles}
+    for name, profile in profiles.items():
+        # Same options as get_db(name), bound to the listening client
+        profile_db = check_client.get_database(MONGO_DB, **read_profile_options(profile))
+        listener.counts.clear()
+        for _ in range(CHECK_READS):
+            await profile_db.pharmacies.find_one({}, {"_id": 0, "id": 1})
+        print(f"{name}: {profile}")
+        for server, count in sorted(listener.counts.items()):
+            print(f"  {server}: {count}")
+    check_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""Compare the per-document Pydantic read path with `trusted_rows` + orjson.
+
+Serves BENCH_ROWS medicine documents through two in-process endpoints, one
+building a `Medicine` per document and validating again through
+`response_model` (the old handlers), one returning
+`FastJSONResponse(trusted_rows(...))`. Checks that both produce the same
+JSON, then reports CPU time per response over BENCH_RUNS requests. Run, from
+backend/,
+
+    python -m packages.iife.serialization_bench
+"""
+from datetime import datetime
+from typing import List
+import asyncio
+import os
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI
+
+from ..context.models import Medicine
+from ..context.serialization import FastJSONResponse, trusted_rows
+
+BENCH_ROWS = int(os.getenv("BENCH_ROWS", 1000))
+BENCH_RUNS = int(os.getenv("BENCH_RUNS", 50))
+
+# A short base64 JPEG prefix stands in for the inline product images
+_IMAGE = "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAAYEBQYFBAYGBQYHBwYIChAKCgkJChQODwwQFxQYGBcUFhYaHSUfGhsjHBYWICwgIyYnKSopGR8tMC0oMCUoKSj" * 3
+
+
+def _documents(count: int) -> List[dict]:
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "pharmacy_id": "bench",
+            "name": f"Medicine {i}",
+            "description": "Effective treatment " * 3,
+            "price": 50.0 + i,
+            "mrp": 70.0 + i,
+            "discount_percentage": 10.0,
+            "stock_quantity": 50,
+            "category": "Vitamins",
+            "image": _IMAGE,
+            "prescription_required": False,
+            "created_at": datetime.utcnow(),
+        }
+        for i in range(count)
+    ]
+
+
+def _app(docs: List[dict]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/validated", response_model=List[Medicine])
+    async def validated():
+        return [Medicine(**doc) for doc in docs]
+
+    @app.get("/trusted", response_model=List[Medicine])
+    async def trusted():
+        return FastJSONResponse(trusted_rows(Medicine, docs))
+
+    return app
+
+
+async def main() -> None:
+    app = _app(_documents(BENCH_ROWS))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        validated = (await client.get("/validated")).json()
+        trusted = (await client.get("/trusted")).json()
+        assert validated == trusted, "the two read paths produce different JSON"
+
+        print(f"{BENCH_ROWS} documents, {BENCH_RUNS} runs")
+        for path in ("/validated", "/trusted"):
+            started = time.process_time()
+            for _ in range(BENCH_RUNS):
+                await client.get(path)
+            cpu_ms = (time.process_time() - started) / BENCH_RUNS * 1000
+            print(f"  {path}: {cpu_ms:.1f} ms CPU per response")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
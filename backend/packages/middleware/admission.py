@@ -0,0 +1,218 @@
+"""Adaptive admission control by route class.
+
+Each route class has its own concurrency limit, adjusted with AIMD from the
+latency of the requests it admits: a completion within the class's latency
+target raises the limit by 1/limit (about +1 per limit's worth of requests),
+one over target cuts it by ADMISSION_BACKOFF, at most once per round trip.
+Requests beyond the limit wait in a bounded FIFO for the class's queue
+timeout and are then shed with a fast 503 and Retry-After, instead of piling
+up on the event loop until clients time out.
+
+Priority: while a higher-priority class (checkout, payments) has requests
+waiting, lower classes only get half of their limit, both for new requests
+and for handing freed slots to their queue, which hands database capacity to
+the requests that make money.
+"""
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic
+from typing import Callable, Deque, Dict, Optional
+import asyncio
+import os
+
+from fastapi import FastAPI
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..context.metrics import Counter, Gauge, Histogram
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1").lower() in ("1", "true", "yes")
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", 0.9))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 1))
+# Share of its limit a class keeps while a higher-priority class is queueing
+ADMISSION_YIELD_FRACTION = float(os.getenv("ADMISSION_YIELD_FRACTION", 0.5))
+
+ADMISSION_LIMIT = Gauge("admission_concurrency_limit", "Current adaptive concurrency limit", ("route_class",))
+ADMISSION_IN_FLIGHT = Gauge("admission_in_flight", "Admitted requests in progress", ("route_class",))
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Requests shed with 503", ("route_class", "reason"))
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds", "Time admitted requests waited for a slot", ("route_class",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0),
+)
+
+
+def _env(name: str, key: str, default: float) -> float:
+    return float(os.getenv(f"ADMISSION_{name.upper()}_{key}", default))
+
+
+@dataclass(frozen=True)
+class RouteClass:
+    name: str
+    priority: int  # lower is more important
+    target_ms: float
+    queue_timeout_ms: float
+    initial_limit: int = 32
+    min_limit: int = 2
+    max_limit: int = 512
+
+    @classmethod
+    def from_env(cls, name: str, priority: int, target_ms: float, queue_timeout_ms: float) -> "RouteClass":
+        return cls(
+            name=name,
+            priority=priority,
+            target_ms=_env(name, "TARGET_MS", target_ms),
+            queue_timeout_ms=_env(name, "QUEUE_TIMEOUT_MS", queue_timeout_ms),
+            initial_limit=int(_env(name, "INITIAL_LIMIT", 32)),
+            min_limit=int(_env(name, "MIN_LIMIT", 2)),
+            max_limit=int(_env(name, "MAX_LIMIT", 512)),
+        )
+
+
+ROUTE_CLASSES = {
+    c.name: c for c in (
+        RouteClass.from_env("payments", priority=0, target_ms=1500, queue_timeout_ms=3000),
+        RouteClass.from_env("checkout", priority=0, target_ms=1000, queue_timeout_ms=3000),
+        RouteClass.from_env("auth", priority=1, target_ms=800, queue_timeout_ms=1000),
+        RouteClass.from_env("cart", priority=1, target_ms=300, queue_timeout_ms=500),
+        RouteClass.from_env("catalog", priority=2, target_ms=250, queue_timeout_ms=100),
+    )
+}
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    if path.startswith("/api/payments"):
+        return "payments"
+    if path == "/api/orders" and method == "POST":
+        return "checkout"
+    if path in ("/api/login", "/api/register"):
+        return "auth"
+    if path.startswith("/api/cart") and method != "GET":
+        return "cart"
+    if method == "GET" and path.startswith(("/api/pharmacies", "/api/medicines")):
+        return "catalog"
+    return None
+
+
+class AIMDLimiter:
+    def __init__(self, route_class: RouteClass, yielding: Callable[[], bool] = lambda: False):
+        self.route_class = route_class
+        # Whether a higher-priority class is queueing right now
+        self.yielding = yielding
+        self.limit = float(route_class.initial_limit)
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        ADMISSION_LIMIT.set(self.limit, route_class.name)
+
+    def _capacity(self, yielding: bool) -> int:
+        limit = self.limit * ADMISSION_YIELD_FRACTION if yielding else self.limit
+        return max(int(limit), 1)
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot; returns None when admitted, else the reason for shedding."""
+        yielding = self.yielding()
+        capacity = self._capacity(yielding)
+        if self.in_flight < capacity and not self.waiters:
+            self._admit()
+            return None
+        if yielding:
+            return "priority"
+        if len(self.waiters) >= capacity:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        started = monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.route_class.queue_timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            return "timeout"
+        except asyncio.CancelledError:
+            # Client went away; hand back a slot granted in the meantime
+            if waiter.done() and not waiter.cancelled():
+                self.release(monotonic(), 0.0, adjust=False)
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+        ADMISSION_QUEUE_WAIT.observe(monotonic() - started, self.route_class.name)
+        return None
+
+    def _admit(self) -> None:
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.inc(self.route_class.name)
+
+    def release(self, started: float, latency: float, adjust: bool = True) -> None:
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.dec(self.route_class.name)
+        rc = self.route_class
+        if not adjust:
+            pass
+        elif latency * 1000 > rc.target_ms:
+            # Requests that started before the last cut already reflect it
+            if started > self._last_decrease:
+                self.limit = max(rc.min_limit, self.limit * ADMISSION_BACKOFF)
+                self._last_decrease = monotonic()
+        elif self.in_flight + 1 >= self.limit / 2:
+            # Only grow while the limit is actually being used
+            self.limit = min(rc.max_limit, self.limit + 1 / self.limit)
+        ADMISSION_LIMIT.set(self.limit, rc.name)
+
+        capacity = self._capacity(self.yielding())
+        while self.waiters and self.in_flight < capacity:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self._admit()
+                waiter.set_result(None)
+
+
+class AdmissionMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.limiters: Dict[str, AIMDLimiter] = {
+            name: AIMDLimiter(rc, lambda priority=rc.priority: self._higher_priority_waiting(priority))
+            for name, rc in ROUTE_CLASSES.items()
+        }
+
+    def _higher_priority_waiting(self, priority: int) -> bool:
+        return any(
+            limiter.waiters for limiter in self.limiters.values()
+            if limiter.route_class.priority < priority
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        name = classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters[name]
+        rejected = await limiter.acquire()
+        if rejected is not None:
+            ADMISSION_REJECTED.inc(name, rejected)
+            await _send_busy(send)
+            return
+
+        started = monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(started, monotonic() - started)
+
+
+async def _send_busy(send: Send) -> None:
+    body = b'{"detail":"Server is busy, please retry shortly"}'
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(ADMISSION_RETRY_AFTER_SECONDS).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def apply_admission(app: FastAPI):
+    if ADMISSION_ENABLED:
+        app.add_middleware(AdmissionMiddleware)
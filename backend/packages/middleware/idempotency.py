@@ -0,0 +1,223 @@
+"""Idempotency-Key support for non-idempotent POSTs.
+
+A client that sends `Idempotency-Key` on one of IDEMPOTENT_ROUTES gets the
+first response replayed for every retry with the same key, instead of a new
+order or gateway order being created. Keys are scoped to the authenticated
+user and bound to a fingerprint of the request, so reusing a key for a
+different request is rejected.
+
+Completed responses live in the `idempotency_keys` TTL collection with a
+small in-process LRU in front of it. Duplicates arriving while the first
+request is still running wait for it in-process. Across workers they get
+409 while the first request holds its lock; a lock that is not released
+within IDEMPOTENCY_LOCK_SECONDS (the worker crashed) is taken over by the
+next retry.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+
+from fastapi import FastAPI
+from pymongo.errors import DuplicateKeyError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..context.db import db
+from ..context.indexes import Index, register_indexes
+from ..context.security import token_subject
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 2048))
+# Longest a request may hold its key before a retry may take it over
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 60))
+
+IDEMPOTENT_ROUTES = {
+    ("POST", "/api/orders"),
+    ("POST", "/api/payments/create-razorpay-order"),
+}
+
+register_indexes(
+    Index("idempotency_keys", "created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS),
+)
+
+
+def _json_error(status_code: int, detail: str, extra_headers: Optional[list] = None) -> Dict[str, Any]:
+    body = ('{"detail":"%s"}' % detail).encode()
+    headers = [["content-type", "application/json"], ["content-length", str(len(body))]]
+    return {"status_code": status_code, "headers": headers + (extra_headers or []), "body": body}
+
+
+class _ResponseCache:
+    """Bounded LRU of completed responses, expiring with the TTL collection."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, record = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return record
+
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        self._entries[key] = (time.monotonic() + IDEMPOTENCY_TTL_SECONDS, record)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.cache = _ResponseCache(IDEMPOTENCY_CACHE_SIZE)
+        self.inflight: Dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in IDEMPOTENT_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        key = headers.get(b"idempotency-key")
+        caller = token_subject(headers.get(b"authorization", b"").decode("latin-1")) if key else None
+        if not caller:
+            # Unauthenticated requests are rejected by the route itself
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        record_id = f"{caller}:{key.decode('latin-1')}"
+        fingerprint = hashlib.sha256(
+            b"\0".join([scope["method"].encode(), scope["path"].encode(), scope["query_string"], body])
+        ).hexdigest()
+
+        while True:
+            record = self.cache.get(record_id)
+            if record is not None:
+                await _replay(record, fingerprint, send)
+                return
+
+            pending = self.inflight.get(record_id)
+            if pending is None:
+                break
+            record = await asyncio.shield(pending)
+            if record is not None:
+                await _replay(record, fingerprint, send)
+                return
+            # The first attempt failed without a replayable response; run again
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[record_id] = future
+        record = None
+        try:
+            record = await self._execute(scope, body, receive, send, record_id, fingerprint)
+        finally:
+            del self.inflight[record_id]
+            future.set_result(record)
+
+    async def _execute(self, scope, body, receive, send, record_id, fingerprint) -> Optional[Dict[str, Any]]:
+        owner = uuid.uuid4().hex
+        now = datetime.utcnow()
+        lock = {"state": "in_progress", "owner": owner, "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}
+        try:
+            await db.idempotency_keys.insert_one({"_id": record_id, "fingerprint": fingerprint, "created_at": now, **lock})
+        except DuplicateKeyError:
+            # Take over a key whose holder died without completing or releasing it
+            taken = await db.idempotency_keys.find_one_and_update(
+                {"_id": record_id, "state": "in_progress", "locked_until": {"$lte": now}},
+                {"$set": {"fingerprint": fingerprint, **lock}},
+            )
+            if taken is None:
+                stored = await db.idempotency_keys.find_one({"_id": record_id})
+                if stored and stored["state"] == "completed":
+                    record = {k: stored[k] for k in ("fingerprint", "status_code", "headers", "body")}
+                    self.cache.put(record_id, record)
+                    await _replay(record, fingerprint, send)
+                    return record
+                await _send_record(_json_error(409, "A request with this Idempotency-Key is in progress",
+                                               [["retry-after", "1"]]), send)
+                return None
+
+        response: Dict[str, Any] = {"status_code": 500, "headers": [], "body": b""}
+        chunks = []
+
+        async def capture(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                response["status_code"] = message["status"]
+                response["headers"] = [[k.decode("latin-1"), v.decode("latin-1")] for k, v in message["headers"]]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, _replay_body(body, receive), capture)
+        except BaseException:
+            await db.idempotency_keys.delete_one({"_id": record_id, "owner": owner})
+            raise
+
+        if response["status_code"] >= 500:
+            # Server errors are not stored so the client can retry for real
+            await db.idempotency_keys.delete_one({"_id": record_id, "owner": owner})
+            return None
+
+        record = {"fingerprint": fingerprint, **response, "body": b"".join(chunks)}
+        await db.idempotency_keys.update_one(
+            {"_id": record_id, "owner": owner},
+            {"$set": {"state": "completed", **{k: record[k] for k in ("status_code", "headers", "body")}},
+             "$unset": {"locked_until": ""}},
+        )
+        self.cache.put(record_id, record)
+        return record
+
+
+async def _read_body(receive: Receive) -> bytes:
+    parts = []
+    while True:
+        message = await receive()
+        parts.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(parts)
+
+
+def _replay_body(body: bytes, receive: Receive) -> Receive:
+    sent = False
+
+    async def wrapped() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return wrapped
+
+
+async def _replay(record: Dict[str, Any], fingerprint: str, send: Send) -> None:
+    if record["fingerprint"] != fingerprint:
+        await _send_record(_json_error(422, "Idempotency-Key was already used for a different request"), send)
+        return
+    headers = record["headers"] + [["idempotent-replayed", "true"]]
+    await _send_record({**record, "headers": headers}, send)
+
+
+async def _send_record(record: Dict[str, Any], send: Send) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": record["status_code"],
+        "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in record["headers"]],
+    })
+    await send({"type": "http.response.body", "body": bytes(record["body"])})
+
+
+def apply_idempotency(app: FastAPI):
+    app.add_middleware(IdempotencyMiddleware)
@@ -0,0 +1,46 @@
+from time import perf_counter
+
+from fastapi import FastAPI
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..context.metrics import HTTP_IN_PROGRESS, HTTP_LATENCY, HTTP_REQUESTS
+
+
+class MetricsMiddleware:
+    """Records request count, status and latency per route template.
+
+    The route is read from `scope["route"]` after the handler ran, so
+    `/orders/{order_id}` is one series rather than one per order id.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = perf_counter() - started
+            HTTP_IN_PROGRESS.dec()
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            HTTP_LATENCY.observe(elapsed, scope["method"], route_path)
+            HTTP_REQUESTS.inc(scope["method"], route_path, str(status_code))
+
+
+def apply_metrics(app: FastAPI):
+    app.add_middleware(MetricsMiddleware)
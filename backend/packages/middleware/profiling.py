@@ -0,0 +1,77 @@
+"""Turns the request profiler on for selected requests.
+
+On demand: an admin (bearer token for a user in ADMIN_USERNAMES) sends
+`X-Profile: 1` or `?__profile=1`. The response carries `X-Profile-Id`; the
+collapsed stacks are at `GET /api/admin/profiles/{id}`.
+
+Sampled: with PROFILE_SAMPLE_EVERY=N, every Nth request of each route is
+profiled into a rolling per-route store; `GET /api/admin/profiles/aggregate`
+merges a route's samples into one flamegraph input.
+"""
+from typing import Dict, Tuple
+import os
+
+from fastapi import FastAPI
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..context.profiler import profiler
+from ..context.security import is_admin_token
+
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", 0))
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp, router: Router):
+        self.app = app
+        self.router = router
+        self._route_counts: Dict[Tuple[str, str], int] = {}
+
+    def _requested(self, scope: Scope) -> bool:
+        headers = dict(scope["headers"])
+        flagged = headers.get(b"x-profile") in (b"1", b"true") or b"__profile=1" in scope["query_string"]
+        return flagged and is_admin_token(headers.get(b"authorization", b"").decode("latin-1"))
+
+    def _sample_due(self, scope: Scope) -> bool:
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                key = (scope["method"], getattr(route, "path", ""))
+                n = self._route_counts.get(key, 0) + 1
+                self._route_counts[key] = n
+                return n % PROFILE_SAMPLE_EVERY == 0
+        return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self._requested(scope):
+            kind = "on_demand"
+        elif PROFILE_SAMPLE_EVERY > 0 and self._sample_due(scope):
+            kind = "sampled"
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        session = profiler.start(kind, scope["method"], scope["path"])
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                session.status_code = message["status"]
+                if kind == "on_demand":
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"x-profile-id", session.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            session.route = route.path if route is not None else None
+            profiler.stop(session)
+
+
+def apply_profiling(app: FastAPI):
+    app.add_middleware(ProfilingMiddleware, router=app.router)
@@ -0,0 +1,86 @@
+"""Token-bucket rate limits for expensive or abusable endpoints.
+
+Each entry of RATE_LIMITS names a route, a limit ("<count>/<period>",
+overridable through the listed env variable) and what the bucket is keyed
+by: the authenticated user, or the client IP for anonymous endpoints. Set
+RATE_LIMIT_TRUST_FORWARDED=1 behind a proxy that sets X-Forwarded-For.
+Requests over the limit get 429 with Retry-After.
+"""
+from typing import Optional
+import os
+
+from fastapi import FastAPI
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..context.metrics import Counter
+from ..context.rate_limit import RateLimit, rate_limit_backend
+from ..context.security import token_subject
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").lower() in ("1", "true", "yes")
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0").lower() in ("1", "true", "yes")
+
+RATE_LIMITS = {
+    ("POST", "/api/login"): RateLimit.parse(os.getenv("RATE_LIMIT_LOGIN", "10/minute"), key="ip"),
+    ("POST", "/api/register"): RateLimit.parse(os.getenv("RATE_LIMIT_REGISTER", "5/minute"), key="ip"),
+    ("POST", "/api/init-data"): RateLimit.parse(os.getenv("RATE_LIMIT_INIT_DATA", "2/minute"), key="ip"),
+    ("POST", "/api/payments/create-razorpay-order"): RateLimit.parse(
+        os.getenv("RATE_LIMIT_CREATE_PAYMENT", "20/minute"), key="user"
+    ),
+    ("GET", "/api/pharmacies"): RateLimit.parse(os.getenv("RATE_LIMIT_PHARMACIES", "120/minute"), key="ip"),
+}
+
+RATE_LIMITED = Counter("http_rate_limited_total", "Requests rejected by rate limits", ("route",))
+
+
+def _client_ip(scope: Scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _user(scope: Scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            return token_subject(value.decode("latin-1"))
+    return None
+
+
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limit = RATE_LIMITS.get((scope["method"], scope["path"])) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        user = _user(scope) if limit.key == "user" else None
+        subject = f"user:{user}" if user else f"ip:{_client_ip(scope)}"
+        allowed, tokens = await rate_limit_backend.take(f"{scope['method']} {scope['path']}|{subject}", limit)
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+
+        RATE_LIMITED.inc(scope["path"])
+        body = b'{"detail":"Too many requests"}'
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(limit.retry_after(tokens)).encode()),
+                (b"x-ratelimit-limit", str(limit.burst).encode()),
+                (b"x-ratelimit-remaining", b"0"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def apply_rate_limit(app: FastAPI):
+    if RATE_LIMIT_ENABLED:
+        app.add_middleware(RateLimitMiddleware)
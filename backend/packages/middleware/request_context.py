@@ -0,0 +1,51 @@
+from typing import Optional
+import uuid
+
+from fastapi import FastAPI
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..context.request_context import reset_request_id, reset_scope, set_request_id, set_scope
+
+MAX_REQUEST_ID_LENGTH = 64
+
+
+def _incoming_request_id(scope: Scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"x-request-id":
+            request_id = value.decode("latin-1")
+            if 0 < len(request_id) <= MAX_REQUEST_ID_LENGTH and request_id.isprintable():
+                return request_id
+    return None
+
+
+class RequestContextMiddleware:
+    """Publishes the ASGI scope and a request id of the current request to
+    context variables. The id is taken from `X-Request-ID` when the caller
+    sends one, otherwise generated, and echoed on the response."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = _incoming_request_id(scope) or uuid.uuid4().hex
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        scope_token = set_scope(scope)
+        request_id_token = set_request_id(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            reset_request_id(request_id_token)
+            reset_scope(scope_token)
+
+
+def apply_request_context(app: FastAPI):
+    app.add_middleware(RequestContextMiddleware)
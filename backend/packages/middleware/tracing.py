@@ -0,0 +1,61 @@
+from fastapi import FastAPI
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..context.security import is_admin_token
+from ..context.tracing import TRACE_TRUST_TRACEPARENT, end_root_span, start_root_span
+
+
+class TracingMiddleware:
+    """Opens the root span of each sampled request.
+
+    The span is renamed to the route template once routing has run, and
+    sampled responses carry `X-Trace-Id` for looking the trace up at
+    `GET /api/admin/traces/{trace_id}`. A `traceparent` may force sampling
+    only with TRACE_TRUST_TRACEPARENT or an admin token.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1") or None
+        trusted = TRACE_TRUST_TRACEPARENT or (
+            traceparent is not None and is_admin_token(headers.get(b"authorization", b"").decode("latin-1"))
+        )
+        span, token = start_root_span(
+            f"{scope['method']} {scope['path']}", traceparent, trusted,
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        if not span.recording:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.set_error(f"HTTP {message['status']}")
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"x-trace-id", span.trace.trace_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                span.name = f"{scope['method']} {route.path}"
+                span.set_attribute("http.route", route.path)
+            end_root_span(span, token)
+
+
+def apply_tracing(app: FastAPI):
+    app.add_middleware(TracingMiddleware)
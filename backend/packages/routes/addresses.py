@@ -3,13 +3,20 @@ from typing import List
 from ..context.db import db
 from ..context.models import Address, AddressCreate
 from ..context.security import get_current_user
+from ..context.serialization import FastJSONResponse, trusted_rows
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["addresses"])
 
+register_indexes(
+    Index("addresses", "id", unique=True, query={"id": "?", "user_id": "?"}),
+    Index("addresses", "user_id", query={"user_id": "?"}),
+)
+
 @router.get("/addresses", response_model=List[Address])
 async def get_addresses(current_user: dict = Depends(get_current_user)):
-    addresses = await db.addresses.find({"user_id": current_user["id"]}).to_list(1000)
-    return [Address(**addr) for addr in addresses]
+    addresses = await db.addresses.find({"user_id": current_user["id"]}, {"_id": 0}).to_list(1000)
+    return FastJSONResponse(trusted_rows(Address, addresses))
 
 @router.post("/addresses", response_model=Address)
 async def create_address(address: AddressCreate, current_user: dict = Depends(get_current_user)):
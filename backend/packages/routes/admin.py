@@ -0,0 +1,75 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from ..context.db import db, pool_stats
+from ..context.loop_monitor import recent_stalls
+from ..context.models import UserPharmaciesRequest
+from ..context.profiler import profiler
+from ..context.tracing import exporter as trace_exporter
+from ..context.security import require_admin
+from ..context.slow_queries import slow_queries
+
+router = APIRouter(tags=["admin"], dependencies=[Depends(require_admin)])
+
+@router.get("/admin/slow-queries")
+async def get_slow_queries(limit: int = 20):
+    """Slowest MongoDB command shapes since startup, by total time spent."""
+    return slow_queries.top(min(limit, 200))
+
+@router.delete("/admin/slow-queries")
+async def reset_slow_queries():
+    slow_queries.reset()
+    return {"message": "Slow query statistics reset"}
+
+@router.put("/admin/users/{user_id}/pharmacies")
+async def set_user_pharmacies(user_id: str, request: UserPharmaciesRequest):
+    """Set the pharmacies whose orders a user may move (`pharmacy_ids`); an
+    empty list revokes them all."""
+    pharmacy_ids = sorted(set(request.pharmacy_ids))
+    if await db.pharmacies.count_documents({"id": {"$in": pharmacy_ids}}) != len(pharmacy_ids):
+        raise HTTPException(status_code=400, detail="Unknown pharmacy")
+    result = await db.users.update_one({"id": user_id}, {"$set": {"pharmacy_ids": pharmacy_ids}})
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"user_id": user_id, "pharmacy_ids": pharmacy_ids}
+
+@router.get("/admin/db-pool")
+async def get_db_pool():
+    """MongoDB pool configuration and live connection usage per server."""
+    return pool_stats()
+
+@router.get("/admin/loop-stalls")
+async def get_loop_stalls(limit: int = 20):
+    """Recent event loop stalls with the loop thread's stack at detection."""
+    return recent_stalls(min(limit, 50))
+
+@router.get("/admin/profiles")
+async def list_profiles(route: Optional[str] = None):
+    """Stored request profiles, newest first."""
+    return profiler.list(route)
+
+@router.get("/admin/profiles/aggregate", response_class=PlainTextResponse)
+async def aggregate_profiles(route: str):
+    """Sampled profiles of one route merged into a collapsed-stack file."""
+    return profiler.aggregate(route)
+
+@router.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str):
+    """Collapsed stacks of one profiled request (flamegraph.pl / speedscope input)."""
+    session = profiler.get(profile_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return session.collapsed()
+
+@router.get("/admin/traces")
+async def list_traces(limit: int = 50):
+    """Recently finished sampled traces, newest first."""
+    return trace_exporter.recent(min(limit, 500))
+
+@router.get("/admin/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """One trace as an OTLP/JSON ExportTraceServiceRequest."""
+    trace = trace_exporter.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
@@ -3,9 +3,16 @@ from datetime import timedelta
 from ..context.db import db
 from ..context.models import UserCreate, User, Token
 from ..context.security import get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["auth"])
 
+register_indexes(
+    Index("users", "username", unique=True, query={"username": "?"}),
+    Index("users", "id", unique=True, query={"id": "?"}),
+    Index("users", "email", query={"email": "?"}),
+)
+
 @router.post("/register", response_model=Token)
 async def register(user: UserCreate):
     existing_user = await db.users.find_one({"$or": [{"username": user.username}, {"email": user.email}]})
@@ -3,11 +3,17 @@ from typing import Optional
 from ..context.db import db
 from ..context.models import Cart, CartItem
 from ..context.security import get_current_user
+from ..context.loader import Loaders, request_loaders
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["cart"])
 
+register_indexes(
+    Index("carts", "user_id", unique=True, query={"user_id": "?"}),
+)
+
 @router.get("/cart", response_model=Optional[Cart])
-async def get_cart(current_user: dict = Depends(get_current_user)):
+async def get_cart(current_user: dict = Depends(get_current_user), loaders: Loaders = Depends(request_loaders)):
     """
     Return the user's cart. If any cart items reference medicines that no longer exist
     (e.g., after re-initializing seed data), those items are pruned and the cart total
@@ -23,11 +29,8 @@ async def get_cart(current_user: dict = Depends(get_current_user)):
         return None
 
     # Filter out items whose medicine no longer exists
-    valid_items = []
-    for item in items:
-        med = await db.medicines.find_one({"id": item.get("medicine_id")})
-        if med:
-            valid_items.append(item)
+    medicines = await loaders.get("medicines", fields=["id"]).load_many(i.get("medicine_id") for i in items)
+    valid_items = [item for item, med in zip(items, medicines) if med]
 
     # If items were pruned, update cart; if empty, delete cart
     if len(valid_items) != len(items):
@@ -4,13 +4,48 @@ from datetime import datetime
 from ..context.db import db
 from ..context.models import Consultation
 from ..context.security import get_current_user
+from ..context.serialization import FastJSONResponse, trusted_rows
+from ..context.scheduling import (
+    SlotUnavailable,
+    StatusConflict,
+    book,
+    change_status,
+    doctor_resource,
+    next_free_slots,
+    parse_datetime,
+    release,
+    release_deleted,
+)
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["consultations"])
 
+register_indexes(
+    Index("consultations", "id", unique=True, query={"id": "?", "user_id": "?"}),
+    Index("consultations", [("user_id", 1), ("created_at", -1)], query={"user_id": "?"}, sort=[("created_at", -1)]),
+)
+
 @router.get("/consultations", response_model=List[Consultation])
 async def get_consultations(current_user: dict = Depends(get_current_user)):
-    consultations = await db.consultations.find({"user_id": current_user["id"]}).sort("created_at", -1).to_list(1000)
-    return [Consultation(**consultation) for consultation in consultations]
+    consultations = (
+        await db.consultations.find({"user_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    )
+    return FastJSONResponse(trusted_rows(Consultation, consultations))
+
+@router.get("/consultations/availability")
+async def get_doctor_availability(
+    doctor_name: str,
+    start: Optional[str] = None,
+    duration_minutes: int = 30,
+    count: int = 5,
+):
+    """Next free start times for a doctor, from `start` (default: now)."""
+    try:
+        after = parse_datetime(start) if start else datetime.utcnow()
+        slots = await next_free_slots(doctor_resource(doctor_name), after, duration_minutes, min(count, 50))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"doctor_name": doctor_name, "duration_minutes": duration_minutes, "slots": slots}
 
 @router.get("/consultations/{consultation_id}", response_model=Consultation)
 async def get_consultation(consultation_id: str, current_user: dict = Depends(get_current_user)):
@@ -31,18 +66,30 @@ async def create_consultation(
     notes: Optional[str] = "",
     current_user: dict = Depends(get_current_user),
 ):
+    try:
+        start = parse_datetime(scheduled_date)
+        await book(doctor_resource(doctor_name), start, duration_minutes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SlotUnavailable:
+        raise HTTPException(status_code=409, detail="Requested slot is not available")
+
     consultation = Consultation(
         user_id=current_user["id"],
         doctor_name=doctor_name,
         specialization=specialization,
         consultation_type=consultation_type,
         price=price,
-        scheduled_date=datetime.fromisoformat(scheduled_date),
+        scheduled_date=start,
         duration_minutes=duration_minutes,
         symptoms=symptoms,
         notes=notes,
     )
-    await db.consultations.insert_one(consultation.dict())
+    try:
+        await db.consultations.insert_one({**consultation.dict(), "slots_reserved": True})
+    except Exception:
+        await release(doctor_resource(doctor_name), start, duration_minutes)
+        raise
     return consultation
 
 @router.put("/consultations/{consultation_id}/status")
@@ -61,18 +108,28 @@ async def update_consultation_status(
     if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found")
 
-    update_data = {"status": status, "updated_at": datetime.utcnow()}
+    update_data = {}
     if diagnosis:
         update_data["diagnosis"] = diagnosis
     if prescription_url:
         update_data["prescription_url"] = prescription_url
 
-    await db.consultations.update_one({"id": consultation_id}, {"$set": update_data})
+    try:
+        await change_status(
+            db.consultations, consultation, doctor_resource(consultation["doctor_name"]), status, update_data
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SlotUnavailable:
+        raise HTTPException(status_code=409, detail="Requested slot is no longer available")
+    except StatusConflict:
+        raise HTTPException(status_code=409, detail="Consultation was changed by another request")
     return {"message": "Consultation status updated successfully"}
 
 @router.delete("/consultations/{consultation_id}")
 async def delete_consultation(consultation_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.consultations.delete_one({"id": consultation_id, "user_id": current_user["id"]})
-    if result.deleted_count == 0:
+    consultation = await db.consultations.find_one_and_delete({"id": consultation_id, "user_id": current_user["id"]})
+    if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found")
+    await release_deleted(consultation, doctor_resource(consultation["doctor_name"]))
     return {"message": "Consultation deleted successfully"}
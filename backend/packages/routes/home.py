@@ -0,0 +1,86 @@
+from fastapi import APIRouter, Depends, Query
+from typing import Optional
+import asyncio
+from ..context.db import db, get_db
+from ..context.security import get_current_user
+from ..context.serialization import FastJSONResponse
+from ..context.tracing import start_span
+from .pharmacies import calculate_distance
+
+router = APIRouter(tags=["home"])
+catalog_db = get_db("catalog")
+
+# Only what the home screen renders; full documents stay behind their own endpoints
+PHARMACY_FIELDS = {"_id": 0, "id": 1, "name": 1, "image": 1, "rating": 1, "is_open": 1,
+                   "delivery_time": 1, "minimum_order": 1, "latitude": 1, "longitude": 1}
+CART_FIELDS = {"_id": 0, "pharmacy_id": 1, "items": 1, "total_amount": 1}
+ORDER_FIELDS = {"_id": 0, "id": 1, "pharmacy_id": 1, "status": 1, "payment_status": 1,
+                "total_amount": 1, "created_at": 1}
+ADDRESS_FIELDS = {"_id": 0, "id": 1, "label": 1, "address_line1": 1, "city": 1, "pincode": 1,
+                  "is_default": 1, "latitude": 1, "longitude": 1}
+
+
+async def _pharmacies(latitude: Optional[float], longitude: Optional[float], radius: float):
+    pharmacies = await catalog_db.pharmacies.find({}, PHARMACY_FIELDS).to_list(1000)
+    if latitude is None or longitude is None:
+        return pharmacies
+
+    nearby = []
+    for pharmacy in pharmacies:
+        if pharmacy.get("latitude") and pharmacy.get("longitude"):
+            distance = calculate_distance(latitude, longitude, pharmacy["latitude"], pharmacy["longitude"])
+            if distance <= radius:
+                pharmacy["distance"] = round(distance, 2)
+                nearby.append(pharmacy)
+    nearby.sort(key=lambda x: x["distance"])
+    return nearby
+
+
+async def _cart(user_id: str):
+    cart = await db.carts.find_one({"user_id": user_id}, CART_FIELDS)
+    if not cart or not cart.get("items"):
+        return None
+    cart["item_count"] = sum(item["quantity"] for item in cart["items"])
+    return cart
+
+
+async def _recent_orders(user_id: str, limit: int):
+    return await db.orders.find({"user_id": user_id}, ORDER_FIELDS).sort("created_at", -1).to_list(limit)
+
+
+async def _addresses(user_id: str):
+    return await db.addresses.find({"user_id": user_id}, ADDRESS_FIELDS).to_list(100)
+
+
+@router.get("/home")
+async def get_home(
+    latitude: Optional[float] = Query(None),
+    longitude: Optional[float] = Query(None),
+    radius: float = Query(10.0),
+    orders_limit: int = Query(5, ge=1, le=50),
+    current_user: dict = Depends(get_current_user),
+):
+    """Everything the app's first screen needs in one round trip: the user is
+    authenticated once and the section queries run concurrently."""
+    user_id = current_user["id"]
+    with start_span("home.fan_out"):
+        pharmacies, cart, orders, addresses = await asyncio.gather(
+            _pharmacies(latitude, longitude, radius),
+            _cart(user_id),
+            _recent_orders(user_id, orders_limit),
+            _addresses(user_id),
+        )
+
+    return FastJSONResponse({
+        "profile": {
+            "id": user_id,
+            "username": current_user["username"],
+            "email": current_user["email"],
+            "full_name": current_user["full_name"],
+            "phone": current_user["phone"],
+        },
+        "pharmacies": pharmacies,
+        "cart": cart,
+        "recent_orders": orders,
+        "addresses": addresses,
+    })
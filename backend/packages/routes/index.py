@@ -13,6 +13,8 @@ from .lab_tests import router as lab_tests_router
 from .consultations import router as consultations_router
 from .init_data import router as init_data_router
 from .payments import router as payments_router
+from .admin import router as admin_router
+from .home import router as home_router
 
 api_router = APIRouter(prefix="/api")
 
@@ -29,3 +31,5 @@ api_router.include_router(lab_tests_router)
 api_router.include_router(consultations_router)
 api_router.include_router(init_data_router)
 api_router.include_router(payments_router)
+api_router.include_router(admin_router)
+api_router.include_router(home_router)
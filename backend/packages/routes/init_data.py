@@ -2,6 +2,7 @@ from fastapi import APIRouter
 from datetime import datetime
 from uuid import uuid5, NAMESPACE_DNS
 from ..context.db import db
+from ..context.etag import bump_versions
 
 router = APIRouter(tags=["init"]) 
 
@@ -95,4 +96,5 @@ async def initialize_data():
             }
             await db.medicines.update_one({"id": m["id"]}, {"$set": m}, upsert=True)
 
+    await bump_versions("pharmacies", "medicines")
     return {"message": "Sample data initialized (idempotent)"}
@@ -4,13 +4,46 @@ from datetime import datetime
 from ..context.db import db
 from ..context.models import LabTest
 from ..context.security import get_current_user
+from ..context.serialization import FastJSONResponse, trusted_rows
+from ..context.scheduling import (
+    SlotUnavailable,
+    StatusConflict,
+    book,
+    change_status,
+    lab_resource,
+    next_free_slots,
+    parse_datetime,
+    release,
+    release_deleted,
+)
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["lab-tests"])
 
+register_indexes(
+    Index("lab_tests", "id", unique=True, query={"id": "?", "user_id": "?"}),
+    Index("lab_tests", [("user_id", 1), ("created_at", -1)], query={"user_id": "?"}, sort=[("created_at", -1)]),
+)
+
 @router.get("/lab-tests", response_model=List[LabTest])
 async def get_lab_tests(current_user: dict = Depends(get_current_user)):
-    lab_tests = await db.lab_tests.find({"user_id": current_user["id"]}).sort("created_at", -1).to_list(1000)
-    return [LabTest(**test) for test in lab_tests]
+    lab_tests = await db.lab_tests.find({"user_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    return FastJSONResponse(trusted_rows(LabTest, lab_tests))
+
+@router.get("/lab-tests/availability")
+async def get_lab_availability(
+    lab_name: str,
+    start: Optional[str] = None,
+    duration_minutes: int = 30,
+    count: int = 5,
+):
+    """Next free start times for a lab, from `start` (default: now)."""
+    try:
+        after = parse_datetime(start) if start else datetime.utcnow()
+        slots = await next_free_slots(lab_resource(lab_name), after, duration_minutes, min(count, 50))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"lab_name": lab_name, "duration_minutes": duration_minutes, "slots": slots}
 
 @router.get("/lab-tests/{test_id}", response_model=LabTest)
 async def get_lab_test(test_id: str, current_user: dict = Depends(get_current_user)):
@@ -27,9 +60,18 @@ async def create_lab_test(
     lab_name: str,
     test_type: str,
     scheduled_date: str,
+    duration_minutes: int = 30,
     notes: Optional[str] = "",
     current_user: dict = Depends(get_current_user),
 ):
+    try:
+        start = parse_datetime(scheduled_date)
+        await book(lab_resource(lab_name), start, duration_minutes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SlotUnavailable:
+        raise HTTPException(status_code=409, detail="Requested slot is not available")
+
     lab_test = LabTest(
         user_id=current_user["id"],
         test_name=test_name,
@@ -37,10 +79,15 @@ async def create_lab_test(
         price=price,
         lab_name=lab_name,
         test_type=test_type,
-        scheduled_date=datetime.fromisoformat(scheduled_date),
+        scheduled_date=start,
+        duration_minutes=duration_minutes,
         notes=notes,
     )
-    await db.lab_tests.insert_one(lab_test.dict())
+    try:
+        await db.lab_tests.insert_one({**lab_test.dict(), "slots_reserved": True})
+    except Exception:
+        await release(lab_resource(lab_name), start, duration_minutes)
+        raise
     return lab_test
 
 @router.put("/lab-tests/{test_id}/status")
@@ -58,16 +105,24 @@ async def update_lab_test_status(
     if not lab_test:
         raise HTTPException(status_code=404, detail="Lab test not found")
 
-    update_data = {"status": status, "updated_at": datetime.utcnow()}
+    update_data = {}
     if results_url:
         update_data["results_url"] = results_url
 
-    await db.lab_tests.update_one({"id": test_id}, {"$set": update_data})
+    try:
+        await change_status(db.lab_tests, lab_test, lab_resource(lab_test["lab_name"]), status, update_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SlotUnavailable:
+        raise HTTPException(status_code=409, detail="Requested slot is no longer available")
+    except StatusConflict:
+        raise HTTPException(status_code=409, detail="Lab test was changed by another request")
     return {"message": "Lab test status updated successfully"}
 
 @router.delete("/lab-tests/{test_id}")
 async def delete_lab_test(test_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.lab_tests.delete_one({"id": test_id, "user_id": current_user["id"]})
-    if result.deleted_count == 0:
+    lab_test = await db.lab_tests.find_one_and_delete({"id": test_id, "user_id": current_user["id"]})
+    if not lab_test:
         raise HTTPException(status_code=404, detail="Lab test not found")
+    await release_deleted(lab_test, lab_resource(lab_test["lab_name"]))
     return {"message": "Lab test deleted successfully"}
@@ -1,29 +1,45 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import List
-from ..context.db import db
+from ..context.db import get_db
 from ..context.models import Medicine
+from ..context.serialization import FastJSONResponse, trusted_row, trusted_rows
+from ..context.etag import catalog_response, scope
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["medicines"])
+catalog_db = get_db("catalog")
+
+register_indexes(
+    Index("medicines", "id", unique=True, query={"id": "?"}),
+    Index("medicines", "pharmacy_id", query={"pharmacy_id": "?"}),
+    Index("medicines", "category", query={"category": "?", "id": {"$ne": "?"}}),
+)
 
 @router.get("/pharmacies/{pharmacy_id}/medicines", response_model=List[Medicine])
-async def get_pharmacy_medicines(pharmacy_id: str):
-    medicines = await db.medicines.find({"pharmacy_id": pharmacy_id}).to_list(1000)
-    return [Medicine(**medicine) for medicine in medicines]
+async def get_pharmacy_medicines(pharmacy_id: str, request: Request):
+    async def load(session):
+        medicines = await catalog_db.medicines.find({"pharmacy_id": pharmacy_id}, {"_id": 0}, session=session).to_list(1000)
+        return trusted_rows(Medicine, medicines)
+
+    return await catalog_response(request, ["medicines", scope("medicines", "pharmacy", pharmacy_id)], load)
 
 @router.get("/medicines/{medicine_id}", response_model=Medicine)
-async def get_medicine(medicine_id: str):
-    medicine = await db.medicines.find_one({"id": medicine_id})
-    if not medicine:
-        raise HTTPException(status_code=404, detail="Medicine not found")
-    return Medicine(**medicine)
+async def get_medicine(medicine_id: str, request: Request):
+    async def load(session):
+        medicine = await catalog_db.medicines.find_one({"id": medicine_id}, {"_id": 0}, session=session)
+        if not medicine:
+            raise HTTPException(status_code=404, detail="Medicine not found")
+        return trusted_row(Medicine, medicine)
+
+    return await catalog_response(request, ["medicines", scope("medicines", medicine_id)], load)
 
 @router.get("/medicines/{medicine_id}/alternatives", response_model=List[Medicine])
 async def get_alternative_medicines(medicine_id: str):
-    medicine = await db.medicines.find_one({"id": medicine_id})
+    medicine = await catalog_db.medicines.find_one({"id": medicine_id})
     if not medicine:
         raise HTTPException(status_code=404, detail="Medicine not found")
-    alternatives = await db.medicines.find({
+    alternatives = await catalog_db.medicines.find({
         "category": medicine["category"],
         "id": {"$ne": medicine_id},
-    }).limit(10).to_list(10)
-    return [Medicine(**m) for m in alternatives]
+    }, {"_id": 0}).limit(10).to_list(10)
+    return FastJSONResponse(trusted_rows(Medicine, alternatives))
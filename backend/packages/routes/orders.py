@@ -1,13 +1,56 @@
 from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from typing import Any, Dict, List, Optional, Set, Tuple
 from datetime import datetime
+from pymongo import ReturnDocument, UpdateOne
 from ..context.db import db
-from ..context.models import Order, CreateOrderRequest
-from ..context.security import get_current_user
-from ..context.socket import sio
+from ..context.models import Order, CreateOrderRequest, BulkOrderStatusRequest
+from ..context.security import ADMIN_USERNAMES, get_current_user
+from ..context.serialization import FastJSONResponse, trusted_row, trusted_rows
+from ..context.outbox import enqueue, order_event, unit_of_work
+from ..context.etag import bump_versions, scope
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["orders"])
 
+# Allowed next statuses; delivered and cancelled are final
+ORDER_STATUS_TRANSITIONS = {
+    "placed": {"confirmed", "cancelled"},
+    "confirmed": {"preparing", "cancelled"},
+    "preparing": {"out_for_delivery", "cancelled"},
+    "out_for_delivery": {"delivered"},
+    "delivered": set(),
+    "cancelled": set(),
+}
+
+register_indexes(
+    Index("orders", "id", unique=True, query={"id": "?"}),
+    Index("orders", [("user_id", 1), ("created_at", -1)], query={"user_id": "?"}, sort=[("created_at", -1)]),
+    Index("orders", "created_at"),
+)
+
+_FORBIDDEN = "Forbidden"
+
+
+def _status_permissions(current_user: dict) -> Tuple[bool, Set[str]]:
+    """(is admin, pharmacy ids) of a caller changing order statuses. Admins
+    may move any order, others only orders of the pharmacies in their
+    `pharmacy_ids` (set through `PUT /admin/users/{id}/pharmacies`)."""
+    is_admin = current_user["username"] in ADMIN_USERNAMES
+    pharmacy_ids = set(current_user.get("pharmacy_ids") or ())
+    if not is_admin and not pharmacy_ids:
+        raise HTTPException(status_code=403, detail="Not allowed to update order statuses")
+    return is_admin, pharmacy_ids
+
+
+def _status_change_error(order: Dict[str, Any], status: str, is_admin: bool, pharmacy_ids: Set[str]) -> Optional[str]:
+    """Why `order` may not move to `status`, or None if it may."""
+    if not is_admin and order.get("pharmacy_id") not in pharmacy_ids:
+        return _FORBIDDEN
+    if status not in ORDER_STATUS_TRANSITIONS.get(order["status"], ()):
+        return f"Cannot change status from {order['status']} to {status}"
+    return None
+
+
 @router.post("/orders", response_model=Order)
 async def create_order(
     delivery_address: str, 
@@ -38,58 +81,157 @@ async def create_order(
         payment_status=payment_status,
     )
 
-    await db.orders.insert_one(new_order.dict())
+    async def work(session):
+        # event_seq counts the order's realtime events; see context/order_events.py
+        await db.orders.insert_one({**new_order.dict(), "event_seq": 1}, session=session)
 
-    # Only clear cart and reduce stock for COD orders
-    # For online payment, this will be done after payment verification
-    if payment_method == "cod":
-        await db.carts.delete_one({"user_id": current_user["id"]})
-        
-        for item in cart["items"]:
-            await db.medicines.update_one(
-                {"id": item["medicine_id"]},
-                {"$inc": {"stock_quantity": -item["quantity"]}},
-            )
+        # Only clear cart and reduce stock for COD orders
+        # For online payment, this will be done after payment verification
+        if payment_method == "cod":
+            await db.carts.delete_one({"user_id": current_user["id"]}, session=session)
+
+            for item in cart["items"]:
+                await db.medicines.update_one(
+                    {"id": item["medicine_id"]},
+                    {"$inc": {"stock_quantity": -item["quantity"]}},
+                    session=session,
+                )
+
+        await enqueue(
+            order_event(
+                current_user["id"], new_order.id, 'order_created',
+                seq=1, status='placed', payment_status=payment_status,
+            ),
+            session=session,
+        )
+
+    await unit_of_work(work)
 
-    await sio.emit('order_created', {
-        'order_id': new_order.id,
-        'status': 'placed',
-        'user_id': current_user["id"],
-    })
+    if payment_method == "cod":
+        # Only this pharmacy's list and the medicines sold change
+        await bump_versions(
+            scope("medicines", "pharmacy", cart["pharmacy_id"]),
+            *(scope("medicines", item["medicine_id"]) for item in cart["items"]),
+        )
 
     return new_order
 
 @router.get("/orders", response_model=List[Order])
 async def get_user_orders(current_user: dict = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": current_user["id"]}).sort("created_at", -1).to_list(1000)
-    return [Order(**order) for order in orders]
+    orders = await db.orders.find({"user_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    return FastJSONResponse(trusted_rows(Order, orders))
 
 @router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str, current_user: dict = Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id, "user_id": current_user["id"]})
+    order = await db.orders.find_one({"id": order_id, "user_id": current_user["id"]}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    return Order(**order)
+    return FastJSONResponse(trusted_row(Order, order))
+
+@router.post("/orders/status/bulk")
+async def bulk_update_order_status(request: BulkOrderStatusRequest, current_user: dict = Depends(get_current_user)):
+    """Apply many status changes with one bulk_write. Each change must be
+    allowed for the caller and a valid transition from the order's current
+    status; the others are reported per order and skipped. Users get one
+    event for all their orders."""
+    is_admin, pharmacy_ids = _status_permissions(current_user)
+
+    results: Dict[str, dict] = {}
+    changes: Dict[str, str] = {}
+    for change in request.updates:
+        if change.order_id in changes or change.order_id in results:
+            results[change.order_id] = {"order_id": change.order_id, "ok": False, "error": "Duplicate order_id"}
+            changes.pop(change.order_id, None)
+        elif change.status not in ORDER_STATUS_TRANSITIONS:
+            results[change.order_id] = {"order_id": change.order_id, "ok": False, "error": "Invalid status"}
+        else:
+            changes[change.order_id] = change.status
+
+    orders = await db.orders.find(
+        {"id": {"$in": list(changes)}}, {"_id": 0, "id": 1, "status": 1, "user_id": 1, "pharmacy_id": 1}
+    ).to_list(None)
+    current = {o["id"]: o for o in orders}
+
+    now = datetime.utcnow()
+    operations, applied = [], []
+    for order_id, status in changes.items():
+        order = current.get(order_id)
+        error = "Order not found" if order is None else _status_change_error(order, status, is_admin, pharmacy_ids)
+        if error:
+            results[order_id] = {"order_id": order_id, "ok": False, "error": error}
+        else:
+            # Matching on the status we validated against keeps concurrent updates from being overwritten
+            operations.append(UpdateOne(
+                {"id": order_id, "status": order["status"]},
+                {"$set": {"status": status, "updated_at": now}, "$inc": {"event_seq": 1}},
+            ))
+            applied.append(order_id)
+            results[order_id] = {"order_id": order_id, "ok": True, "status": status}
+
+    async def work(session) -> List[str]:
+        """Apply the batch; returns the orders another writer changed first."""
+        outcome = await db.orders.bulk_write(operations, ordered=False, session=session)
+        latest = {
+            order["id"]: order for order in await db.orders.find(
+                {"id": {"$in": applied}}, {"_id": 0, "id": 1, "status": 1, "event_seq": 1}, session=session
+            ).to_list(None)
+        }
+        conflicts = []
+        if outcome.matched_count < len(operations):
+            conflicts = [order_id for order_id, order in latest.items() if order["status"] != changes[order_id]]
+
+        # Coalesced per user room on delivery, so each user gets one frame for the whole batch
+        rows = [
+            order_event(
+                current[order_id]["user_id"], order_id, 'order_status_updated',
+                seq=latest[order_id]["event_seq"], status=changes[order_id],
+            )
+            for order_id in applied if order_id not in conflicts
+        ]
+        if rows:
+            await enqueue(*rows, session=session)
+        return conflicts
+
+    if operations:
+        for order_id in await unit_of_work(work):
+            results[order_id] = {"order_id": order_id, "ok": False, "error": "Order changed concurrently"}
+
+    updated = sum(1 for r in results.values() if r["ok"])
+    return {"updated": updated, "failed": len(results) - updated, "results": list(results.values())}
 
 @router.put("/orders/{order_id}/status")
 async def update_order_status(order_id: str, status: str, current_user: dict = Depends(get_current_user)):
-    valid_statuses = ["placed", "confirmed", "preparing", "out_for_delivery", "delivered", "cancelled"]
-    if status not in valid_statuses:
+    """Move one order to `status`, under the same rules as the bulk endpoint."""
+    is_admin, pharmacy_ids = _status_permissions(current_user)
+    if status not in ORDER_STATUS_TRANSITIONS:
         raise HTTPException(status_code=400, detail="Invalid status")
 
-    order = await db.orders.find_one({"id": order_id})
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0, "status": 1, "user_id": 1, "pharmacy_id": 1})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"status": status, "updated_at": datetime.utcnow()}},
-    )
-
-    await sio.emit('order_status_updated', {
-        'order_id': order_id,
-        'status': status,
-        'user_id': order["user_id"],
-    })
+    error = _status_change_error(order, status, is_admin, pharmacy_ids)
+    if error == _FORBIDDEN:
+        raise HTTPException(status_code=403, detail="Not allowed to update this order")
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    async def work(session) -> bool:
+        updated = await db.orders.find_one_and_update(
+            {"id": order_id, "status": order["status"]},
+            {"$set": {"status": status, "updated_at": datetime.utcnow()}, "$inc": {"event_seq": 1}},
+            projection={"event_seq": 1},
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        if updated is None:
+            return False
+        await enqueue(
+            order_event(order["user_id"], order_id, 'order_status_updated', seq=updated["event_seq"], status=status),
+            session=session,
+        )
+        return True
+
+    if not await unit_of_work(work):
+        raise HTTPException(status_code=409, detail="Order changed concurrently")
 
     return {"message": "Order status updated successfully"}
@@ -1,24 +1,38 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import List
-import razorpay
+from datetime import datetime
 import hmac
 import hashlib
-import os
+import json
+import math
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from ..context.db import db
 from ..context.models import Transaction, PaymentMethod, VerifyPaymentRequest
 from ..context.security import get_current_user
+from ..context.outbox import enqueue, order_event, unit_of_work
+from ..context.serialization import FastJSONResponse, trusted_rows
+from ..context.gateway import (
+    GatewayError,
+    GatewayUnavailable,
+    RAZORPAY_KEY_ID,
+    RAZORPAY_KEY_SECRET,
+    RAZORPAY_WEBHOOK_SECRET,
+    razorpay_client,
+)
+from ..cron import payment_events
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["payments"])
 
-# Initialize Razorpay client with test keys
-RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID", "rzp_test_123456789")
-RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET", "test_secret_key_123456789")
-
-try:
-    razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-except Exception as e:
-    print(f"Warning: Razorpay client initialization failed: {e}")
-    razorpay_client = None
+register_indexes(
+    Index("payment_methods", "id", unique=True),
+    Index("payment_methods", "user_id", query={"user_id": "?"}),
+    Index("transactions", "id", unique=True),
+    Index("transactions", "user_id"),
+    Index("transactions", "order_id", query={"order_id": "?", "user_id": "?"}),
+    Index("transactions", "razorpay_order_id", query={"razorpay_order_id": "?"}),
+)
 
 @router.post("/payments/create-razorpay-order")
 async def create_razorpay_order(order_id: str, current_user: dict = Depends(get_current_user)):
@@ -29,11 +43,8 @@ async def create_razorpay_order(order_id: str, current_user: dict = Depends(get_
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
         
-        if not razorpay_client:
-            raise HTTPException(status_code=500, detail="Payment service not configured")
-        
         # Create Razorpay order
-        razorpay_order = razorpay_client.order.create({
+        razorpay_order = await razorpay_client.create_order({
             "amount": int(order["total_amount"] * 100),  # Amount in paise
             "currency": "INR",
             "receipt": order_id,
@@ -66,6 +77,13 @@ async def create_razorpay_order(order_id: str, current_user: dict = Depends(get_
             "currency": razorpay_order["currency"],
             "key_id": RAZORPAY_KEY_ID
         }
+    except HTTPException:
+        raise
+    except GatewayUnavailable as e:
+        retry_after = max(1, math.ceil(e.retry_after or 1))
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(retry_after)})
+    except GatewayError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -82,46 +100,106 @@ async def verify_payment(data: VerifyPaymentRequest, current_user: dict = Depend
         
         if generated_signature != data.razorpay_signature:
             # Payment verification failed
-            await db.orders.update_one(
+            async def record_failure(session):
+                order = await db.orders.find_one_and_update(
+                    {"id": data.order_id},
+                    {"$set": {"payment_status": "failed"}, "$inc": {"event_seq": 1}},
+                    projection={"event_seq": 1},
+                    return_document=ReturnDocument.AFTER,
+                    session=session,
+                )
+                await db.transactions.update_one(
+                    {"razorpay_order_id": data.razorpay_order_id},
+                    {"$set": {"status": "failed", "error_message": "Signature verification failed"}},
+                    session=session,
+                )
+                if order is not None:
+                    await enqueue(
+                        order_event(
+                            current_user["id"], data.order_id, 'payment_status_updated',
+                            seq=order["event_seq"], payment_status="failed",
+                        ),
+                        session=session,
+                    )
+
+            await unit_of_work(record_failure)
+            raise HTTPException(status_code=400, detail="Payment verification failed")
+        
+        # Payment verified successfully
+        async def record_success(session):
+            order = await db.orders.find_one_and_update(
                 {"id": data.order_id},
-                {"$set": {"payment_status": "failed"}}
+                {"$set": {
+                    "payment_status": "completed",
+                    "razorpay_payment_id": data.razorpay_payment_id,
+                    "razorpay_signature": data.razorpay_signature
+                }, "$inc": {"event_seq": 1}},
+                projection={"event_seq": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session,
             )
+
             await db.transactions.update_one(
                 {"razorpay_order_id": data.razorpay_order_id},
-                {"$set": {"status": "failed", "error_message": "Signature verification failed"}}
+                {"$set": {
+                    "status": "success",
+                    "razorpay_payment_id": data.razorpay_payment_id,
+                    "razorpay_signature": data.razorpay_signature
+                }},
+                session=session,
             )
-            raise HTTPException(status_code=400, detail="Payment verification failed")
-        
-        # Payment verified successfully
-        await db.orders.update_one(
-            {"id": data.order_id},
-            {"$set": {
-                "payment_status": "completed",
-                "razorpay_payment_id": data.razorpay_payment_id,
-                "razorpay_signature": data.razorpay_signature
-            }}
-        )
-        
-        await db.transactions.update_one(
-            {"razorpay_order_id": data.razorpay_order_id},
-            {"$set": {
-                "status": "success",
-                "razorpay_payment_id": data.razorpay_payment_id,
-                "razorpay_signature": data.razorpay_signature
-            }}
-        )
-        
+            if order is not None:
+                await enqueue(
+                    order_event(
+                        current_user["id"], data.order_id, 'payment_status_updated',
+                        seq=order["event_seq"], payment_status="completed",
+                    ),
+                    session=session,
+                )
+
+        await unit_of_work(record_success)
         return {"message": "Payment verified successfully", "status": "success"}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/payments/webhook")
+async def razorpay_webhook(request: Request):
+    """Accept a Razorpay webhook. Events are stored in the inbox and applied by
+    the payment events worker; redelivered events are acknowledged and dropped."""
+    if not RAZORPAY_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Webhooks are not configured")
+    body = await request.body()
+    expected_signature = hmac.new(RAZORPAY_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_signature, request.headers.get("X-Razorpay-Signature", "")):
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
+
+    try:
+        event = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+
+    event_id = request.headers.get("X-Razorpay-Event-Id") or hashlib.sha256(body).hexdigest()
+    try:
+        await db.payment_events.insert_one({
+            "_id": event_id,
+            "event": event.get("event"),
+            "payload": event.get("payload", {}),
+            "status": "pending",
+            "received_at": datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        return {"status": "duplicate"}
+
+    payment_events.wake()
+    return {"status": "accepted"}
+
 @router.get("/payments/methods", response_model=List[PaymentMethod])
 async def get_payment_methods(current_user: dict = Depends(get_current_user)):
     """Get user's saved payment methods"""
-    methods = await db.payment_methods.find({"user_id": current_user["id"]}).to_list(100)
-    return [PaymentMethod(**method) for method in methods]
+    methods = await db.payment_methods.find({"user_id": current_user["id"]}, {"_id": 0}).to_list(100)
+    return FastJSONResponse(trusted_rows(PaymentMethod, methods))
 
 @router.post("/payments/methods", response_model=PaymentMethod)
 async def save_payment_method(
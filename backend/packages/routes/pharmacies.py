@@ -1,10 +1,18 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from typing import List, Optional
-from ..context.db import db
+from ..context.db import get_db
 from ..context.models import Pharmacy
+from ..context.serialization import trusted_row, trusted_rows
+from ..context.etag import catalog_response
+from ..context.indexes import Index, register_indexes
 import math
 
 router = APIRouter(tags=["pharmacies"])
+catalog_db = get_db("catalog")
+
+register_indexes(
+    Index("pharmacies", "id", unique=True, query={"id": "?"}),
+)
 
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate distance between two coordinates using Haversine formula (in km)"""
@@ -22,33 +30,39 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
 
 @router.get("/pharmacies", response_model=List[Pharmacy])
 async def get_pharmacies(
+    request: Request,
     latitude: Optional[float] = Query(None),
     longitude: Optional[float] = Query(None),
     radius: Optional[float] = Query(10.0)  # Default 10km radius
 ):
-    pharmacies = await db.pharmacies.find().to_list(1000)
-    pharmacy_list = [Pharmacy(**pharmacy) for pharmacy in pharmacies]
-    
-    # If location provided, filter by distance and add distance field
-    if latitude is not None and longitude is not None:
-        pharmacies_with_distance = []
-        for pharmacy in pharmacy_list:
-            if pharmacy.latitude and pharmacy.longitude:
-                distance = calculate_distance(latitude, longitude, pharmacy.latitude, pharmacy.longitude)
-                if distance <= radius:
-                    pharmacy_dict = pharmacy.dict()
-                    pharmacy_dict['distance'] = round(distance, 2)
-                    pharmacies_with_distance.append(pharmacy_dict)
-        
-        # Sort by distance
-        pharmacies_with_distance.sort(key=lambda x: x['distance'])
-        return pharmacies_with_distance
-    
-    return pharmacy_list
+    async def load(session):
+        pharmacies = await catalog_db.pharmacies.find({}, {"_id": 0}, session=session).to_list(1000)
+        pharmacy_list = trusted_rows(Pharmacy, pharmacies)
+
+        # If location provided, filter by distance and add distance field
+        if latitude is not None and longitude is not None:
+            pharmacies_with_distance = []
+            for pharmacy_dict in pharmacy_list:
+                if pharmacy_dict['latitude'] and pharmacy_dict['longitude']:
+                    distance = calculate_distance(latitude, longitude, pharmacy_dict['latitude'], pharmacy_dict['longitude'])
+                    if distance <= radius:
+                        pharmacy_dict['distance'] = round(distance, 2)
+                        pharmacies_with_distance.append(pharmacy_dict)
+
+            # Sort by distance
+            pharmacies_with_distance.sort(key=lambda x: x['distance'])
+            return pharmacies_with_distance
+
+        return pharmacy_list
+
+    return await catalog_response(request, ["pharmacies"], load)
 
 @router.get("/pharmacies/{pharmacy_id}", response_model=Pharmacy)
-async def get_pharmacy(pharmacy_id: str):
-    pharmacy = await db.pharmacies.find_one({"id": pharmacy_id})
-    if not pharmacy:
-        raise HTTPException(status_code=404, detail="Pharmacy not found")
-    return Pharmacy(**pharmacy)
+async def get_pharmacy(pharmacy_id: str, request: Request):
+    async def load(session):
+        pharmacy = await catalog_db.pharmacies.find_one({"id": pharmacy_id}, {"_id": 0}, session=session)
+        if not pharmacy:
+            raise HTTPException(status_code=404, detail="Pharmacy not found")
+        return trusted_row(Pharmacy, pharmacy)
+
+    return await catalog_response(request, ["pharmacies"], load)
@@ -3,9 +3,16 @@ from typing import List, Optional
 from ..context.db import db
 from ..context.models import Prescription
 from ..context.security import get_current_user
+from ..context.serialization import FastJSONResponse, trusted_rows
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["prescriptions"])
 
+register_indexes(
+    Index("prescriptions", "id", unique=True, query={"id": "?", "user_id": "?"}),
+    Index("prescriptions", [("user_id", 1), ("created_at", -1)], query={"user_id": "?"}, sort=[("created_at", -1)]),
+)
+
 @router.post("/prescriptions", response_model=Prescription)
 async def upload_prescription(
     image_url: str,
@@ -25,9 +32,9 @@ async def upload_prescription(
 @router.get("/prescriptions", response_model=List[Prescription])
 async def get_prescriptions(current_user: dict = Depends(get_current_user)):
     prescriptions = (
-        await db.prescriptions.find({"user_id": current_user["id"]}).sort("created_at", -1).to_list(1000)
+        await db.prescriptions.find({"user_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(1000)
     )
-    return [Prescription(**p) for p in prescriptions]
+    return FastJSONResponse(trusted_rows(Prescription, prescriptions))
 
 @router.get("/prescriptions/{prescription_id}", response_model=Prescription)
 async def get_prescription(prescription_id: str, current_user: dict = Depends(get_current_user)):
@@ -1,10 +1,20 @@
 from fastapi import APIRouter, HTTPException, Depends
 from typing import List
-from ..context.db import db
+from ..context.db import db, get_db
 from ..context.models import Review
 from ..context.security import get_current_user
+from ..context.loader import Loaders, request_loaders
+from ..context.serialization import FastJSONResponse
+from ..context.indexes import Index, register_indexes
 
 router = APIRouter(tags=["reviews"])
+catalog_db = get_db("catalog")
+
+register_indexes(
+    Index("reviews", "id", unique=True),
+    Index("reviews", [("medicine_id", 1), ("created_at", -1)], query={"medicine_id": "?"}, sort=[("created_at", -1)]),
+    Index("reviews", [("medicine_id", 1), ("user_id", 1)], query={"medicine_id": "?", "user_id": "?"}),
+)
 
 @router.post("/medicines/{medicine_id}/reviews", response_model=Review)
 async def add_review(medicine_id: str, rating: float, comment: str, current_user: dict = Depends(get_current_user)):
@@ -24,10 +34,11 @@ async def add_review(medicine_id: str, rating: float, comment: str, current_user
     return review
 
 @router.get("/medicines/{medicine_id}/reviews", response_model=List[dict])
-async def get_medicine_reviews(medicine_id: str):
-    reviews = await db.reviews.find({"medicine_id": medicine_id}).sort("created_at", -1).to_list(1000)
-    enriched_reviews = []
-    for review in reviews:
-        user = await db.users.find_one({"id": review["user_id"]})
-        enriched_reviews.append({**review, "user_name": user["full_name"] if user else "Unknown User"})
-    return enriched_reviews
+async def get_medicine_reviews(medicine_id: str, loaders: Loaders = Depends(request_loaders)):
+    reviews = await catalog_db.reviews.find({"medicine_id": medicine_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    users = await loaders.get("users", fields=["full_name"], profile="catalog").load_many(r["user_id"] for r in reviews)
+    enriched_reviews = [
+        {**review, "user_name": user["full_name"] if user else "Unknown User"}
+        for review, user in zip(reviews, users)
+    ]
+    return FastJSONResponse(enriched_reviews)
@@ -0,0 +1,59 @@
+import asyncio
+import inspect
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class _Interleaving:
+    """Proxy that yields to the event loop before and after every awaited
+    database call. mongomock runs each operation to completion in one step,
+    so without this, concurrent tasks never interleave their reads and
+    writes the way they do against a real server."""
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return _Interleaving(attr) if name[0] != "_" else attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if not inspect.isawaitable(result):
+                return result
+
+            async def interleaved():
+                await asyncio.sleep(0)
+                value = await result
+                await asyncio.sleep(0)
+                return value
+
+            return interleaved()
+
+        return call
+
+    def __getitem__(self, name):
+        return _Interleaving(self._target[name])
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """In-memory Motor database; pass the modules whose `db` it should replace.
+    With `interleave=True` every call yields to the loop, so concurrent
+    tasks interleave their operations."""
+    database = AsyncMongoMockClient()["medimart_test"]
+
+    def use(*modules, interleave=False):
+        handle = _Interleaving(database) if interleave else database
+        for module in modules:
+            monkeypatch.setattr(module, "db", handle)
+        return handle
+
+    return use
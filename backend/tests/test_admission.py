@@ -0,0 +1,140 @@
+from time import monotonic
+import asyncio
+
+import pytest
+
+from packages.middleware import admission
+from packages.middleware.admission import AdmissionMiddleware, AIMDLimiter, RouteClass
+
+pytestmark = pytest.mark.anyio
+
+
+def _limiter(limit=4, yielding=lambda: False, **options):
+    route_class = RouteClass(
+        name="test", priority=1, target_ms=100, queue_timeout_ms=options.pop("queue_timeout_ms", 1000),
+        initial_limit=limit, **options,
+    )
+    return AIMDLimiter(route_class, yielding)
+
+
+async def _queued(limiter):
+    """Start an acquire that has to wait, and return its task once it is queued."""
+    task = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert limiter.waiters
+    return task
+
+
+async def test_fast_completions_grow_the_limit_while_it_is_used():
+    limiter = _limiter(limit=4)
+    for _ in range(4):
+        assert await limiter.acquire() is None
+
+    limiter.release(monotonic(), 0.01)
+    assert limiter.limit == pytest.approx(4.25)
+
+    # Mostly idle: no growth
+    idle = _limiter(limit=32)
+    await idle.acquire()
+    idle.release(monotonic(), 0.01)
+    assert idle.limit == 32
+
+
+async def test_slow_completions_cut_the_limit_once_per_round_trip():
+    limiter = _limiter(limit=10, min_limit=9)
+    started = monotonic()
+    for _ in range(3):
+        await limiter.acquire()
+
+    limiter.release(started, 0.5)
+    assert limiter.limit == pytest.approx(10 * admission.ADMISSION_BACKOFF)
+
+    # Started before the cut, so it already saw the lower limit's effect
+    limiter.release(started, 0.5)
+    assert limiter.limit == pytest.approx(10 * admission.ADMISSION_BACKOFF)
+
+    limiter.release(monotonic(), 0.5)
+    assert limiter.limit == 9  # floored at min_limit
+
+
+async def test_a_released_slot_goes_to_the_oldest_waiter():
+    limiter = _limiter(limit=2)
+    assert [await limiter.acquire() for _ in range(2)] == [None, None]
+    first, second = await _queued(limiter), await _queued(limiter)
+
+    limiter.release(monotonic(), 0.01)
+    assert await first is None
+    assert limiter.in_flight == 2 and not second.done()
+
+    limiter.release(monotonic(), 0.01)
+    assert await second is None
+    assert limiter.in_flight == 2 and not limiter.waiters
+
+
+async def test_the_queue_is_bounded_by_the_limit():
+    limiter = _limiter(limit=1)
+    await limiter.acquire()
+    waiting = await _queued(limiter)
+    assert await limiter.acquire() == "queue_full"
+    waiting.cancel()
+
+
+async def test_a_timed_out_waiter_leaves_the_queue_without_a_slot():
+    limiter = _limiter(limit=1, queue_timeout_ms=10)
+    await limiter.acquire()
+
+    assert await limiter.acquire() == "timeout"
+    assert limiter.in_flight == 1 and not limiter.waiters
+
+    limiter.release(monotonic(), 0.01)
+    assert limiter.in_flight == 0
+
+
+async def test_a_cancelled_waiter_does_not_keep_a_slot():
+    limiter = _limiter(limit=1)
+    await limiter.acquire()
+
+    waiting = await _queued(limiter)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert not limiter.waiters and limiter.in_flight == 1
+
+    # Granted, then cancelled before it could run
+    granted = await _queued(limiter)
+    limiter.release(monotonic(), 0.01)
+    granted.cancel()
+    outcome = (await asyncio.gather(granted, return_exceptions=True))[0]
+    # Either the caller got the slot (and will release it) or it was handed back
+    assert limiter.in_flight == (1 if outcome is None else 0)
+
+
+async def test_yielding_halves_admission_and_queue_hand_off():
+    higher_priority_waiting = True
+    limiter = _limiter(limit=4, yielding=lambda: higher_priority_waiting)
+
+    assert [await limiter.acquire() for _ in range(3)] == [None, None, "priority"]
+
+    higher_priority_waiting = False
+    await limiter.acquire()
+    await limiter.acquire()
+    waiting = await _queued(limiter)
+
+    # Four in flight; one finishes, but the yielding share is two
+    higher_priority_waiting = True
+    limiter.release(monotonic(), 0.01)
+    await asyncio.sleep(0)
+    assert not waiting.done() and limiter.in_flight == 3
+
+    higher_priority_waiting = False
+    limiter.release(monotonic(), 0.01)
+    assert await waiting is None
+
+
+async def test_lower_classes_yield_while_checkout_is_queueing():
+    middleware = AdmissionMiddleware(app=None)
+    catalog, checkout = middleware.limiters["catalog"], middleware.limiters["checkout"]
+    assert not catalog.yielding()
+
+    checkout.waiters.append(asyncio.get_running_loop().create_future())
+    assert catalog.yielding() and not checkout.yielding()
@@ -0,0 +1,120 @@
+import pytest
+from starlette.requests import Request
+
+from packages.context import etag
+from packages.context.etag import bump_versions, catalog_etag, catalog_response, scope
+
+pytestmark = pytest.mark.anyio
+
+
+class _Session:
+    """Stands in for a causal Motor session: it reports fixed times and
+    records how it is advanced."""
+
+    def __init__(self, cluster_time, operation_time):
+        self.cluster_time = cluster_time
+        self.operation_time = operation_time
+        self.advanced = []
+
+    def advance_cluster_time(self, value):
+        self.advanced.append(("cluster", value))
+
+    def advance_operation_time(self, value):
+        self.advanced.append(("operation", value))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _Client:
+    def __init__(self):
+        self.sessions = []
+
+    async def start_session(self, causal_consistency=False):
+        assert causal_consistency
+        session = _Session({"clusterTime": len(self.sessions)}, f"op-{len(self.sessions)}")
+        self.sessions.append(session)
+        return session
+
+
+@pytest.fixture
+def versions(mock_db, monkeypatch):
+    database = mock_db(etag)
+    monkeypatch.setattr(etag, "catalog_db", database)
+    monkeypatch.setattr(etag, "client", _Client())
+    etag.catalog_cache.cache.clear()
+    return database
+
+
+def _request(path="/api/medicines", if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": headers})
+
+
+def test_scope_joins_the_collection_and_parts():
+    assert scope("medicines", "pharmacy", "p1") == "medicines:pharmacy:p1"
+    assert scope("medicines") == "medicines"
+
+
+async def test_bumping_a_scoped_key_retires_only_its_etags(versions):
+    pharmacy_1 = ["medicines", scope("medicines", "pharmacy", "p1")]
+    pharmacy_2 = ["medicines", scope("medicines", "pharmacy", "p2")]
+    before_1, _ = await catalog_etag(pharmacy_1)
+    before_2, _ = await catalog_etag(pharmacy_2)
+    assert before_1 != before_2
+
+    await bump_versions(scope("medicines", "pharmacy", "p1"))
+
+    assert (await catalog_etag(pharmacy_1))[0] != before_1
+    assert (await catalog_etag(pharmacy_2))[0] == before_2
+
+
+async def test_bumps_count_up_under_one_epoch(versions):
+    await bump_versions("pharmacies")
+    first = await versions.collection_versions.find_one({"_id": "pharmacies"})
+    await bump_versions("pharmacies")
+    second = await versions.collection_versions.find_one({"_id": "pharmacies"})
+    assert (first["version"], second["version"]) == (1, 2)
+    assert first["epoch"] == second["epoch"]
+
+
+async def test_a_matching_etag_answers_304_without_loading(versions):
+    loads = []
+
+    async def load(session):
+        loads.append(session)
+        return [{"id": "m1"}]
+
+    first = await catalog_response(_request(), ["medicines"], load)
+    assert first.status_code == 200 and first.body == b'[{"id":"m1"}]'
+    tag = first.headers["etag"]
+
+    for if_none_match in (tag, tag[2:], f'"other", {tag}', "*"):
+        response = await catalog_response(_request(if_none_match=if_none_match), ["medicines"], load)
+        assert response.status_code == 304 and response.headers["etag"] == tag
+    assert len(loads) == 1
+
+    await bump_versions("medicines")
+    changed = await catalog_response(_request(if_none_match=tag), ["medicines"], load)
+    assert changed.status_code == 200 and changed.headers["etag"] != tag
+    assert len(loads) == 2
+
+
+async def test_the_load_session_is_advanced_past_the_version_read(versions):
+    loaded_with = []
+
+    async def load(session):
+        loaded_with.append(session)
+        return []
+
+    await catalog_response(_request(), ["pharmacies"], load)
+
+    version_read, data_read = etag.client.sessions
+    assert loaded_with == [data_read]
+    assert data_read.advanced == [
+        ("cluster", version_read.cluster_time),
+        ("operation", version_read.operation_time),
+    ]
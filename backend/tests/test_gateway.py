@@ -0,0 +1,78 @@
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+
+from packages.context import gateway
+from packages.context.gateway import CircuitBreaker, GatewayUnavailable, RazorpayClient
+from packages.iife import razorpay_stub
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    """The stub gateway served over real HTTP, so client timeouts apply."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(razorpay_stub.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+async def client(stub_url, monkeypatch):
+    monkeypatch.setattr(gateway, "GATEWAY_BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(gateway, "GATEWAY_TIMEOUT_SECONDS", 0.2)
+    monkeypatch.setattr(razorpay_stub, "stats", {"requests": 0})
+    rzp = RazorpayClient("rzp_test", "secret", base_url=stub_url)
+    yield rzp
+    await rzp.close()
+
+
+async def test_retries_rejected_requests_until_the_gateway_recovers(client, monkeypatch):
+    monkeypatch.setattr(razorpay_stub, "STUB_FAIL_FIRST", gateway.GATEWAY_MAX_RETRIES)
+    order = await client.create_order({"amount": 1000, "currency": "INR"})
+    assert order["status"] == "created"
+    assert razorpay_stub.stats["requests"] == gateway.GATEWAY_MAX_RETRIES + 1
+    assert client.breaker.state == "closed"
+
+
+async def test_open_breaker_fails_fast_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(razorpay_stub, "STUB_FAILURE_RATE", 1.0)
+    client.breaker = CircuitBreaker(threshold=2, reset_seconds=30)
+    for _ in range(2):
+        with pytest.raises(GatewayUnavailable):
+            await client.fetch_order("order_x")
+    sent = razorpay_stub.stats["requests"]
+
+    with pytest.raises(GatewayUnavailable) as excinfo:
+        await client.fetch_order("order_x")
+    assert razorpay_stub.stats["requests"] == sent
+    assert client.breaker.state == "open"
+    assert 29 < excinfo.value.retry_after <= 30
+
+
+async def test_read_timeout_on_create_is_not_retried(client, monkeypatch):
+    monkeypatch.setattr(razorpay_stub, "STUB_LATENCY_MS", 500)
+    started = time.monotonic()
+    with pytest.raises(GatewayUnavailable, match="ReadTimeout"):
+        await client.create_order({"amount": 1000})
+    assert time.monotonic() - started < 0.5
+    # The gateway may have created the order, so a POST is never sent twice
+    assert razorpay_stub.stats["requests"] == 1
+
+
+async def test_read_timeout_on_fetch_is_retried(client, monkeypatch):
+    monkeypatch.setattr(razorpay_stub, "STUB_LATENCY_MS", 500)
+    with pytest.raises(GatewayUnavailable, match="ReadTimeout"):
+        await client.fetch_order("order_x")
+    assert razorpay_stub.stats["requests"] == gateway.GATEWAY_MAX_RETRIES + 1
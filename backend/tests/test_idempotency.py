@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from packages.context.security import create_access_token
+from packages.middleware import idempotency
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def client(mock_db):
+    db = mock_db(idempotency)
+    app = FastAPI()
+    calls = []
+
+    @app.post("/api/orders")
+    async def create_order():
+        calls.append(1)
+        return {"order": len(calls)}
+
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+    token = create_access_token({"sub": "alice"})
+    http = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test",
+        headers={"Authorization": f"Bearer {token}", "Idempotency-Key": "k1"},
+    )
+    return http, db, calls
+
+
+async def test_retry_replays_the_first_response(client):
+    http, _, calls = client
+    first = await http.post("/api/orders")
+    second = await http.post("/api/orders", headers={"Authorization": f"Bearer {create_access_token({'sub': 'alice'})}"})
+    assert second.json() == first.json() == {"order": 1}
+    assert second.headers["idempotent-replayed"] == "true"
+    assert len(calls) == 1
+
+
+async def test_retry_takes_over_a_key_left_locked_by_a_crashed_request(client):
+    http, db, calls = client
+    await db.idempotency_keys.insert_one({
+        "_id": "alice:k1", "fingerprint": "stale", "state": "in_progress", "owner": "dead",
+        "created_at": datetime.utcnow(), "locked_until": datetime.utcnow() + timedelta(seconds=30),
+    })
+    assert (await http.post("/api/orders")).status_code == 409
+
+    await db.idempotency_keys.update_one({"_id": "alice:k1"}, {"$set": {"locked_until": datetime.utcnow()}})
+    response = await http.post("/api/orders")
+    assert response.status_code == 200 and len(calls) == 1
+    assert (await db.idempotency_keys.find_one({"_id": "alice:k1"}))["state"] == "completed"
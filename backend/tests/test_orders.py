@@ -0,0 +1,93 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from packages.context import outbox, security
+from packages.context.security import create_access_token
+from packages.routes import admin, orders
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(mock_db, monkeypatch):
+    db = mock_db(orders, outbox, security, admin)
+    monkeypatch.setattr(outbox, "OUTBOX_TRANSACTIONS", "off")
+    monkeypatch.setattr(security, "ADMIN_USERNAMES", {"root"})
+    monkeypatch.setattr(orders, "ADMIN_USERNAMES", {"root"})
+    await db.users.insert_many([
+        {"id": "u1", "username": "customer"},
+        {"id": "u2", "username": "staff", "pharmacy_ids": ["p1"]},
+        {"id": "u3", "username": "root"},
+    ])
+    await db.pharmacies.insert_many([{"id": "p1"}, {"id": "p2"}])
+    await db.orders.insert_many([
+        {"id": "o1", "user_id": "u1", "pharmacy_id": "p1", "status": "placed"},
+        {"id": "o2", "user_id": "u1", "pharmacy_id": "p2", "status": "placed"},
+    ])
+    app = FastAPI()
+    app.include_router(orders.router)
+    app.include_router(admin.router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+        yield http, db
+
+
+def _auth(username):
+    return {"Authorization": f"Bearer {create_access_token({'sub': username})}"}
+
+
+async def test_bulk_status_update_is_limited_to_the_callers_pharmacies(client):
+    http, db = client
+    body = {"updates": [{"order_id": "o1", "status": "confirmed"}, {"order_id": "o2", "status": "confirmed"}]}
+
+    assert (await http.post("/orders/status/bulk", json=body, headers=_auth("customer"))).status_code == 403
+
+    response = await http.post("/orders/status/bulk", json=body, headers=_auth("staff"))
+    results = {r["order_id"]: r for r in response.json()["results"]}
+    assert results["o1"]["ok"] and results["o2"] == {"order_id": "o2", "ok": False, "error": "Forbidden"}
+    assert (await db.orders.find_one({"id": "o2"}))["status"] == "placed"
+    assert await db.outbox.count_documents({"payload.order_id": "o1"}) == 1
+
+
+async def test_single_status_update_follows_the_bulk_rules(client):
+    http, db = client
+
+    async def put(order_id, status, username):
+        return await http.put(f"/orders/{order_id}/status", params={"status": status}, headers=_auth(username))
+
+    assert (await put("o1", "confirmed", "customer")).status_code == 403
+    assert (await put("o2", "confirmed", "staff")).status_code == 403
+    invalid = await put("o1", "delivered", "staff")
+    assert invalid.status_code == 400 and invalid.json()["detail"] == "Cannot change status from placed to delivered"
+    assert (await db.orders.find_one({"id": "o1"}))["status"] == "placed"
+
+    assert (await put("o1", "confirmed", "staff")).status_code == 200
+    assert (await put("o2", "confirmed", "root")).status_code == 200
+    assert await db.outbox.count_documents({}) == 2
+
+
+async def test_admins_provision_pharmacy_staff(client):
+    http, db = client
+    url = "/admin/users/u1/pharmacies"
+
+    assert (await http.put(url, json={"pharmacy_ids": ["p2"]}, headers=_auth("staff"))).status_code == 403
+    assert (await http.put(url, json={"pharmacy_ids": ["p9"]}, headers=_auth("root"))).status_code == 400
+    assert (await http.put("/admin/users/nobody/pharmacies", json={"pharmacy_ids": []},
+                           headers=_auth("root"))).status_code == 404
+
+    response = await http.put(url, json={"pharmacy_ids": ["p2", "p2"]}, headers=_auth("root"))
+    assert response.json() == {"user_id": "u1", "pharmacy_ids": ["p2"]}
+    moved = await http.put("/orders/o2/status", params={"status": "confirmed"}, headers=_auth("customer"))
+    assert moved.status_code == 200
+
+
+async def test_each_order_event_takes_the_next_seq_of_its_order(client):
+    http, db = client
+    for status in ("confirmed", "preparing"):
+        await http.put("/orders/o1/status", params={"status": status}, headers=_auth("staff"))
+    body = {"updates": [{"order_id": "o1", "status": "out_for_delivery"}]}
+    await http.post("/orders/status/bulk", json=body, headers=_auth("staff"))
+
+    rows = await db.outbox.find({"payload.order_id": "o1"}).sort("_id", 1).to_list(None)
+    assert [r["payload"]["fields"]["seq"] for r in rows] == [1, 2, 3]
+    assert (await db.orders.find_one({"id": "o1"}))["event_seq"] == 3
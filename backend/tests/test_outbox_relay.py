@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from packages.context import order_events as order_events_module
+from packages.context.order_events import order_events
+from packages.context.outbox import enqueue, order_event
+from packages.context import outbox
+from packages.cron import outbox_relay
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def frames(mock_db, monkeypatch):
+    mock_db(outbox, outbox_relay, interleave=True)
+    monkeypatch.setattr(order_events, "window", 0)
+    sent = []
+
+    async def emit(event, data, room=None):
+        sent.append((room, data))
+
+    monkeypatch.setattr(order_events_module, "emit", emit)
+    return sent
+
+
+async def test_coalesced_events_carry_the_latest_seq(frames):
+    await enqueue(
+        order_event("u1", "o1", "order_status_updated", seq=3, status="confirmed"),
+        order_event("u1", "o1", "order_status_updated", seq=2, status="placed"),
+    )
+
+    assert await outbox_relay.process_batch() == 2
+
+    [(room, data)] = frames
+    assert room == "user_u1" and data["orders"][0]["seq"] == 3
+    assert [r["status"] for r in await outbox_relay.db.outbox.find({}).to_list(None)] == ["delivered"] * 2
+
+
+async def test_rows_stay_pending_when_the_emit_fails(frames, monkeypatch):
+    async def failing_emit(event, data, room=None):
+        raise ConnectionError("socket.io down")
+
+    monkeypatch.setattr(order_events_module, "emit", failing_emit)
+    await enqueue(
+        order_event("u1", "o1", "order_created", seq=1, status="placed"),
+        order_event("u1", "o1", "order_status_updated", seq=2, status="confirmed"),
+    )
+
+    assert await outbox_relay.process_batch() == 2
+    rows = await outbox_relay.db.outbox.find({}).to_list(None)
+    assert [(r["status"], r["attempts"]) for r in rows] == [("pending", 1), ("pending", 1)]
+    assert "socket.io down" in rows[0]["last_error"]
+
+
+async def test_concurrent_relays_deliver_each_row_once(frames, monkeypatch):
+    published = []
+
+    async def publish(row):
+        published.append(row["_id"])
+
+    monkeypatch.setitem(outbox_relay.OUTBOX_HANDLERS, "order_event", publish)
+    monkeypatch.setattr(outbox_relay, "OUTBOX_BATCH_SIZE", 3)
+    await enqueue(*(order_event("u1", f"o{i}", "order_created", seq=1, status="placed") for i in range(10)))
+
+    while sum(await asyncio.gather(outbox_relay.process_batch(), outbox_relay.process_batch())):
+        pass
+
+    assert len(published) == len(set(published)) == 10
+    rows = await outbox_relay.db.outbox.find({}).to_list(None)
+    assert {r["status"] for r in rows} == {"delivered"}
+
+
+async def test_rows_of_a_worker_that_died_are_claimed_again(frames):
+    await enqueue(order_event("u1", "o1", "order_created", seq=1, status="placed"))
+    await outbox_relay.db.outbox.update_one({}, {"$set": {
+        "status": "relaying", "owner": "dead-worker", "lease_until": datetime.utcnow() + timedelta(seconds=30),
+    }})
+    assert await outbox_relay.process_batch() == 0
+
+    await outbox_relay.db.outbox.update_one({}, {"$set": {"lease_until": datetime.utcnow()}})
+    assert await outbox_relay.process_batch() == 1
+    assert len(frames) == 1
+    assert (await outbox_relay.db.outbox.find_one({}))["status"] == "delivered"
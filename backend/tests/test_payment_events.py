@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+from packages.context import outbox
+from packages.cron import payment_events
+
+pytestmark = pytest.mark.anyio
+
+
+def _captured(event_id, razorpay_order_id):
+    return {
+        "_id": event_id,
+        "event": "payment.captured",
+        "payload": {"payment": {"entity": {"id": f"pay_{event_id}", "order_id": razorpay_order_id}}},
+        "status": "pending",
+        "received_at": datetime.utcnow(),
+    }
+
+
+@pytest.fixture
+def db(mock_db, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_TRANSACTIONS", "off")
+    return mock_db(payment_events, outbox)
+
+
+async def test_a_bad_event_is_failed_without_blocking_the_batch(db):
+    await db.orders.insert_one({"id": "o1", "user_id": "u1", "razorpay_order_id": "rzp_1", "payment_status": "pending"})
+    bad = _captured("evt_bad", "rzp_2")
+    del bad["event"]
+    await db.payment_events.insert_many([bad, _captured("evt_ok", "rzp_1")])
+
+    assert await payment_events.process_batch() == 2
+
+    failed = await db.payment_events.find_one({"_id": "evt_bad"})
+    assert failed["status"] == "failed" and "KeyError" in failed["error"]
+    assert "processed_at" not in failed  # kept out of the retention TTL
+    assert (await db.payment_events.find_one({"_id": "evt_ok"}))["status"] == "processed"
+    assert (await db.orders.find_one({"id": "o1"}))["payment_status"] == "completed"
+    assert await payment_events.process_batch() == 0
+
+
+async def test_only_orders_the_batch_changed_are_announced(db):
+    await db.orders.insert_many([
+        {"id": "o1", "user_id": "u1", "razorpay_order_id": "rzp_1", "payment_status": "pending"},
+        {"id": "o2", "user_id": "u2", "razorpay_order_id": "rzp_2", "payment_status": "completed"},
+    ])
+    await db.payment_events.insert_many([_captured("evt_1", "rzp_1"), _captured("evt_2", "rzp_2")])
+
+    await payment_events.process_batch()
+
+    rows = await db.outbox.find({}).to_list(None)
+    assert [r["payload"] for r in rows] == [{
+        "user_id": "u1", "order_id": "o1", "event": "payment_status_updated",
+        "fields": {"seq": 1, "payment_status": "completed"},
+    }]
+
+
+async def test_a_transient_error_leaves_the_event_pending(db, monkeypatch):
+    await db.orders.insert_one({"id": "o1", "user_id": "u1", "razorpay_order_id": "rzp_1", "payment_status": "pending"})
+    await db.payment_events.insert_one(_captured("evt_1", "rzp_1"))
+    apply = payment_events._apply
+
+    async def flaky(updates):
+        raise AutoReconnect("primary stepped down")
+
+    monkeypatch.setattr(payment_events, "_apply", flaky)
+    assert await payment_events.process_batch() == 1
+
+    event = await db.payment_events.find_one({"_id": "evt_1"})
+    assert event["status"] == "pending" and event["attempts"] == 1
+    assert event["next_attempt_at"] > datetime.utcnow()
+    assert await payment_events.process_batch() == 0  # backing off
+
+    monkeypatch.setattr(payment_events, "_apply", apply)
+    await db.payment_events.update_one({"_id": "evt_1"}, {"$set": {"next_attempt_at": datetime.utcnow()}})
+    assert await payment_events.process_batch() == 1
+    assert (await db.payment_events.find_one({"_id": "evt_1"}))["status"] == "processed"
+    assert (await db.orders.find_one({"id": "o1"}))["payment_status"] == "completed"
@@ -0,0 +1,77 @@
+import pytest
+
+from packages.context import rate_limit
+from packages.context.rate_limit import MemoryBackend, MongoBackend, RateLimit
+
+pytestmark = pytest.mark.anyio
+
+# Two requests at once, refilling one every two seconds
+LIMIT = RateLimit.parse("2/4s")
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def test_parse():
+    assert RateLimit.parse("10/minute") == RateLimit(rate_per_second=10 / 60, burst=10)
+    assert RateLimit.parse(" 5 / 2 h ", key="user") == RateLimit(rate_per_second=5 / 7200, burst=5, key="user")
+
+
+@pytest.mark.parametrize("spec", ["0/minute", "5/0minute", "ten/minute", "5/fortnight"])
+def test_parse_rejects_unusable_limits(spec):
+    with pytest.raises(ValueError):
+        RateLimit.parse(spec)
+
+
+def test_retry_after_waits_for_the_next_whole_token():
+    assert LIMIT.retry_after(0) == 2
+    assert LIMIT.retry_after(0.75) == 1
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def backend(request, mock_db):
+    if request.param == "memory":
+        return MemoryBackend(max_keys=10)
+    mock_db(rate_limit)
+    return MongoBackend()
+
+
+async def test_bucket_debits_then_refills(backend, clock):
+    assert await backend.take("k", LIMIT) == (True, 1)
+    assert await backend.take("k", LIMIT) == (True, 0)
+    assert await backend.take("k", LIMIT) == (False, 0)
+
+    clock.now += 1
+    assert await backend.take("k", LIMIT) == (False, 0.5)
+    clock.now += 1
+    assert await backend.take("k", LIMIT) == (True, 0)
+
+    # Refills stop at the burst
+    clock.now += 60
+    assert await backend.take("k", LIMIT) == (True, 1)
+    assert await backend.take("other", LIMIT) == (True, 1)
+
+
+async def test_memory_backend_forgets_the_oldest_bucket(clock):
+    backend = MemoryBackend(max_keys=2)
+    for key in ("a", "b", "c"):
+        await backend.take(key, LIMIT)
+        await backend.take(key, LIMIT)
+    # "a" was evicted, so it starts full again
+    assert await backend.take("a", LIMIT) == (True, 1)
+    assert await backend.take("c", LIMIT) == (False, 0)
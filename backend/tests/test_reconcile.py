@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+import csv
+
+import pytest
+
+from packages.cron import reconcile
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_only_one_worker_holds_the_schedule_lease(mock_db, monkeypatch):
+    mock_db(reconcile)
+    monkeypatch.setattr(reconcile, "RECONCILE_INTERVAL_MINUTES", 60)
+    holder = reconcile._HOLDER
+    assert await reconcile._acquire_lease()
+
+    monkeypatch.setattr(reconcile, "_HOLDER", "other-worker")
+    assert not await reconcile._acquire_lease()
+
+    # Released, but the last run started less than an interval ago
+    monkeypatch.setattr(reconcile, "_HOLDER", holder)
+    await reconcile._release_lease()
+    assert not await reconcile._acquire_lease()
+
+    monkeypatch.setattr(reconcile, "RECONCILE_INTERVAL_MINUTES", 0)
+    assert await reconcile._acquire_lease()
+
+
+def _write_csv(path, rows, columns=("order_id", "payment_id", "amount", "status", "notes")):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows({c: row.get(c, "") for c in columns} for row in rows)
+    return path
+
+
+def test_settlement_rows_are_sorted_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(reconcile, "RECONCILE_SORT_CHUNK_ROWS", 2)
+    ids = ["rzp_e", "rzp_b", "", "rzp_d", "rzp_a", "rzp_c"]
+    path = _write_csv(tmp_path / "s.csv", [{"order_id": i, "amount": "1", "status": "captured"} for i in ids])
+
+    rows = list(reconcile._sorted_settlement_rows(path))
+
+    assert [r["order_id"] for r in rows] == ["rzp_a", "rzp_b", "rzp_c", "rzp_d", "rzp_e"]
+    assert set(rows[0]) == set(reconcile.SETTLEMENT_COLUMNS)
+
+
+def test_settlement_file_without_required_columns_is_rejected(tmp_path):
+    path = _write_csv(tmp_path / "s.csv", [], columns=("order_id", "amount"))
+    with pytest.raises(ValueError, match="payment_id, status"):
+        list(reconcile._sorted_settlement_rows(path))
+
+
+def test_the_highest_ranked_attempt_decides_an_order():
+    rows = [
+        {"order_id": "rzp_a", "status": "failed"},
+        {"order_id": "rzp_a", "status": "captured"},
+        {"order_id": "rzp_a", "status": "authorized"},
+        {"order_id": "rzp_b", "status": "failed"},
+    ]
+    assert [(k, r["status"]) for k, r in reconcile._gateway_orders(iter(rows))] == [
+        ("rzp_a", "captured"), ("rzp_b", "failed"),
+    ]
+
+
+@pytest.fixture
+async def ledger(mock_db, monkeypatch, tmp_path):
+    db = mock_db(reconcile)
+    # Small chunks and batches so the merge and the batched fixes see several of each
+    monkeypatch.setattr(reconcile, "RECONCILE_SORT_CHUNK_ROWS", 2)
+    monkeypatch.setattr(reconcile, "RECONCILE_BATCH_SIZE", 1)
+    long_ago = datetime.utcnow() - timedelta(minutes=reconcile.RECONCILE_STUCK_AFTER_MINUTES + 5)
+
+    transactions = [
+        ("rzp_a", "success", 100),    # matches
+        ("rzp_b", "initiated", 200),  # captured at the gateway
+        ("rzp_c", "success", 300),    # gateway settled a different amount
+        ("rzp_d", "success", 400),    # unknown to the gateway
+        ("rzp_f", "success", 600),    # gateway says failed; not overridden
+        ("rzp_g", "initiated", 700),  # failed at the gateway
+        ("rzp_h", "initiated", 800),  # abandoned before paying; not reported
+    ]
+    await db.transactions.insert_many([
+        {"id": f"t_{k}", "order_id": f"o_{k}", "razorpay_order_id": k, "status": s, "amount": a}
+        for k, s, a in transactions
+    ])
+    await db.orders.insert_many([
+        {"id": f"o_{k}", "payment_status": "completed" if s == "success" else "pending",
+         "payment_method": "razorpay", "created_at": datetime.utcnow()}
+        for k, s, _ in transactions
+    ] + [
+        {"id": "o_stuck", "razorpay_order_id": "rzp_s", "payment_status": "pending",
+         "payment_method": "razorpay", "total_amount": 50, "created_at": long_ago},
+        {"id": "o_cod", "payment_status": "pending", "payment_method": "cod", "created_at": long_ago},
+    ])
+
+    settlement = _write_csv(tmp_path / "settlement.csv", [
+        {"order_id": "rzp_g", "payment_id": "pay_g", "amount": "700", "status": "failed"},
+        {"order_id": "rzp_e", "payment_id": "pay_e", "amount": "500", "status": "captured"},
+        {"order_id": "rzp_c", "payment_id": "pay_c", "amount": "250", "status": "captured"},
+        {"order_id": "rzp_b", "payment_id": "pay_b1", "amount": "200", "status": "failed"},
+        {"order_id": "rzp_a", "payment_id": "pay_a", "amount": "100.00", "status": "captured"},
+        {"order_id": "rzp_f", "payment_id": "pay_f", "amount": "600", "status": "failed"},
+        {"order_id": "rzp_b", "payment_id": "pay_b2", "amount": "200", "status": "captured"},
+    ])
+    return db, settlement
+
+
+def _report(path):
+    with open(path, newline="") as f:
+        return sorted((r["kind"], r["razorpay_order_id"], r["order_id"], r["fixed"]) for r in csv.DictReader(f))
+
+
+async def test_reconcile_reports_every_discrepancy_kind(ledger, tmp_path):
+    db, settlement = ledger
+    report = tmp_path / "report.csv"
+
+    stats = await reconcile.reconcile(settlement, report)
+
+    assert _report(report) == [
+        ("amount_mismatch", "rzp_c", "o_rzp_c", "False"),
+        ("missing_in_db", "rzp_e", "", "False"),
+        ("missing_in_gateway", "rzp_d", "o_rzp_d", "False"),
+        ("status_mismatch", "rzp_b", "o_rzp_b", "False"),
+        ("status_mismatch", "rzp_f", "o_rzp_f", "False"),
+        ("status_mismatch", "rzp_g", "o_rzp_g", "False"),
+        ("stuck_pending", "rzp_s", "o_stuck", "False"),
+    ]
+    assert stats["transactions"] == 7 and stats["gateway_orders"] == 6 and stats["fixed"] == 0
+    assert (await db.transactions.find_one({"id": "t_rzp_b"}))["status"] == "initiated"
+
+
+async def test_reconcile_fix_corrects_only_authoritative_statuses(ledger, tmp_path):
+    db, settlement = ledger
+    report = tmp_path / "report.csv"
+
+    stats = await reconcile.reconcile(settlement, report, fix=True)
+
+    fixed = {(kind, key) for kind, key, _, was_fixed in _report(report) if was_fixed == "True"}
+    assert fixed == {("status_mismatch", "rzp_b"), ("status_mismatch", "rzp_g")}
+    assert stats["fixed"] == 2
+
+    captured = await db.transactions.find_one({"id": "t_rzp_b"})
+    assert captured["status"] == "success" and captured["razorpay_payment_id"] == "pay_b2"
+    assert (await db.orders.find_one({"id": "o_rzp_b"}))["payment_status"] == "completed"
+    assert (await db.transactions.find_one({"id": "t_rzp_g"}))["status"] == "failed"
+    assert (await db.orders.find_one({"id": "o_rzp_g"}))["payment_status"] == "failed"
+    # A gateway failure never overrides a recorded success
+    assert (await db.transactions.find_one({"id": "t_rzp_f"}))["status"] == "success"
+    assert (await db.orders.find_one({"id": "o_rzp_f"}))["payment_status"] == "completed"
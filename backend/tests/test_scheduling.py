@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from packages.context import scheduling
+from packages.context.scheduling import (
+    SlotUnavailable, StatusConflict, book, change_status, next_free_slots, release, slots_for,
+)
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2030, 1, 7, 10, 0)
+
+
+@pytest.fixture
+async def calendars(mock_db):
+    db = mock_db(scheduling, interleave=True)
+    await db.slot_calendars.create_index([("resource", 1), ("day", 1)], unique=True)
+    return db
+
+
+async def test_concurrent_bookings_of_one_slot_have_one_winner(calendars):
+    outcomes = await asyncio.gather(
+        *(book("doctor:a", START, 30) for _ in range(50)), return_exceptions=True
+    )
+    assert sum(o is None for o in outcomes) == 1
+    assert all(isinstance(o, SlotUnavailable) for o in outcomes if o is not None)
+    calendar = await calendars.slot_calendars.find_one({"resource": "doctor:a"})
+    assert sorted(calendar["booked"]) == slots_for(START, 30)[1]
+
+
+async def test_concurrent_bookings_of_disjoint_slots_all_win(calendars):
+    starts = [START + timedelta(minutes=30 * i) for i in range(8)]
+    outcomes = await asyncio.gather(*(book("doctor:a", s, 30) for s in starts), return_exceptions=True)
+    assert outcomes == [None] * 8
+    assert await next_free_slots("doctor:a", START, 30, count=1) == [START + timedelta(hours=4)]
+
+
+async def test_release_frees_the_slots_an_aware_booking_took(calendars):
+    ist = timezone(timedelta(hours=5, minutes=30))
+    await book("lab:x", datetime(2030, 1, 7, 15, 30, tzinfo=ist), 30)  # 10:00 UTC
+    # Mongo hands the stored value back as naive UTC
+    await release("lab:x", START, 30)
+    await book("lab:x", START, 30)
+
+
+async def test_throughput_under_contention(calendars):
+    """Rough booking rate with many clients racing for a few slots."""
+    starts = [START + timedelta(minutes=15 * (i % 16)) for i in range(400)]
+    began = asyncio.get_running_loop().time()
+    outcomes = await asyncio.gather(*(book("doctor:b", s, 15) for s in starts), return_exceptions=True)
+    elapsed = asyncio.get_running_loop().time() - began
+    assert sum(o is None for o in outcomes) == 16
+    print(f"{len(starts) / elapsed:.0f} booking attempts/s against mongomock")
+
+
+async def _appointment(db, **fields):
+    appointment = {"id": "c1", "status": "scheduled", "scheduled_date": START, "duration_minutes": 30, **fields}
+    await db.consultations.insert_one(dict(appointment))
+    return appointment
+
+
+async def test_concurrent_cancels_release_once(calendars):
+    await book("doctor:a", START, 30)
+    appointment = await _appointment(calendars, slots_reserved=True)
+
+    async def cancel_then_rebook():
+        await change_status(calendars.consultations, appointment, "doctor:a", "cancelled", {})
+        await book("doctor:a", START, 30)
+
+    outcomes = await asyncio.gather(
+        cancel_then_rebook(),
+        change_status(calendars.consultations, appointment, "doctor:a", "cancelled", {}),
+        return_exceptions=True,
+    )
+
+    assert sum(isinstance(o, StatusConflict) for o in outcomes) == 1
+    assert any(o is None for o in outcomes)
+    # The losing cancel must not have freed the new booking
+    with pytest.raises(SlotUnavailable):
+        await book("doctor:a", START, 30)
+
+
+async def test_cancelling_an_unreserved_appointment_keeps_other_bookings(calendars):
+    await book("doctor:a", START, 30)  # someone else's booking
+    appointment = await _appointment(calendars)  # booked before slots were tracked
+
+    await change_status(calendars.consultations, appointment, "doctor:a", "cancelled", {})
+
+    with pytest.raises(SlotUnavailable):
+        await book("doctor:a", START, 30)
+
+
+async def test_concurrent_revivals_book_once(calendars):
+    appointment = await _appointment(calendars, status="cancelled", slots_reserved=False)
+
+    outcomes = await asyncio.gather(
+        *(change_status(calendars.consultations, appointment, "doctor:a", "scheduled", {}) for _ in range(2)),
+        return_exceptions=True,
+    )
+
+    assert sum(o is None for o in outcomes) == 1
+    assert all(isinstance(o, (SlotUnavailable, StatusConflict)) for o in outcomes if o is not None)
+    calendar = await calendars.slot_calendars.find_one({"resource": "doctor:a"})
+    assert sorted(calendar["booked"]) == slots_for(START, 30)[1]
+    assert (await calendars.consultations.find_one({"id": "c1"}))["slots_reserved"] is True
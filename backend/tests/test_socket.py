@@ -0,0 +1,57 @@
+import pytest
+
+from packages.context import socket
+from packages.context.presence import PresenceRegistry, USER
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def server(mock_db, monkeypatch):
+    db = mock_db(socket)
+    registry = PresenceRegistry()
+    monkeypatch.setattr(socket, "presence", registry)
+    sent, connected = [], {"sid1"}
+
+    async def emit(event, data, room=None, to=None):
+        sent.append((to or room, event, data))
+
+    monkeypatch.setattr(socket.sio, "emit", emit)
+    monkeypatch.setattr(socket.sio.manager, "is_connected", lambda sid, namespace: sid in connected)
+    return db, registry, sent, connected
+
+
+async def test_emits_to_an_offline_user_are_deferred_until_after_connect(server):
+    db, registry, sent, _ = server
+    await socket.emit("order_updates", {"n": 1}, room="user_u1")
+    await socket.emit("order_updates", {"n": 2}, room="user_u1")
+    assert sent == [] and await db.deferred_notifications.count_documents({}) == 2
+
+    await socket._come_online("sid1", "u1")
+
+    assert sent == [("sid1", "order_updates", {"n": 1}), ("sid1", "order_updates", {"n": 2})]
+    assert await db.deferred_notifications.count_documents({}) == 0
+    assert registry.is_online(USER, "u1")
+
+    await socket.emit("order_updates", {"n": 3}, room="user_u1")
+    assert sent[-1] == ("user_u1", "order_updates", {"n": 3})
+
+
+async def test_a_socket_gone_before_its_backlog_went_out_is_not_marked_online(server):
+    db, registry, sent, connected = server
+    await socket.emit("order_updates", {"n": 1}, room="user_u1")
+    connected.clear()
+
+    await socket._come_online("sid1", "u1")
+
+    assert not registry.is_online(USER, "u1")
+
+
+async def test_nothing_is_deferred_when_presence_is_not_authoritative(server, monkeypatch):
+    db, _, sent, _ = server
+    monkeypatch.setattr(socket, "PRESENCE_AUTHORITATIVE", False)
+
+    await socket.emit("order_updates", {"n": 1}, room="user_u1")
+
+    assert sent == [("user_u1", "order_updates", {"n": 1})]
+    assert await db.deferred_notifications.count_documents({}) == 0
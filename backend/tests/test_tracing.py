@@ -0,0 +1,22 @@
+from packages.context import tracing
+from packages.context.tracing import NOOP_SPAN, end_root_span, start_root_span
+
+TRACEPARENT = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+
+
+def test_untrusted_traceparent_cannot_force_sampling(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0)
+    span, token = start_root_span("GET /", TRACEPARENT)
+    assert span is NOOP_SPAN and token is None
+
+
+def test_trusted_forced_traces_are_capped(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0)
+    monkeypatch.setattr(tracing, "_forced_budget", tracing._ForcedBudget(2))
+    spans = []
+    for _ in range(3):
+        span, token = start_root_span("GET /", TRACEPARENT, trust_sampled=True)
+        spans.append(span)
+        end_root_span(span, token)
+    assert [s is NOOP_SPAN for s in spans] == [False, False, True]
+    assert spans[0].trace.trace_id == "a" * 32